@@ -8,8 +8,15 @@ import json
 import time
 import tempfile
 import traceback
+import asyncio
+import hashlib
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict
 from datetime import datetime
-from nltk.tokenize import sent_tokenize, word_tokenize
+import numpy as np
+from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 from nltk.probability import FreqDist
 from nltk.collocations import BigramCollocationFinder, TrigramCollocationFinder
@@ -20,13 +27,12 @@ from typing import List, Dict, Tuple, Any, Optional, Union
 try:
     import nltk
     from nltk.corpus import stopwords
-    from nltk.tokenize import word_tokenize, sent_tokenize as nltk_sent_tokenize
+    from nltk.tokenize import word_tokenize
     from nltk.stem import WordNetLemmatizer, PorterStemmer
 except ImportError:
     nltk = None
     stopwords = None
     word_tokenize = None
-    nltk_sent_tokenize = None
     WordNetLemmatizer = None
     PorterStemmer = None
 
@@ -40,6 +46,71 @@ from nltk.probability import FreqDist
 from nltk.collocations import BigramCollocationFinder, TrigramCollocationFinder
 from nltk.metrics import BigramAssocMeasures, TrigramAssocMeasures
 
+from app.bm25_index import bm25_cache, rank_passages
+from app.boilerplate import (
+    REMOVE_BOILERPLATE, find_repeated_lines, get_boilerplate, stored_boilerplate, strip_page
+)
+from app.corpus_search import corpus_index, make_snippet
+from app.chunking import (
+    chunk_pages, estimate_tokens, format_chunks, get_chunks, select_spread, truncate_to_tokens
+)
+from app.doc_cache import CACHE_DIR, content_hash, text_cache, write_json_atomic
+from app.doc_metadata import stored_metadata
+from app.http_pool import get_async_client, get_client, get_session
+from app.llm_cache import llm_cache, request_key
+from app.paragraph_index import ParagraphIndex
+from app.query_cache import query_cache
+from app.singleflight import singleflight
+from app.sentence_index import (
+    build_sentence_index, get_sentence_index, sentence_pieces, split_sentences, stored_sentence_index
+)
+from app.vector_index import reciprocal_rank_fusion, vector_cache
+from app.parallel_extract import (
+    extract_fitz_range, format_page, imap_ranges, page_text, reset_pool, should_parallelize
+)
+
+# Passages the local chat answers from
+LOCAL_CHAT_PASSAGES = 5
+
+# Task prompts sent to the external LLM along with the document text
+SIMPLIFY_PROMPT = "Simplify the following text to make it more accessible and easier to understand while preserving the meaning."
+MINDMAP_PROMPT = "Create a hierarchical mindmap of the main concepts and ideas in this document. Return the result as a properly formatted JSON structure."
+
+# Set while a cached request is generated; the mock generation flags it so its output isn't cached
+_generation = contextvars.ContextVar("llm_generation", default=None)
+
+# Set while document text is sent to the LLM: (text, callable returning its sentences), so
+# the mock generation slices the document's stored sentence offsets instead of splitting the text
+_context_sentences = contextvars.ContextVar("context_sentences", default=None)
+
+# "[Page n] " markers opening each page of extracted text and chunk contexts
+_PAGE_MARKER = re.compile(r"\[Page (\d+)\] ?")
+
+
+async def _tracked(state, awaitable):
+    """Await with _generation set to state"""
+    token = _generation.set(state)
+    try:
+        return await awaitable
+    finally:
+        _generation.reset(token)
+
+try:
+    import config
+    CHAT_RETRIEVAL = config.CHAT_RETRIEVAL
+    CHAT_TOP_K = config.CHAT_TOP_K
+    CHAT_CONTEXT_TOKENS = config.CHAT_CONTEXT_TOKENS
+    LLM_CONTEXT_TOKENS = config.LLM_CONTEXT_TOKENS
+    VECTOR_SEARCH = config.VECTOR_SEARCH
+    PERSIST_LEMMAS = config.PERSIST_LEMMAS
+except (ImportError, AttributeError):
+    CHAT_RETRIEVAL = True
+    CHAT_TOP_K = 8
+    CHAT_CONTEXT_TOKENS = 3000
+    LLM_CONTEXT_TOKENS = 6000
+    VECTOR_SEARCH = True
+    PERSIST_LEMMAS = True
+
 # Download NLTK data
 try:
     nltk.data.find('tokenizers/punkt')
@@ -53,10 +124,30 @@ except LookupError:
 class AdvancedLLM:
     """Advanced LLM-like capabilities for PDF analysis"""
     
+    # Paragraph indexes kept in memory (one per recently ranked document)
+    INDEX_CACHE_SIZE = 8
+    
+    # Preprocessed token lists kept per distinct text, and word lemmas remembered
+    TOKEN_CACHE_SIZE = 20000
+    LEMMA_MEMO_SIZE = 200000
+    LEMMA_FILE = os.path.join(CACHE_DIR, "lemmas.json")
+    
     def __init__(self):
         self.stop_words = set(stopwords.words('english'))
         self.lemmatizer = WordNetLemmatizer()
         
+        # Inverted indexes keyed by a digest of the paragraphs they were built from
+        self._index_cache = OrderedDict()
+        self._index_lock = threading.Lock()
+        
+        # Token lists keyed by a digest of the text, and the word -> lemma memo
+        self._token_cache = OrderedDict()
+        self._token_lock = threading.Lock()
+        self.token_cache_hits = 0
+        self.token_cache_misses = 0
+        self._lemmas = self._load_lemmas()
+        self._lemmas_saved = len(self._lemmas)
+        
         # Knowledge graph for storing document concepts and relationships
         self.knowledge_graph = {}
         
@@ -80,92 +171,106 @@ class AdvancedLLM:
         }
         
     def preprocess(self, text):
-        """Advanced text preprocessing with lemmatization"""
+        """Advanced text preprocessing with lemmatization
+        
+        Results are cached per distinct text and lemmas per word, so
+        preprocessing the same paragraphs again costs one hash lookup.
+        """
         # Handle empty text
         if not text:
             return []
+        
+        key = hashlib.blake2b(text.encode("utf-8", "replace"), digest_size=16).digest()
+        with self._token_lock:
+            tokens = self._token_cache.get(key)
+            if tokens is not None:
+                self._token_cache.move_to_end(key)
+                self.token_cache_hits += 1
+                return list(tokens)
+            self.token_cache_misses += 1
             
         # Tokenize and lowercase
         tokens = word_tokenize(text.lower())
         
-        # Remove stopwords and punctuation
-        tokens = [t for t in tokens if t.isalnum() and t not in self.stop_words]
+        # Remove stopwords and punctuation, then lemmatize
+        tokens = tuple(self._lemmatize(t) for t in tokens if t.isalnum() and t not in self.stop_words)
         
-        # Lemmatize
-        tokens = [self.lemmatizer.lemmatize(t) for t in tokens]
-        
-        return tokens
+        with self._token_lock:
+            self._token_cache[key] = tokens
+            while len(self._token_cache) > self.TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
+        return list(tokens)
+    
+    def _lemmatize(self, token):
+        lemma = self._lemmas.get(token)
+        if lemma is None:
+            lemma = self.lemmatizer.lemmatize(token)
+            if len(self._lemmas) < self.LEMMA_MEMO_SIZE:
+                self._lemmas[token] = lemma
+        return lemma
+    
+    def _load_lemmas(self):
+        """Read the lemma memo saved by an earlier process"""
+        if not PERSIST_LEMMAS or not os.path.exists(self.LEMMA_FILE):
+            return {}
+        try:
+            with open(self.LEMMA_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable lemma memo {self.LEMMA_FILE}: {str(e)}")
+            return {}
+    
+    def save_lemmas(self):
+        """Persist the lemma memo if it has grown since it was last saved; return its size"""
+        lemmas = self._lemmas.copy()
+        if PERSIST_LEMMAS and len(lemmas) > self._lemmas_saved:
+            os.makedirs(os.path.dirname(os.path.abspath(self.LEMMA_FILE)), exist_ok=True)
+            write_json_atomic(self.LEMMA_FILE, lemmas)
+            self._lemmas_saved = len(lemmas)
+        return len(lemmas)
+    
+    def preprocess_stats(self):
+        """Return token cache counters and the lemma memo size"""
+        with self._token_lock:
+            return {
+                "cached_texts": len(self._token_cache),
+                "hits": self.token_cache_hits,
+                "misses": self.token_cache_misses,
+                "lemmas": len(self._lemmas),
+            }
         
-    def calculate_tfidf(self, document_tokens, all_documents_tokens):
-        """Calculate TF-IDF for tokens in a document"""
-        # Count frequency of each token in the document
-        doc_counter = Counter(document_tokens)
+    def build_index(self, paragraphs):
+        """Return the inverted index for a list of paragraphs, building it once per distinct list"""
+        digest = hashlib.blake2b(digest_size=16)
+        for paragraph in paragraphs:
+            digest.update(paragraph.encode("utf-8", "replace"))
+            digest.update(b"\x00")
+        key = digest.hexdigest()
         
-        # Calculate total number of documents
-        num_docs = len(all_documents_tokens)
+        with self._index_lock:
+            index = self._index_cache.get(key)
+            if index is not None:
+                self._index_cache.move_to_end(key)
+                return index
         
-        # Calculate TF-IDF for each token
-        tfidf_scores = {}
-        for token, count in doc_counter.items():
-            # Term frequency
-            tf = count / max(len(document_tokens), 1)
-            
-            # Document frequency - number of documents containing this token
-            df = sum(1 for doc in all_documents_tokens if token in doc)
-            
-            # Inverse document frequency
-            idf = math.log(num_docs / max(df, 1))
-            
-            # TF-IDF score
-            tfidf_scores[token] = tf * idf
-            
-        return tfidf_scores
+        index = ParagraphIndex([self.preprocess(p) for p in paragraphs])
         
-    def rank_paragraphs(self, query_tokens, paragraphs):
-        """Rank paragraphs by relevance to query using TF-IDF and semantic scoring"""
-        # Preprocess all paragraphs
-        processed_paragraphs = [self.preprocess(p) for p in paragraphs]
+        with self._index_lock:
+            self._index_cache[key] = index
+            while len(self._index_cache) > self.INDEX_CACHE_SIZE:
+                self._index_cache.popitem(last=False)
+        return index
         
-        # Calculate TF-IDF for each paragraph
-        tfidf_scores = [self.calculate_tfidf(tokens, processed_paragraphs) 
-                        for tokens in processed_paragraphs]
+    def rank_paragraphs(self, query_tokens, paragraphs, index=None):
+        """Rank paragraphs by relevance to query using TF-IDF and semantic scoring
         
-        # Calculate query TF-IDF 
-        query_tfidf = Counter({t: 1 for t in query_tokens})
+        Returns one score per paragraph, computed with sparse-matrix operations
+        over the postings of the query terms; other paragraphs score 0.
+        """
+        if index is None:
+            index = self.build_index(paragraphs)
         
-        # Score each paragraph
-        paragraph_scores = []
-        for i, para_tokens in enumerate(processed_paragraphs):
-            # Skip empty paragraphs
-            if not para_tokens:
-                paragraph_scores.append(0)
-                continue
-                
-            # TF-IDF similarity
-            tfidf_sim = 0
-            para_tfidf = tfidf_scores[i]
-            for token in query_tokens:
-                if token in para_tfidf:
-                    tfidf_sim += para_tfidf[token] * query_tfidf[token]
-            
-            # Jaccard similarity
-            query_set = set(query_tokens)
-            para_set = set(para_tokens)
-            jaccard = len(query_set.intersection(para_set)) / len(query_set.union(para_set)) if para_set else 0
-            
-            # Exact phrase matching boost
-            exact_match_boost = 0
-            query_bigrams = [' '.join(query_tokens[i:i+2]) for i in range(len(query_tokens)-1)]
-            para_text = ' '.join(para_tokens)
-            for bigram in query_bigrams:
-                if bigram in para_text:
-                    exact_match_boost += 0.2
-            
-            # Combine scores with weights
-            combined_score = (0.6 * tfidf_sim) + (0.3 * jaccard) + (0.1 * exact_match_boost)
-            paragraph_scores.append(combined_score)
-            
-        return paragraph_scores
+        return index.score_array(list(query_tokens)).tolist()
         
     def extract_entities(self, text):
         """Extract named entities and key terms from text"""
@@ -185,8 +290,14 @@ class AdvancedLLM:
         
         return list(set(entities))
         
-    def generate_answer(self, query, context_paragraphs, pdf_structure=None):
-        """Generate an answer based on the query and context"""
+    def generate_answer(self, query, context_paragraphs, pdf_structure=None, paragraph_sentences=None):
+        """Generate an answer based on the query and context
+        
+        paragraph_sentences, one list per context paragraph, are the
+        paragraphs' sentences when they were sliced from the document's
+        stored offsets; otherwise the paragraphs are split here.
+        """
+        paragraph_sentences = self._paragraph_sentences(context_paragraphs, paragraph_sentences)
         # Extract query intent and keywords
         query_tokens = self.preprocess(query)
         query_type = self.classify_query(query)
@@ -204,22 +315,22 @@ class AdvancedLLM:
         # For definition queries, try to extract a definition
         if query_type == "definition" and query_entities:
             target_term = query_entities[0]
-            definition = self.extract_definition(target_term, context_paragraphs)
+            definition = self.extract_definition(target_term, context_paragraphs, paragraph_sentences)
             if definition:
                 template = np.random.choice(self.response_templates["definition"])
                 return template.format(term=target_term, definition=definition)
         
         # For explanation queries, combine relevant information
         if query_type in ["explanation", "why", "how"]:
-            explanation = self.extract_explanation(query_entities, context_paragraphs)
+            explanation = self.extract_explanation(query_entities, context_paragraphs, paragraph_sentences)
             if explanation:
                 template = np.random.choice(self.response_templates["explanation"])
                 return template.format(explanation=explanation)
         
         # For general queries, use a more sophisticated approach
         sentences = []
-        for paragraph in context_paragraphs[:3]:  # Use top 3 paragraphs
-            sentences.extend(sent_tokenize(paragraph))
+        for paragraph in paragraph_sentences[:3]:  # Use top 3 paragraphs
+            sentences.extend(paragraph)
         
         # Score sentences by relevance to query
         sentence_scores = self.rank_paragraphs(query_tokens, sentences)
@@ -263,7 +374,13 @@ class AdvancedLLM:
                 
         return "general"
     
-    def extract_definition(self, term, paragraphs):
+    def _paragraph_sentences(self, paragraphs, paragraph_sentences=None):
+        """Return one list of sentences per paragraph, splitting only if none were given"""
+        if paragraph_sentences is not None:
+            return paragraph_sentences
+        return [split_sentences(paragraph) for paragraph in paragraphs]
+    
+    def extract_definition(self, term, paragraphs, paragraph_sentences=None):
         """Extract a definition for a term from the context"""
         # Look for patterns like "term is", "term refers to", "term means"
         for paragraph in paragraphs:
@@ -284,20 +401,19 @@ class AdvancedLLM:
                     return matches.group(1).strip()
         
         # Look for sentences that contain the term
-        for paragraph in paragraphs:
-            sentences = sent_tokenize(paragraph)
+        for sentences in self._paragraph_sentences(paragraphs, paragraph_sentences):
             for sentence in sentences:
                 if term.lower() in sentence.lower():
                     return sentence
                     
         return None
         
-    def extract_explanation(self, entities, paragraphs):
+    def extract_explanation(self, entities, paragraphs, paragraph_sentences=None):
         """Extract explanations related to the entities"""
         # Join paragraphs into sentences
         all_sentences = []
-        for paragraph in paragraphs:
-            all_sentences.extend(sent_tokenize(paragraph))
+        for sentences in self._paragraph_sentences(paragraphs, paragraph_sentences):
+            all_sentences.extend(sentences)
             
         # Score sentences by entity coverage
         entity_sentences = []
@@ -599,29 +715,87 @@ class ExternalLLMConnector:
             logging.exception(e)
             return f"Error processing response: {str(e)}"
 
+    def _api_headers(self, provider, api_key):
+        """Return the HTTP headers for a provider's API"""
+        headers = {
+            "Content-Type": "application/json",
+        }
+        
+        # Add authorization header based on provider
+        if provider == "openai":
+            headers["Authorization"] = f"Bearer {api_key}"
+        elif provider == "huggingface":
+            # HF inference API requires this header format
+            headers["Authorization"] = f"Bearer {api_key}"
+            # Add additional headers for Hugging Face
+            headers["X-Use-Cache"] = "false"
+        elif provider == "custom" and api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        return headers
+
+    def _parse_api_response(self, provider, response_json):
+        """Extract the generated text from a provider's JSON response"""
+        result = ""
+        if provider == "openai":
+            result = response_json["choices"][0]["message"]["content"]
+        elif provider == "huggingface":
+            result = self._handle_huggingface_response(response_json)
+        elif provider == "custom":
+            # Handle different custom response formats
+            if "choices" in response_json and len(response_json["choices"]) > 0:
+                if "message" in response_json["choices"][0]:
+                    result = response_json["choices"][0]["message"]["content"]
+                elif "text" in response_json["choices"][0]:
+                    result = response_json["choices"][0]["text"]
+            elif "response" in response_json:
+                result = response_json["response"]
+            else:
+                # Try to get the first field that might contain the response
+                for key, value in response_json.items():
+                    if isinstance(value, str) and len(value) > 20:
+                        result = value
+                        break
+                if not result:
+                    result = str(response_json)
+        return result
+
+    def _error_message(self, provider, response):
+        """Log and return the error of a failed API response"""
+        try:
+            error_content = response.json()
+        except:
+            error_content = response.text
+        logging.error(f"Error calling {provider} API: {response.status_code} - {error_content}")
+        error_message = f"Error calling {provider} API: {response.status_code} - {error_content}"
+        print(f"Full API error response: {error_message}")
+        return error_message
+
+    def _huggingface_retry(self, data):
+        """Return (request data, API key, endpoint) to retry an OpenAI request on Hugging Face, or None"""
+        hf_key = config.LLM_API_KEYS.get("huggingface")
+        if not hf_key:
+            return None
+        
+        # Reformat request for Hugging Face
+        query = data.get("messages", [{}])[-1].get("content", "")
+        context = ""
+        for msg in data.get("messages", []):
+            if "content" in msg and "Document:" in msg.get("content", ""):
+                context = msg.get("content", "").split("Document:", 1)[1].strip()
+                break
+        
+        return self._format_huggingface_request(query, context), hf_key, config.LLM_ENDPOINTS.get("huggingface")
+
     def _call_external_api(self, data):
         """Make the API call to the external LLM provider"""
         result = ""
         try:
-            headers = {
-                "Content-Type": "application/json",
-            }
-            
-            # Add authorization header based on provider
-            if self.provider == "openai":
-                headers["Authorization"] = f"Bearer {self.api_key}"
-            elif self.provider == "huggingface":
-                # HF inference API requires this header format
-                headers["Authorization"] = f"Bearer {self.api_key}"
-                # Add additional headers for Hugging Face
-                headers["X-Use-Cache"] = "false"
-            elif self.provider == "custom" and self.api_key:
-                headers["Authorization"] = f"Bearer {self.api_key}"
+            headers = self._api_headers(self.provider, self.api_key)
             
             print(f"Calling {self.provider} API at {self.endpoint}")
             print(f"Request data: {data}")
             
-            response = requests.post(
+            response = get_session().post(
                 self.endpoint,
                 headers=headers,
                 json=data,
@@ -633,63 +807,23 @@ class ExternalLLMConnector:
             if response.status_code == 200:
                 response_json = response.json()
                 print(f"Response JSON: {response_json}")
-                
-                if self.provider == "openai":
-                    result = response_json["choices"][0]["message"]["content"]
-                elif self.provider == "huggingface":
-                    result = self._handle_huggingface_response(response_json)
-                elif self.provider == "custom":
-                    # Handle different custom response formats
-                    if "choices" in response_json and len(response_json["choices"]) > 0:
-                        if "message" in response_json["choices"][0]:
-                            result = response_json["choices"][0]["message"]["content"]
-                        elif "text" in response_json["choices"][0]:
-                            result = response_json["choices"][0]["text"]
-                    elif "response" in response_json:
-                        result = response_json["response"]
-                    else:
-                        # Try to get the first field that might contain the response
-                        for key, value in response_json.items():
-                            if isinstance(value, str) and len(value) > 20:
-                                result = value
-                                break
-                        if not result:
-                            result = str(response_json)
-                
+                result = self._parse_api_response(self.provider, response_json)
                 logging.info(f"Got response from {self.provider} API")
             else:
                 # Better error handling with response details
-                try:
-                    error_content = response.json()
-                    logging.error(f"Error calling {self.provider} API: {response.status_code} - {error_content}")
-                    error_message = f"Error calling {self.provider} API: {response.status_code} - {error_content}"
-                except:
-                    logging.error(f"Error calling {self.provider} API: {response.status_code} - {response.text}")
-                    error_message = f"Error calling {self.provider} API: {response.status_code} - {response.text}"
-                
-                print(f"Full API error response: {error_message}")
+                self._error_message(self.provider, response)
                 
                 if self.provider == "openai" and response.status_code in [401, 403]:
                     # If OpenAI key doesn't work, try falling back to Hugging Face
                     logging.info("OpenAI API key seems invalid, checking if Hugging Face is available")
-                    hf_key = config.LLM_API_KEYS.get("huggingface")
-                    if hf_key:
+                    retry = self._huggingface_retry(data)
+                    if retry:
                         # Switch provider temporarily
                         original_provider = self.provider
+                        new_data, self.api_key, self.endpoint = retry
                         self.provider = "huggingface"
-                        self.api_key = hf_key
-                        self.endpoint = config.LLM_ENDPOINTS.get("huggingface")
-                        
-                        # Reformat request for Hugging Face
-                        query = data.get("messages", [{}])[-1].get("content", "")
-                        context = ""
-                        for msg in data.get("messages", []):
-                            if "content" in msg and "Document:" in msg.get("content", ""):
-                                context = msg.get("content", "").split("Document:", 1)[1].strip()
-                                break
                         
                         # Call HuggingFace API
-                        new_data = self._format_huggingface_request(query, context)
                         result = self._call_external_api(new_data)
                         
                         # Reset provider
@@ -708,7 +842,155 @@ class ExternalLLMConnector:
         
         return result
 
+    async def _acall_external_api(self, data, provider=None, api_key=None, endpoint=None):
+        """Async _call_external_api over the shared httpx.AsyncClient
+        
+        The provider, API key and endpoint default to the connector's own;
+        they are passed rather than switched on self so concurrent calls
+        don't see each other's fallback.
+        """
+        provider = provider or self.provider
+        api_key = api_key or self.api_key
+        endpoint = endpoint or self.endpoint
+        try:
+            print(f"Calling {provider} API at {endpoint}")
+            response = await get_async_client().post(
+                endpoint,
+                headers=self._api_headers(provider, api_key),
+                json=data,
+                timeout=self.timeout
+            )
+            
+            print(f"Response status: {response.status_code}")
+            
+            if response.status_code == 200:
+                logging.info(f"Got response from {provider} API")
+                return self._parse_api_response(provider, response.json())
+            
+            self._error_message(provider, response)
+            
+            if provider == "openai" and response.status_code in [401, 403]:
+                # If OpenAI key doesn't work, try falling back to Hugging Face
+                logging.info("OpenAI API key seems invalid, checking if Hugging Face is available")
+                retry = self._huggingface_retry(data)
+                if retry:
+                    new_data, hf_key, hf_endpoint = retry
+                    return await self._acall_external_api(new_data, "huggingface", hf_key, hf_endpoint)
+            
+            return f"Error calling {provider} API: {response.status_code}"
+        
+        except Exception as e:
+            logging.error(f"Exception calling {provider} API: {str(e)}")
+            logging.exception(e)
+            return f"Error calling {provider} API: {str(e)}"
+
+    def _chat_messages(self, query, context, prompt_type):
+        """Return the system and user chat messages for a task"""
+        system_prompt = self.system_prompts.get(prompt_type, self.system_prompts["pdf_analysis"])
+        messages = []
+        
+        # Add system message
+        if system_prompt:
+            messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+        
+        # Add context as user message if available
+        if context:
+            messages.append({
+                "role": "user",
+                "content": f"Document content:\n\n{context}\n\nTask: {query}"
+            })
+        else:
+            # Just the query if no context
+            messages.append({
+                "role": "user",
+                "content": query
+            })
+        return messages
+
     def generate_response(self, query, context, prompt_type="pdf_analysis"):
+        """Generate a response, from the LLM response cache when the same request was answered before
+        
+        Args:
+            query: The user's question or task
+            context: Relevant document context
+            prompt_type: Type of prompt to use ("pdf_analysis", "summarization", etc.)
+            
+        Returns:
+            Generated response text
+        """
+        key = self._cache_key(query, context, prompt_type)
+        if key is None:
+            return self._generate_response(query, context, prompt_type)
+        
+        cached = llm_cache.get(key)
+        if cached is not None:
+            print(f"LLM response cache hit for {prompt_type}")
+            return cached
+        
+        state = {"mock": False}
+        token = _generation.set(state)
+        try:
+            start = time.perf_counter()
+            response = self._generate_response(query, context, prompt_type)
+            self._cache_response(key, prompt_type, response, state, time.perf_counter() - start)
+        finally:
+            _generation.reset(token)
+        return response
+    
+    async def agenerate_response(self, query, context, prompt_type="pdf_analysis"):
+        """Async generate_response, with the same LLM response cache"""
+        key = self._cache_key(query, context, prompt_type)
+        if key is None:
+            return await self._agenerate_response(query, context, prompt_type)
+        
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            print(f"LLM response cache hit for {prompt_type}")
+            return cached
+        
+        state = {"mock": False}
+        start = time.perf_counter()
+        response = await _tracked(state, self._agenerate_response(query, context, prompt_type))
+        await asyncio.to_thread(self._cache_response, key, prompt_type, response, state, time.perf_counter() - start)
+        return response
+    
+    def _model_name(self):
+        """Return the model the provider is called with"""
+        try:
+            import config
+            return {
+                "mistral": config.MISTRAL_MODEL,
+                "huggingface": config.HF_MODEL,
+                "openai": config.DEFAULT_MODEL,
+            }.get(self.provider, self.model)
+        except (ImportError, AttributeError):
+            return self.model
+    
+    def _cache_key(self, query, context, prompt_type):
+        """Return the LLM response cache key of a request, or None when it isn't cached"""
+        try:
+            import config
+            enable_external_llm = config.ENABLE_EXTERNAL_LLM
+        except ImportError:
+            enable_external_llm = False
+        if not enable_external_llm or self.provider == "mock" or not llm_cache.caches(prompt_type):
+            return None
+        system_prompt = self.system_prompts.get(prompt_type, self.system_prompts["pdf_analysis"])
+        return request_key(
+            self.provider, self._model_name(), system_prompt, context, query,
+            (self.temperature, self.max_tokens)
+        )
+    
+    def _cache_response(self, key, prompt_type, response, state, latency):
+        """Store a provider's response; mock fallbacks, errors and interrupted streams are not cached"""
+        if state["mock"] or state.get("failed") or not response or response.startswith("Error"):
+            return
+        llm_cache.put(key, prompt_type, response, latency)
+    
+    def _generate_response(self, query, context, prompt_type="pdf_analysis"):
         """Generate a response using the configured LLM provider
         
         Args:
@@ -751,34 +1033,13 @@ class ExternalLLMConnector:
                 import config
                 print(f"Using Mistral client with model {config.MISTRAL_MODEL}")
                 
-                # Create client with explicit API key
+                # Reuse one client (and its connections) per API key
                 api_key = config.LLM_API_KEYS.get("mistral")
                 print(f"Using Mistral API key: {api_key[:4]}...{api_key[-4:] if len(api_key) > 8 else ''}")
-                client = MistralClient(api_key=api_key)
+                client = get_client(("mistral", MistralClient.__name__, api_key), lambda: MistralClient(api_key=api_key))
                 
                 # Format the messages
-                system_prompt = self.system_prompts.get(prompt_type, self.system_prompts["pdf_analysis"])
-                messages = []
-                
-                # Add system message
-                if system_prompt:
-                    messages.append({
-                        "role": "system",
-                        "content": system_prompt
-                    })
-                
-                # Add context as user message if available
-                if context:
-                    messages.append({
-                        "role": "user",
-                        "content": f"Document content:\n\n{context}\n\nTask: {query}"
-                    })
-                else:
-                    # Just the query if no context
-                    messages.append({
-                        "role": "user",
-                        "content": query
-                    })
+                messages = self._chat_messages(query, context, prompt_type)
                 
                 # Generate completion - handle both API versions
                 try:
@@ -805,7 +1066,7 @@ class ExternalLLMConnector:
                         "messages": messages
                     }
                     try:
-                        response = requests.post(endpoint, headers=headers, json=data, timeout=30)
+                        response = get_session().post(endpoint, headers=headers, json=data, timeout=30)
                         if response.status_code == 200:
                             chat_response = response.json()
                         else:
@@ -843,35 +1104,14 @@ class ExternalLLMConnector:
                 
                 print(f"Using huggingface-hub client with provider {config.HF_PROVIDER} and model {config.HF_MODEL}")
                 
-                # Create client
-                client = InferenceClient(
-                    provider=config.HF_PROVIDER,
-                    api_key=self.api_key,
+                # Reuse one client (and its connections) per provider and API key
+                client = get_client(
+                    ("huggingface", config.HF_PROVIDER, self.api_key),
+                    lambda: InferenceClient(provider=config.HF_PROVIDER, api_key=self.api_key)
                 )
                 
                 # Format the messages
-                system_prompt = self.system_prompts.get(prompt_type, self.system_prompts["pdf_analysis"])
-                messages = []
-                
-                # Add system message
-                if system_prompt:
-                    messages.append({
-                        "role": "system",
-                        "content": system_prompt
-                    })
-                
-                # Add context as user message if available
-                if context:
-                    messages.append({
-                        "role": "user",
-                        "content": f"Document content:\n\n{context}\n\nTask: {query}"
-                    })
-                else:
-                    # Just the query if no context
-                    messages.append({
-                        "role": "user",
-                        "content": query
-                    })
+                messages = self._chat_messages(query, context, prompt_type)
                 
                 # Generate completion
                 completion = client.chat.completions.create(
@@ -919,8 +1159,265 @@ class ExternalLLMConnector:
             
         return result
         
+    async def _agenerate_response(self, query, context, prompt_type="pdf_analysis"):
+        """Async _generate_response that awaits the provider instead of blocking
+        
+        Provider calls go through the SDKs' async clients or the shared
+        httpx.AsyncClient; the local mock generation runs in a worker thread.
+        Without httpx the blocking generate_response runs in a worker thread.
+        """
+        try:
+            import config
+            enable_external_llm = config.ENABLE_EXTERNAL_LLM
+        except ImportError:
+            enable_external_llm = False
+        
+        if not enable_external_llm or self.provider == "mock":
+            print(f"Using mock generation for {prompt_type}")
+            return await asyncio.to_thread(self._mock_generate, query, context, prompt_type)
+        
+        if get_async_client() is None:
+            print("httpx not installed. Running the blocking connector in a worker thread.")
+            return await asyncio.to_thread(self._generate_response, query, context, prompt_type)
+        
+        print(f"Generating response using {self.provider} provider for {prompt_type} (async)")
+        
+        messages = self._chat_messages(query, context, prompt_type)
+        if self.provider == "mistral":
+            result = await self._amistral_chat(messages)
+        elif self.provider == "huggingface":
+            result = await self._ahuggingface_chat(query, context, prompt_type, messages)
+        elif self.provider in ("openai", "custom"):
+            if self.provider == "openai":
+                data = self._format_openai_request(query, context, prompt_type)
+            else:
+                data = self._format_custom_request(query, context, prompt_type)
+            result = await self._acall_external_api(data)
+        else:
+            print(f"Provider {self.provider} not recognized. Using mock fallback.")
+            result = None
+        
+        # If we got an error or empty response, fall back to mock
+        if not result or result.startswith("Error calling"):
+            print(f"API error, falling back to mock: {result}")
+            return await asyncio.to_thread(self._mock_generate, query, context, prompt_type)
+        
+        return result
+    
+    async def _amistral_chat(self, messages):
+        """Chat completion from Mistral's async client, else its HTTP API; None on failure"""
+        import config
+        api_key = config.LLM_API_KEYS.get("mistral")
+        try:
+            try:
+                from mistralai import Mistral
+            except ImportError:
+                from mistralai.client import Mistral  # mistralai 2.x
+            
+            client = get_client(("mistral", "Mistral", api_key), lambda: Mistral(api_key=api_key))
+            chat_response = await client.chat.complete_async(
+                model=config.MISTRAL_MODEL,
+                messages=messages,
+            )
+            if chat_response and chat_response.choices:
+                return chat_response.choices[0].message.content
+        except ImportError:
+            print("Async Mistral client not available, using the HTTP API")
+        except Exception as e:
+            print(f"Error calling Mistral API: {str(e)}")
+        
+        # Fall back to direct HTTP request
+        try:
+            response = await get_async_client().post(
+                "https://api.mistral.ai/v1/chat/completions",
+                headers={"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"},
+                json={"model": config.MISTRAL_MODEL, "messages": messages},
+                timeout=self.timeout
+            )
+            if response.status_code == 200:
+                chat_response = response.json()
+                if chat_response.get("choices") and "message" in chat_response["choices"][0]:
+                    return chat_response["choices"][0]["message"]["content"]
+            else:
+                print(f"HTTP error from Mistral API: {response.status_code} - {response.text}")
+        except Exception as http_err:
+            print(f"HTTP request to Mistral API failed: {str(http_err)}")
+        return None
+    
+    async def _ahuggingface_chat(self, query, context, prompt_type, messages):
+        """Chat completion from huggingface_hub's AsyncInferenceClient, else the HTTP API; None on failure"""
+        try:
+            from huggingface_hub import AsyncInferenceClient
+        except ImportError:
+            print("huggingface_hub library not installed. Falling back to HTTP requests.")
+            data = self._format_huggingface_request(query, context, prompt_type)
+            return await self._acall_external_api(data)
+        
+        try:
+            client = get_client(
+                ("huggingface-async", config.HF_PROVIDER, self.api_key),
+                lambda: AsyncInferenceClient(provider=config.HF_PROVIDER, api_key=self.api_key)
+            )
+            completion = await client.chat.completions.create(
+                model=config.HF_MODEL,
+                messages=messages,
+                max_tokens=config.MAX_TOKENS,
+                temperature=config.TEMPERATURE,
+            )
+            if completion and completion.choices:
+                return completion.choices[0].message.content
+        except Exception as e:
+            print(f"Error using huggingface-hub async client: {str(e)}")
+        return None
+        
+    async def astream_response(self, query, context, prompt_type="pdf_analysis"):
+        """Yield the generated response in pieces as the provider produces them
+        
+        Mistral, Hugging Face and OpenAI stream their tokens. Custom endpoints
+        and the mock generation answer whole, and are yielded a sentence at a
+        time. If the provider fails before sending any text, the mock
+        response is streamed instead. A response in the LLM response cache is
+        yielded a sentence at a time; a streamed one is stored once complete.
+        """
+        key = self._cache_key(query, context, prompt_type)
+        if key is None:
+            async for piece in self._astream_response(query, context, prompt_type, {"mock": False}):
+                yield piece
+            return
+        
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
+            print(f"LLM response cache hit for {prompt_type}")
+            for piece in sentence_pieces(cached):
+                yield piece
+            return
+        
+        state = {"mock": False}
+        pieces = []
+        start = time.perf_counter()
+        async for piece in self._astream_response(query, context, prompt_type, state):
+            pieces.append(piece)
+            yield piece
+        await asyncio.to_thread(
+            self._cache_response, key, prompt_type, "".join(pieces), state, time.perf_counter() - start
+        )
+    
+    async def _astream_response(self, query, context, prompt_type, state):
+        """Uncached astream_response
+        
+        Sets state["mock"] when the mock response is streamed and state["failed"]
+        when the provider's stream broke off, so neither is cached.
+        """
+        try:
+            import config
+            enable_external_llm = config.ENABLE_EXTERNAL_LLM
+        except ImportError:
+            enable_external_llm = False
+        
+        if enable_external_llm and self.provider != "mock" and get_async_client() is not None:
+            messages = self._chat_messages(query, context, prompt_type)
+            if self.provider == "mistral":
+                pieces = self._astream_mistral(messages)
+            elif self.provider == "huggingface":
+                pieces = self._astream_huggingface(messages)
+            elif self.provider == "openai":
+                data = dict(self._format_openai_request(query, context, prompt_type), stream=True)
+                pieces = self._astream_sse(self.endpoint, self._api_headers("openai", self.api_key), data)
+            else:
+                # No streaming protocol for this provider; stream its whole answer by sentence
+                response = await _tracked(state, self._agenerate_response(query, context, prompt_type))
+                for piece in sentence_pieces(response):
+                    yield piece
+                return
+            
+            streamed = False
+            try:
+                async for piece in pieces:
+                    if piece:
+                        streamed = True
+                        yield piece
+            except Exception as e:
+                print(f"Error streaming from {self.provider}: {str(e)}")
+                state["failed"] = True
+            if streamed:
+                return
+            print(f"No text streamed from {self.provider}, falling back to mock")
+        elif enable_external_llm and self.provider != "mock":
+            print("httpx not installed. Streaming the blocking connector's answer by sentence.")
+            response = await _tracked(state, asyncio.to_thread(self._generate_response, query, context, prompt_type))
+            for piece in sentence_pieces(response):
+                yield piece
+            return
+        
+        state["mock"] = True
+        response = await asyncio.to_thread(self._mock_generate, query, context, prompt_type)
+        for piece in sentence_pieces(response):
+            yield piece
+    
+    async def _astream_sse(self, endpoint, headers, data):
+        """Yield the content deltas of an OpenAI-style chat completion stream"""
+        async with get_async_client().stream("POST", endpoint, headers=headers, json=data, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                await response.aread()
+                self._error_message(self.provider, response)
+                return
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                choices = json.loads(payload).get("choices") or [{}]
+                yield (choices[0].get("delta") or {}).get("content")
+    
+    async def _astream_mistral(self, messages):
+        """Yield tokens from Mistral's async client, else its HTTP streaming API"""
+        import config
+        api_key = config.LLM_API_KEYS.get("mistral")
+        try:
+            try:
+                from mistralai import Mistral
+            except ImportError:
+                from mistralai.client import Mistral  # mistralai 2.x
+        except ImportError:
+            print("Async Mistral client not available, using the HTTP API")
+            headers = {"Content-Type": "application/json", "Authorization": f"Bearer {api_key}"}
+            data = {"model": config.MISTRAL_MODEL, "messages": messages, "stream": True}
+            async for piece in self._astream_sse("https://api.mistral.ai/v1/chat/completions", headers, data):
+                yield piece
+            return
+        
+        client = get_client(("mistral", "Mistral", api_key), lambda: Mistral(api_key=api_key))
+        stream = await client.chat.stream_async(model=config.MISTRAL_MODEL, messages=messages)
+        async for event in stream:
+            content = event.data.choices[0].delta.content if event.data.choices else None
+            if isinstance(content, str):
+                yield content
+    
+    async def _astream_huggingface(self, messages):
+        """Yield tokens from huggingface_hub's AsyncInferenceClient"""
+        from huggingface_hub import AsyncInferenceClient
+        
+        client = get_client(
+            ("huggingface-async", config.HF_PROVIDER, self.api_key),
+            lambda: AsyncInferenceClient(provider=config.HF_PROVIDER, api_key=self.api_key)
+        )
+        stream = await client.chat.completions.create(
+            model=config.HF_MODEL,
+            messages=messages,
+            max_tokens=config.MAX_TOKENS,
+            temperature=config.TEMPERATURE,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content
+        
     def _mock_generate(self, query, context, prompt_type="pdf_analysis"):
         """Generate a sophisticated mock response when no API is available"""
+        state = _generation.get()
+        if state is not None:
+            state["mock"] = True
         print(f"Using enhanced mock provider for {prompt_type}")
         
         # For handling chat about document content
@@ -1019,8 +1516,15 @@ class ExternalLLMConnector:
         
         return "I couldn't find specific information in the document to answer your question. The document appears to discuss personal experiences, values, and someone named Onoda, but doesn't address your specific query about '" + question + "'. Please try asking about a different topic covered in the document."
     
-    def _create_summary(self, text):
-        """Create a more effective document summary"""
+    def _create_summary(self, text, sentences=None):
+        """Create a more effective document summary
+        
+        sentences are the text's sentences when they were sliced from the
+        document's stored offsets; otherwise the text is split here.
+        """
+        if sentences is None:
+            sentences = self._sent_sentences(text)
+        
         # Basic text cleaning
         text = text.replace('\n\n', ' | ').replace('\n', ' ')
         text = re.sub(r'\s+', ' ', text).strip()
@@ -1030,13 +1534,10 @@ class ExternalLLMConnector:
             return text
         
         # Split into sentences for analysis
-        sentences = []
-        try:
-            from nltk.tokenize import sent_tokenize
-            sentences = sent_tokenize(text)
-        except:
-            # Fallback if NLTK not available
-            sentences = [s.strip() + '.' for s in text.split('.') if s.strip()]
+        if sentences is None:
+            sentences = split_sentences(text)
+        else:
+            sentences = [" ".join(sentence.split()) for sentence in sentences]
         
         if len(sentences) <= 5:
             return text
@@ -1075,6 +1576,13 @@ class ExternalLLMConnector:
         
         return summary
     
+    def _sent_sentences(self, text):
+        """Return the sentences of document text AIService is sending, sliced from stored offsets, or None"""
+        sent = _context_sentences.get()
+        if sent is None or sent[0] != text:
+            return None
+        return sent[1]()
+    
     def _generate_fallback(self, query, context, prompt_type):
         """Generate a fallback response"""
         prompt_intros = {
@@ -1089,13 +1597,9 @@ class ExternalLLMConnector:
         # If we have context, try to extract meaningful parts
         if context and len(context) > 100:
             # Split into sentences
-            sentences = []
-            try:
-                from nltk.tokenize import sent_tokenize
-                sentences = sent_tokenize(context)
-            except:
-                # Fallback if NLTK not available
-                sentences = [s.strip() + '.' for s in context.split('.') if s.strip()]
+            sentences = self._sent_sentences(context)
+            if sentences is None:
+                sentences = split_sentences(context)
             
             if len(sentences) > 5:
                 selected_sentences = [
@@ -1151,7 +1655,7 @@ class ExternalLLMConnector:
                 print("Attempting to use Mistral AI for text generation")
                 
                 # Format the prompt
-                prompt = prompt_template.format(text=text[:10000])  # Limit text to avoid token limits
+                prompt = prompt_template.format(text=truncate_to_tokens(text, LLM_CONTEXT_TOKENS))  # Limit text to avoid token limits
                 print(f"Formatted prompt (first 100 chars): {prompt[:100]}...")
                 
                 # Try different client approaches
@@ -1161,7 +1665,7 @@ class ExternalLLMConnector:
                     from mistralai.models.chat_completion import ChatMessage
                     
                     print("Using mistralai.client library")
-                    client = MistralClient(api_key=api_key)
+                    client = get_client(("mistral", "MistralClient", api_key), lambda: MistralClient(api_key=api_key))
                     
                     # Create the chat message
                     messages = [
@@ -1187,7 +1691,7 @@ class ExternalLLMConnector:
                         from mistralai import Mistral
                         
                         print("Using mistralai package")
-                        client = Mistral(api_key=api_key)
+                        client = get_client(("mistral", "Mistral", api_key), lambda: Mistral(api_key=api_key))
                         
                         # Format the messages for the API
                         messages = [
@@ -1215,7 +1719,6 @@ class ExternalLLMConnector:
                 # Third attempt - using direct HTTP request
                 try:
                     print("Attempting direct HTTP request to Mistral API")
-                    import requests
                     
                     endpoint = "https://api.mistral.ai/v1/chat/completions"
                     headers = {
@@ -1228,7 +1731,7 @@ class ExternalLLMConnector:
                         "max_tokens": max_tokens
                     }
                     
-                    response = requests.post(endpoint, headers=headers, json=data, timeout=30)
+                    response = get_session().post(endpoint, headers=headers, json=data, timeout=30)
                     
                     if response.status_code == 200:
                         result = response.json()
@@ -1266,6 +1769,13 @@ class FreqDist:
             return sorted_items[:n]
         return sorted_items
 
+def _pages_used(passages):
+    """Return the sorted page numbers of retrieved passages, or None without passages"""
+    return sorted({page for passage in passages for page in passage["pages"]}) if passages else None
+
+def _summary_prompt(complexity):
+    return f"Create a {complexity or 'standard'} summary of the following document content."
+
 # Main AI Service class
 class AIService:
     """Main AI service for PDF analysis and processing"""
@@ -1342,146 +1852,423 @@ class AIService:
         
         return intersection / union if union > 0 else 0
         
-    def summarize(self, filename, complexity=None, max_length=None):
+    def summarize(self, filename, complexity=None, max_length=None, pages=None):
         """Generate a summary for a PDF file
         
+        Concurrent identical summaries of the same document share one run.
+        
         Args:
             filename: Path to the PDF file relative to upload dir
             complexity: Summary complexity (simple, standard, technical)
             max_length: Maximum length of the summary in words (optional)
+            pages: 1-based page numbers to summarize (optional, default all)
             
         Returns:
             The summary as a string
         """
+        key = self._flight_key("summarize", os.path.join(self.upload_dir, filename), complexity, max_length, pages)
+        if key is None:
+            return self._summarize(filename, complexity, max_length, pages)
+        return singleflight.do(key, lambda: self._summarize(filename, complexity, max_length, pages))
+    
+    def _summarize(self, filename, complexity=None, max_length=None, pages=None):
         try:
-            # Try importing config, or use defaults
-            try:
-                import config
-                enable_external_llm = config.ENABLE_EXTERNAL_LLM
-            except ImportError:
-                enable_external_llm = False
+            # Extract text from PDF, spread over the whole document within the context budget
+            text = self._summary_context(filename, pages)
             
-            # Get full path
             file_path = os.path.join(self.upload_dir, filename)
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"File not found: {file_path}")
-            
-            # Extract text from PDF
-            text = self.extract_text(file_path, "hybrid")
-            if not text:
-                raise ValueError("Failed to extract text from PDF")
             
             # Generate summary using external LLM if enabled
-            if enable_external_llm:
-                self.logger.info(f"Generating summary for {filename} using external LLM")
-                # Create prompt for summarization
-                prompt = f"Create a {complexity or 'standard'} summary of the following document content."
-                
-                # Send request to LLM
-                summary = self.external_llm.generate_response(prompt, text, prompt_type="summarization")
-                
-                # Check if we got a reasonable response
-                if summary and not summary.startswith("Error:"):
+            if self._external_llm_enabled("summarization"):
+                with self._sending(file_path, text):
+                    summary = self._llm_summary(
+                        self.external_llm.generate_response(_summary_prompt(complexity), text, prompt_type="summarization")
+                    )
+                if summary is not None:
                     return summary
-                
-                # If not, fall back to local summarization
-                self.logger.warning("External LLM response was not valid, falling back to local")
-            else:
-                # Use local summarization
-                self.logger.info(f"Generating summary for {filename} using local model")
             
             # Fallback to local summarization
-            summary = self._local_summarize(text, complexity, max_length)
+            return self._local_summarize(text, complexity, max_length, self.context_sentences(file_path, text))
+        except Exception as e:
+            self.logger.error(f"Error generating summary: {str(e)}")
+            raise
+
+    async def asummarize(self, filename, complexity=None, max_length=None, pages=None):
+        """Async summarize: PDF work runs in worker threads and the LLM is awaited"""
+        key = await asyncio.to_thread(
+            self._flight_key, "summarize", os.path.join(self.upload_dir, filename), complexity, max_length, pages
+        )
+        if key is None:
+            return await self._asummarize(filename, complexity, max_length, pages)
+        return await singleflight.ado(key, lambda: self._asummarize(filename, complexity, max_length, pages))
+    
+    async def _asummarize(self, filename, complexity=None, max_length=None, pages=None):
+        try:
+            text = await asyncio.to_thread(self._summary_context, filename, pages)
+            file_path = os.path.join(self.upload_dir, filename)
             
-            return summary
+            if self._external_llm_enabled("summarization"):
+                with self._sending(file_path, text):
+                    summary = self._llm_summary(
+                        await self.external_llm.agenerate_response(_summary_prompt(complexity), text, prompt_type="summarization")
+                    )
+                if summary is not None:
+                    return summary
+            
+            sentences = await asyncio.to_thread(self.context_sentences, file_path, text)
+            return await asyncio.to_thread(self._local_summarize, text, complexity, max_length, sentences)
         except Exception as e:
             self.logger.error(f"Error generating summary: {str(e)}")
             raise
+    
+    async def astream_summary(self, filename, complexity=None, max_length=None, pages=None):
+        """Stream a summary as ("token", {"text"}) events, then ("done", {})
+        
+        Tokens are forwarded as the LLM generates them; the local summary is
+        streamed a sentence at a time.
+        """
+        text = await asyncio.to_thread(self._summary_context, filename, pages)
+        file_path = os.path.join(self.upload_dir, filename)
+        
+        if self._external_llm_enabled("summarization"):
+            with self._sending(file_path, text):
+                async for piece in self.external_llm.astream_response(_summary_prompt(complexity), text, prompt_type="summarization"):
+                    yield "token", {"text": piece}
+        else:
+            sentences = await asyncio.to_thread(self.context_sentences, file_path, text)
+            summary = await asyncio.to_thread(self._local_summarize, text, complexity, max_length, sentences)
+            for piece in sentence_pieces(summary):
+                yield "token", {"text": piece}
+        yield "done", {}
+    
+    def _flight_key(self, operation, pdf_path, *params):
+        """Return the single-flight key of an operation on a PDF, or None if the file is missing"""
+        try:
+            doc_hash = content_hash(pdf_path)
+        except OSError:
+            return None
+        return (operation, doc_hash) + tuple(tuple(param) if isinstance(param, list) else param for param in params)
+    
+    def _summary_context(self, filename, pages=None):
+        """Return the text to summarize of an uploaded PDF, within the context budget"""
+        # Get full path
+        file_path = os.path.join(self.upload_dir, filename)
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        
+        text = self.document_context(file_path, "hybrid", pages)
+        if not text:
+            raise ValueError("Failed to extract text from PDF")
+        return text
+    
+    def _llm_summary(self, summary):
+        """Return an LLM summary, or None if it is unusable and the local one should be used"""
+        if summary and not summary.startswith("Error:"):
+            return summary
+        self.logger.warning("External LLM response was not valid, falling back to local")
+        return None
+    
+    def _local_summarize(self, text, complexity=None, max_length=None, sentences=None):
+        """Summarize text locally from its leading, middle and closing sentences
+        
+        A "simple" summary is also simplified; max_length caps it in words.
+        sentences are the text's, when sliced from the document's stored offsets.
+        """
+        summary = self.external_llm._create_summary(text, sentences)
+        if complexity == "simple":
+            summary = self._rule_based_simplification(summary)
+        if max_length:
+            words = summary.split()
+            if len(words) > max_length:
+                summary = " ".join(words[:max_length]) + "..."
+        return summary
 
-    def chat(self, prompt, pdf_path=None, context=None, extract_method="hybrid", system_prompt=None):
+    def chat(self, prompt, pdf_path=None, context=None, extract_method="hybrid", system_prompt=None, pages=None):
         """Chat about a PDF document"""
+        return self.chat_with_sources(prompt, pdf_path, context, extract_method, system_prompt, pages)["response"]
+    
+    async def achat(self, prompt, pdf_path=None, context=None, extract_method="hybrid", system_prompt=None, pages=None):
+        """Async chat about a PDF document"""
+        return (await self.achat_with_sources(prompt, pdf_path, context, extract_method, system_prompt, pages))["response"]
+    
+    def chat_with_sources(self, prompt, pdf_path=None, context=None, extract_method="hybrid", system_prompt=None, pages=None):
+        """Chat about a PDF document and report which pages the answer was given
+        
+        With CHAT_RETRIEVAL on, only the passages most relevant to the prompt
+        (up to CHAT_CONTEXT_TOKENS) are sent to the LLM instead of the whole
+        document.
+        
+        Returns:
+            {"response": the answer, "pages": page numbers of the passages used,
+             or None when the whole document or the given context was used}
+        """
+        full_context, passages, error = self._chat_context(prompt, pdf_path, context, extract_method, pages)
+        if error:
+            return {"response": error, "pages": []}
+        
+        # Try external LLM for better chat
+        if self._external_llm_enabled("chat"):
+            try:
+                result = self._llm_chat(self.external_llm.generate_response(prompt, full_context, "pdf_analysis"), passages)
+                if result is not None:
+                    return result
+            except Exception as e:
+                print(f"Error using external LLM for chat: {e}")
+        
+        return self._local_chat_with_sources(prompt, full_context, passages, pdf_path, context, extract_method, pages)
+    
+    async def achat_with_sources(self, prompt, pdf_path=None, context=None, extract_method="hybrid", system_prompt=None, pages=None):
+        """Async chat_with_sources: PDF work runs in worker threads and the LLM is awaited"""
+        full_context, passages, error = await asyncio.to_thread(
+            self._chat_context, prompt, pdf_path, context, extract_method, pages
+        )
+        if error:
+            return {"response": error, "pages": []}
+        
+        if self._external_llm_enabled("chat"):
+            try:
+                result = self._llm_chat(await self.external_llm.agenerate_response(prompt, full_context, "pdf_analysis"), passages)
+                if result is not None:
+                    return result
+            except Exception as e:
+                print(f"Error using external LLM for chat: {e}")
+        
+        return await asyncio.to_thread(
+            self._local_chat_with_sources, prompt, full_context, passages, pdf_path, context, extract_method, pages
+        )
+    
+    async def astream_chat(self, prompt, pdf_path=None, context=None, extract_method="hybrid", pages=None):
+        """Stream a chat answer as ("token", {"text"}) events, then ("done", {"pages"})
+        
+        Tokens are forwarded as the LLM generates them; the local answer is
+        streamed a sentence at a time.
+        """
+        full_context, passages, error = await asyncio.to_thread(
+            self._chat_context, prompt, pdf_path, context, extract_method, pages
+        )
+        if error:
+            yield "error", {"message": error}
+            return
+        
+        if self._external_llm_enabled("chat"):
+            async for piece in self.external_llm.astream_response(prompt, full_context, "pdf_analysis"):
+                yield "token", {"text": piece}
+            yield "done", {"pages": _pages_used(passages)}
+            return
+        
+        result = await asyncio.to_thread(
+            self._local_chat_with_sources, prompt, full_context, passages, pdf_path, context, extract_method, pages
+        )
+        for piece in sentence_pieces(result["response"]):
+            yield "token", {"text": piece}
+        yield "done", {"pages": result["pages"]}
+    
+    def _chat_context(self, prompt, pdf_path, context, extract_method, pages):
+        """Return (context, retrieved passages or None, error message or None) for a chat message"""
+        passages = None
         
         # If we're given direct context, use that
         if context:
-            full_context = context
+            return context, None, None
+        
+        # Otherwise retrieve the relevant passages, or extract the whole PDF
+        if not pdf_path:
+            return None, None, "No PDF specified. Please upload a PDF first."
+        
+        if CHAT_RETRIEVAL:
+            try:
+                passages = self.retrieve_passages(pdf_path, prompt, extract_method, pages) or None
+            except Exception as e:
+                print(f"Passage retrieval failed, sending the whole document: {str(e)}")
+        
+        if passages is not None:
+            full_context = format_chunks(passages)
+            print(f"Retrieved {len(passages)} passages (~{estimate_tokens(full_context)} tokens) for chat")
         else:
-            # Otherwise extract the text from the PDF
-            if not pdf_path:
-                return "No PDF specified. Please upload a PDF first."
-            
-            full_context = self.extract_text(pdf_path, extract_method)
-            
-            if not full_context:
-                return "Failed to extract text from the PDF file."
+            full_context = self.extract_text(pdf_path, extract_method, pages, remove_boilerplate=True)
         
-        # Prompt for chat generation
-        prompt_type = "pdf_analysis"
+        if not full_context:
+            return None, None, "Failed to extract text from the PDF file."
+        return full_context, passages, None
+    
+    def _llm_chat(self, llm_response, passages):
+        """Return the chat result for an LLM answer, or None if it is too short to use"""
+        if llm_response and len(llm_response) > 20:
+            print(f"Received chat response ({len(llm_response)} chars)")
+            return {"response": llm_response, "pages": _pages_used(passages)}
+        print(f"Received short or empty chat response, falling back to local")
+        return None
+    
+    def _local_chat_with_sources(self, prompt, full_context, passages, pdf_path, context, extract_method, pages):
+        """Answer locally, from the document's best passages when there is one"""
+        if passages is None and not context:
+            try:
+                passages = self.search_passages(pdf_path, prompt, LOCAL_CHAT_PASSAGES, extract_method, pages) or None
+            except Exception as e:
+                print(f"BM25 search failed, ranking the context instead: {str(e)}")
         
-        # Try external LLM for better chat
+        document = pdf_path if not context else None
+        return {
+            "response": self._local_chat(prompt, full_context, passages, document, extract_method),
+            "pages": _pages_used(passages)
+        }
+    
+    def _external_llm_enabled(self, task):
+        """Return whether config enables the external LLM, logging the choice for a task"""
         try:
             import config
             if config.ENABLE_EXTERNAL_LLM:
-                print(f"Using {config.LLM_PROVIDER} for chat")
-                
-                # Try to use external LLM
-                llm_response = self.external_llm.generate_response(prompt, full_context, prompt_type)
-                
-                # Ensure we got a valid response
-                if llm_response and len(llm_response) > 20:
-                    print(f"Received chat response ({len(llm_response)} chars)")
-                    return llm_response
-                else:
-                    print(f"Received short or empty chat response, falling back to local")
-            else:
-                print("External LLM disabled, using local chat")
-        except Exception as e:
-            print(f"Error using external LLM for chat: {e}")
+                print(f"Using {config.LLM_PROVIDER} for {task}")
+                return True
+            print(f"External LLM disabled, using local {task}")
+        except ImportError:
+            print(f"Config module not found, using local {task}")
+        return False
+    
+    def retrieve_passages(self, pdf_path, query, extract_method="hybrid", pages=None,
+                          top_k=None, max_tokens=None):
+        """Select the passages to answer a query from, within a token budget
+        
+        The top_k best BM25 passages are taken in score order while they fit
+        in max_tokens. If nothing matches the query, the document's leading
+        passages are used instead.
+        
+        Returns:
+            A list of {"id", "page", "pages", "text", "score"} dicts in document order
+        """
+        top_k = top_k or CHAT_TOP_K
+        max_tokens = max_tokens or CHAT_CONTEXT_TOKENS
+        
+        candidates = self.search_passages(pdf_path, query, top_k, extract_method, pages)
+        if not candidates:
+            candidates = [dict(chunk, score=0.0) for chunk in self.chunks(pdf_path, extract_method, pages)[:top_k]]
+        
+        selected = []
+        used_tokens = 0
+        for passage in candidates:
+            tokens = estimate_tokens(passage["text"])
+            if selected and used_tokens + tokens > max_tokens:
+                continue
+            selected.append(passage)
+            used_tokens += tokens
+        
+        return sorted(selected, key=lambda passage: passage["id"])
+    
+    def _local_chat(self, prompt, context, passages=None, pdf_path=None, extract_method="hybrid"):
+        """Answer a chat message locally from the passages most relevant to it
         
-        # Fallback to local processing
-        return self._local_chat(prompt, full_context)
+        Uses the given retrieved passages, best first, or else ranks the
+        paragraphs of the context. When the passages or context come from
+        pdf_path, their sentences are sliced from its stored offsets.
+        """
+        if passages:
+            ranked = sorted(passages, key=lambda passage: passage["score"], reverse=True)[:LOCAL_CHAT_PASSAGES]
+            texts = [passage["text"] for passage in ranked]
+            pieces = [(passage["page"], passage["text"]) for passage in ranked]
+        else:
+            paragraphs = [p.strip() for p in re.split(r'\n\s*\n', context or "") if p.strip()]
+            scores = self.advanced_llm.rank_paragraphs(self.advanced_llm.preprocess(prompt), paragraphs)
+            
+            # The page each paragraph starts on, from the markers before it
+            start_pages = []
+            page = None
+            for paragraph in paragraphs:
+                start_pages.append(page)
+                markers = _PAGE_MARKER.findall(paragraph)
+                page = int(markers[-1]) if markers else page
+            
+            ranked = sorted(zip(paragraphs, scores, start_pages), key=lambda item: item[1], reverse=True)
+            ranked = [item for item in ranked[:LOCAL_CHAT_PASSAGES] if item[1] > 0]
+            texts = [paragraph for paragraph, _, _ in ranked]
+            pieces = [(page, paragraph) for paragraph, _, page in ranked]
+        
+        paragraph_sentences = self.document_sentences(pdf_path, pieces, extract_method) if pdf_path and pieces else None
+        return self.advanced_llm.generate_answer(prompt, texts, paragraph_sentences=paragraph_sentences)
 
-    def simplify(self, text):
-        """Simplify complex text to make it more readable"""
+    def simplify(self, text=None, pdf_path=None, extract_method="hybrid", pages=None):
+        """Simplify complex text to make it more readable
+        
+        If no text is given, the text of pdf_path (optionally only the given pages) is simplified;
+        concurrent identical simplifications of the same document share one run.
+        """
+        key = self._flight_key("simplify", pdf_path, extract_method, pages) if not text and pdf_path else None
+        if key is None:
+            return self._simplify(text, pdf_path, extract_method, pages)
+        return singleflight.do(key, lambda: self._simplify(text, pdf_path, extract_method, pages))
+    
+    def _simplify(self, text=None, pdf_path=None, extract_method="hybrid", pages=None):
+        from_document = not text and pdf_path
+        if from_document:
+            text = self.document_context(pdf_path, extract_method, pages)
+        
         if not text:
             return "No text provided for simplification."
         
-        try:
-            import config
-            if config.ENABLE_EXTERNAL_LLM:
-                print(f"Using {config.LLM_PROVIDER} for text simplification")
-                
-                # Create prompt for simplification
-                prompt = "Simplify the following text to make it more accessible and easier to understand while preserving the meaning."
-                
-                # Try to use external LLM
-                llm_response = self.external_llm.generate_response(prompt, text, prompt_type="simplification")
-                
-                # Ensure we got a valid response
-                if llm_response and len(llm_response) > 20:
-                    print(f"Received simplified text ({len(llm_response)} chars)")
-                    return llm_response
-                else:
-                    print(f"Received short or empty simplification, falling back to local")
-            else:
-                print("External LLM disabled, using local simplification")
-        except ImportError:
-            print("Config module not found, using local simplification")
-        except Exception as e:
-            print(f"Error using external LLM for simplification: {e}")
+        if self._external_llm_enabled("simplification"):
+            try:
+                with self._sending(pdf_path, text, extract_method) if from_document else contextlib.nullcontext():
+                    simplified = self._llm_simplification(
+                        self.external_llm.generate_response(SIMPLIFY_PROMPT, text, prompt_type="simplification")
+                    )
+                if simplified is not None:
+                    return simplified
+            except Exception as e:
+                print(f"Error using external LLM for simplification: {e}")
         
         # Fall back to rule-based simplification
-        return self._rule_based_simplification(text)
+        sentences = self.context_sentences(pdf_path, text, extract_method) if from_document else None
+        return self._rule_based_simplification(text, sentences)
 
-    def _rule_based_simplification(self, text):
-        """Simplify text using rule-based approach"""
+    async def asimplify(self, text=None, pdf_path=None, extract_method="hybrid", pages=None):
+        """Async simplify: PDF work runs in worker threads and the LLM is awaited"""
+        key = None
+        if not text and pdf_path:
+            key = await asyncio.to_thread(self._flight_key, "simplify", pdf_path, extract_method, pages)
+        if key is None:
+            return await self._asimplify(text, pdf_path, extract_method, pages)
+        return await singleflight.ado(key, lambda: self._asimplify(text, pdf_path, extract_method, pages))
+    
+    async def _asimplify(self, text=None, pdf_path=None, extract_method="hybrid", pages=None):
+        from_document = not text and pdf_path
+        if from_document:
+            text = await asyncio.to_thread(self.document_context, pdf_path, extract_method, pages)
+        
+        if not text:
+            return "No text provided for simplification."
+        
+        if self._external_llm_enabled("simplification"):
+            try:
+                with self._sending(pdf_path, text, extract_method) if from_document else contextlib.nullcontext():
+                    simplified = self._llm_simplification(
+                        await self.external_llm.agenerate_response(SIMPLIFY_PROMPT, text, prompt_type="simplification")
+                    )
+                if simplified is not None:
+                    return simplified
+            except Exception as e:
+                print(f"Error using external LLM for simplification: {e}")
+        
+        sentences = await asyncio.to_thread(self.context_sentences, pdf_path, text, extract_method) if from_document else None
+        return await asyncio.to_thread(self._rule_based_simplification, text, sentences)
+
+    def _llm_simplification(self, llm_response):
+        """Return LLM-simplified text, or None if it is too short to use"""
+        if llm_response and len(llm_response) > 20:
+            print(f"Received simplified text ({len(llm_response)} chars)")
+            return llm_response
+        print(f"Received short or empty simplification, falling back to local")
+        return None
+
+    def _rule_based_simplification(self, text, sentences=None):
+        """Simplify text using rule-based approach
+        
+        sentences are the text's, when sliced from the document's stored offsets.
+        """
         if not text:
             return ""
             
         # Split into sentences
-        try:
-            sentences = sent_tokenize(text)
-        except:
-            sentences = [s.strip() + '.' for s in text.split('.') if s.strip()]
+        if sentences is None:
+            sentences = split_sentences(text)
         
         simplified_sentences = []
         
@@ -1609,53 +2396,78 @@ class AIService:
             print(f"Error extracting JSON from response: {e}")
             return None
 
-    def create_mindmap(self, pdf_path, extract_method="hybrid"):
-        """Create a mindmap based on PDF content"""
-        full_text = self.extract_text(pdf_path, extract_method)
+    def create_mindmap(self, pdf_path, extract_method="hybrid", pages=None):
+        """Create a mindmap based on PDF content
+        
+        Concurrent identical mindmaps of the same document share one run.
+        """
+        key = self._flight_key("mindmap", pdf_path, extract_method, pages)
+        if key is None:
+            return self._create_mindmap(pdf_path, extract_method, pages)
+        return singleflight.do(key, lambda: self._create_mindmap(pdf_path, extract_method, pages))
+    
+    def _create_mindmap(self, pdf_path, extract_method="hybrid", pages=None):
+        # Chunks from across the document, within the context budget
+        full_text = self.document_context(pdf_path, extract_method, pages)
         
         if not full_text:
             return {"error": "Failed to extract text from the PDF file."}
-            
-        # Limit text length to avoid token limits
-        if len(full_text) > 10000:
-            print(f"Limiting input text for mindmap from {len(full_text)} to 10000 chars")
-            full_text = full_text[:10000]
-        
-        # Prompt for mindmap generation
-        prompt = "Create a hierarchical mindmap of the main concepts and ideas in this document. Return the result as a properly formatted JSON structure."
         
         # Try external LLM for better mindmap generation
-        try:
-            import config
-            if config.ENABLE_EXTERNAL_LLM:
-                try:
-                    print(f"Using {config.LLM_PROVIDER} provider for mindmap generation")
-                    
-                    # Try external LLM to generate a structured outline for the mindmap
-                    llm_response = self.external_llm.generate_response(prompt, full_text, prompt_type="mindmap")
-                    
-                    # Ensure we got a valid response
-                    if llm_response and len(llm_response) > 20:
-                        print(f"Received mindmap response ({len(llm_response)} chars). Processing...")
-                        
-                        # Try to extract JSON from response
-                        mindmap_data = self._extract_mindmap_json(llm_response)
-                        if mindmap_data:
-                            return mindmap_data
-                    else:
-                        print(f"Received short or empty mindmap response: {llm_response[:50]}...")
-                except Exception as e:
-                    print(f"Error using external LLM for mindmap: {e}")
-            else:
-                print("External LLM disabled, using local mindmap generation")
-        except ImportError:
-            print("Config module not found, using local mindmap generation")
+        if self._external_llm_enabled("mindmap generation"):
+            try:
+                with self._sending(pdf_path, full_text, extract_method):
+                    mindmap_data = self._llm_mindmap(
+                        self.external_llm.generate_response(MINDMAP_PROMPT, full_text, prompt_type="mindmap")
+                    )
+                if mindmap_data:
+                    return mindmap_data
+            except Exception as e:
+                print(f"Error using external LLM for mindmap: {e}")
         
         # Fall back to local processing for mindmap
-        return self._local_mindmap(full_text)
+        return self._local_mindmap(full_text, self.context_sentences(pdf_path, full_text, extract_method))
+        
+    async def acreate_mindmap(self, pdf_path, extract_method="hybrid", pages=None):
+        """Async create_mindmap: PDF work runs in worker threads and the LLM is awaited"""
+        key = await asyncio.to_thread(self._flight_key, "mindmap", pdf_path, extract_method, pages)
+        if key is None:
+            return await self._acreate_mindmap(pdf_path, extract_method, pages)
+        return await singleflight.ado(key, lambda: self._acreate_mindmap(pdf_path, extract_method, pages))
+    
+    async def _acreate_mindmap(self, pdf_path, extract_method="hybrid", pages=None):
+        full_text = await asyncio.to_thread(self.document_context, pdf_path, extract_method, pages)
+        
+        if not full_text:
+            return {"error": "Failed to extract text from the PDF file."}
         
-    def _local_mindmap(self, text):
-        """Generate a mindmap structure locally without using an external LLM"""
+        if self._external_llm_enabled("mindmap generation"):
+            try:
+                with self._sending(pdf_path, full_text, extract_method):
+                    mindmap_data = self._llm_mindmap(
+                        await self.external_llm.agenerate_response(MINDMAP_PROMPT, full_text, prompt_type="mindmap")
+                    )
+                if mindmap_data:
+                    return mindmap_data
+            except Exception as e:
+                print(f"Error using external LLM for mindmap: {e}")
+        
+        sentences = await asyncio.to_thread(self.context_sentences, pdf_path, full_text, extract_method)
+        return await asyncio.to_thread(self._local_mindmap, full_text, sentences)
+    
+    def _llm_mindmap(self, llm_response):
+        """Return the mindmap parsed from an LLM response, or None if there is none"""
+        if not llm_response or len(llm_response) <= 20:
+            print(f"Received short or empty mindmap response: {(llm_response or '')[:50]}...")
+            return None
+        print(f"Received mindmap response ({len(llm_response)} chars). Processing...")
+        return self._extract_mindmap_json(llm_response)
+    
+    def _local_mindmap(self, text, sentences=None):
+        """Generate a mindmap structure locally without using an external LLM
+        
+        sentences are the text's, when sliced from the document's stored offsets.
+        """
         try:
             # Simple implementation to generate a mindmap
             lines = text.split('\n')
@@ -1675,18 +2487,8 @@ class AIService:
             }
             
             # Extract sentences
-            sentences = []
-            for line in lines:
-                if line.strip():
-                    try:
-                        # Make sure we use the global sent_tokenize function
-                        from nltk.tokenize import sent_tokenize
-                        line_sentences = sent_tokenize(line)
-                        sentences.extend(line_sentences)
-                    except:
-                        # Fallback if sentence tokenization fails
-                        parts = [p.strip() + '.' for p in line.split('.') if p.strip()]
-                        sentences.extend(parts)
+            if sentences is None:
+                sentences = split_sentences(text)
             
             # Generate word frequency
             words = []
@@ -1796,93 +2598,405 @@ class AIService:
             self.logger.error(f"Error extracting text from PDF: {str(e)}")
             raise
 
-    def extract_text(self, pdf_path, extract_method="hybrid"):
-        """Extract text from a PDF file using the specified method"""
+    def iter_pages(self, pdf_path, extract_method="hybrid", pages=None):
+        """Yield (page_number, text) for each page of a PDF, in page order
+        
+        Pages are served from the text cache when available. Otherwise they
+        are extracted one at a time (range by range across the process pool
+        for large documents) and streamed into the cache as they are yielded,
+        so consumers never need the whole document in memory.
+        
+        Args:
+            pdf_path: Path to the PDF file
+            extract_method: "simple", "blocks" or "hybrid"
+            pages: Optional 1-based page numbers; only these pages are opened
+            
+        Raises:
+            FileNotFoundError: If the PDF does not exist
+            ImportError: If PyMuPDF is not installed
+            ValueError: If the PDF cannot be opened
+        """
+        if not os.path.exists(pdf_path):
+            raise FileNotFoundError(f"PDF file not found: {pdf_path}")
+        
+        # Unknown methods fall through to hybrid, so cache them under that name
+        if extract_method not in ("simple", "blocks"):
+            extract_method = "hybrid"
+        
+        metadata = stored_metadata(pdf_path)
+        if pages is not None:
+            pages = sorted({int(page) for page in pages if int(page) > 0})
+            # Drop pages past the end without opening the document
+            if metadata is not None:
+                pages = [page for page in pages if page <= metadata["page_count"]]
+                if not pages:
+                    return
+        
+        # Reuse a previous extraction of the same content with the same method
+        cached_pages = text_cache.lookup(pdf_path, extract_method, pages)
+        if cached_pages is not None:
+            print(f"Using cached {extract_method} text for {pdf_path}")
+            yield from cached_pages
+            return
+        
+        # A page range only touches the requested pages and leaves the document cache alone
+        if pages is not None:
+            yield from self._extract_pages(pdf_path, extract_method, pages)
+            return
+        
+        writer = text_cache.writer(pdf_path, extract_method)
+        try:
+            for page_number, text in self._extract_pages(pdf_path, extract_method):
+                writer.add(page_number, text)
+                yield page_number, text
+            writer.commit()
+        finally:
+            writer.close()
+    
+    def _extract_pages(self, pdf_path, extract_method, pages=None):
+        """Extract pages with PyMuPDF, bypassing the text cache"""
+        import fitz  # PyMuPDF
+        
+        # Open the PDF and check if it's valid
+        try:
+            doc = fitz.open(pdf_path)
+            print(f"Successfully opened PDF with {doc.page_count} pages.")
+        except Exception as e:
+            print(f"Error opening PDF: {str(e)}")
+            raise ValueError(f"Could not open the PDF file. Error: {str(e)}")
+        
+        try:
+            page_count = doc.page_count
+            
+            if pages is not None:
+                for page_number in pages:
+                    if page_number <= page_count:
+                        yield page_number, page_text(doc.load_page(page_number - 1), extract_method)
+                return
+            
+            next_page = 0
+            
+            # Large documents are split into page ranges across the process pool
+            if should_parallelize(page_count):
+                try:
+                    for chunk in imap_ranges(extract_fitz_range, pdf_path, page_count, extract_method):
+                        for page_number, text in chunk:
+                            yield page_number, text
+                            next_page = page_number
+                except Exception as e:
+                    print(f"Parallel extraction failed at page {next_page + 1}, continuing serially: {str(e)}")
+                    reset_pool()
+            
+            for page_num in range(next_page, page_count):
+                yield page_num + 1, page_text(doc.load_page(page_num), extract_method)
+        finally:
+            doc.close()
+
+    def iter_content_pages(self, pdf_path, extract_method="hybrid", pages=None):
+        """Yield (page_number, text) like iter_pages, without the document's repeated headers and footers
+        
+        A page range uses the lines detected over the whole document at
+        ingest; before that, it detects them among the requested pages only,
+        so no other page is extracted.
+        """
+        if not REMOVE_BOILERPLATE:
+            yield from self.iter_pages(pdf_path, extract_method, pages)
+            return
+        
+        if pages is None:
+            repeated = get_boilerplate(
+                pdf_path, extract_method, lambda: self.iter_pages(pdf_path, extract_method)
+            )["repeated"]
+            content = self.iter_pages(pdf_path, extract_method)
+        else:
+            record = stored_boilerplate(pdf_path, extract_method)
+            content = list(self.iter_pages(pdf_path, extract_method, pages))
+            repeated = record["repeated"] if record is not None else find_repeated_lines(content)
+        
+        for page_number, text in content:
+            yield page_number, strip_page(text, repeated)[0] if repeated else text
+    
+    def chunks(self, pdf_path, extract_method="hybrid", pages=None):
+        """Return the document's token-bounded, overlapping chunks
+        
+        The whole document is chunked once and cached; a page range is
+        chunked on the fly from just those pages.
+        """
+        if extract_method not in ("simple", "blocks"):
+            extract_method = "hybrid"
+        if pages is not None:
+            return chunk_pages(self.iter_content_pages(pdf_path, extract_method, pages))
+        return get_chunks(pdf_path, extract_method, lambda: self.iter_content_pages(pdf_path, extract_method))
+    
+    def document_context(self, pdf_path, extract_method="hybrid", pages=None, max_tokens=None):
+        """Return document text for an LLM prompt, within a token budget
+        
+        Documents that fit are returned whole. Longer ones are represented by
+        chunks spread evenly across them, so the model sees every part of the
+        document rather than only its beginning.
+        """
+        max_tokens = max_tokens or LLM_CONTEXT_TOKENS
+        try:
+            chunks = self.chunks(pdf_path, extract_method, pages)
+        except (FileNotFoundError, ImportError, ValueError) as e:
+            print(f"Could not chunk {pdf_path}: {str(e)}")
+            chunks = None
+        
+        # extract_text also turns empty or unreadable documents into a readable message
+        if not chunks or sum(chunk["tokens"] for chunk in chunks) <= max_tokens:
+            return self.extract_text(pdf_path, extract_method, pages, remove_boilerplate=True)
+        
+        selected = select_spread(chunks, max_tokens)
+        print(f"Using {len(selected)} of {len(chunks)} chunks to fit {max_tokens} tokens")
+        return format_chunks(selected)
+    
+    def sentence_index(self, pdf_path, extract_method="hybrid"):
+        """Return the document's per-page sentence offsets, splitting it on first use
+        
+        Split at ingest; page_sentences() and document_sentences() slice the
+        document's text with it. Returns None if the document cannot be read.
+        """
+        if extract_method not in ("simple", "blocks"):
+            extract_method = "hybrid"
+        try:
+            return get_sentence_index(pdf_path, extract_method, lambda: self.iter_content_pages(pdf_path, extract_method))
+        except (FileNotFoundError, ImportError, ValueError) as e:
+            print(f"Could not split sentences of {pdf_path}: {str(e)}")
+            return None
+    
+    def page_sentences(self, pdf_path, extract_method="hybrid", pages=None):
+        """Return [(page_number, sentences)] for the document's content pages, or only the given ones
+        
+        Sentences are sliced from the offsets stored at ingest, and only the
+        requested pages' text is read. A document without stored offsets has
+        just the requested pages split, in memory.
+        """
+        if extract_method not in ("simple", "blocks"):
+            extract_method = "hybrid"
+        if pages is None:
+            index = self.sentence_index(pdf_path, extract_method)
+        else:
+            index = stored_sentence_index(pdf_path, extract_method)
+        content = self.iter_content_pages(pdf_path, extract_method, pages)
+        if index is None:
+            content = list(content)
+            index = build_sentence_index(content)
+        return [(page_number, index.page_sentences(page_number, text)) for page_number, text in content]
+    
+    def document_sentences(self, pdf_path, pieces, extract_method="hybrid"):
+        """Return the sentences of pieces of a document's text without splitting them
+        
+        Each piece gets the sentences of its pages (see page_sentences())
+        that appear in it, in document order.
+        
+        Args:
+            pdf_path: Path to the PDF file the text comes from
+            pieces: List of (page_number, text): text starts on page_number, or
+                with None on the page the previous piece ended on. "[Page n]"
+                markers (see format_page() and format_chunks()) move to page n.
+            
+        Returns:
+            One list of sentences per piece, or None if the document cannot be read
+        """
+        segments = []
+        page = None
+        for start_page, text in pieces:
+            page = start_page if start_page is not None else page
+            parts = _PAGE_MARKER.split(text)
+            piece = [(page, parts[0])]
+            for i in range(1, len(parts), 2):
+                page = int(parts[i])
+                piece.append((page, parts[i + 1]))
+            segments.append(piece)
+        
+        wanted = sorted({page for piece in segments for page, _ in piece if page is not None})
+        try:
+            by_page = dict(self.page_sentences(pdf_path, extract_method, wanted)) if wanted else {}
+        except (FileNotFoundError, ImportError, ValueError) as e:
+            print(f"Could not read the sentences of {pdf_path}: {str(e)}")
+            return None
+        return [
+            [sentence for page, segment in piece for sentence in by_page.get(page, ()) if sentence in segment]
+            for piece in segments
+        ]
+    
+    def context_sentences(self, pdf_path, text, extract_method="hybrid"):
+        """Return the sentences of text built from a document (extract_text(), document_context())
+        
+        Returns None for text without page markers, which is not the document's.
+        """
+        if not text or not _PAGE_MARKER.search(text):
+            return None
+        sentences = self.document_sentences(pdf_path, [(None, text)], extract_method)
+        return sentences[0] if sentences is not None else None
+    
+    @contextlib.contextmanager
+    def _sending(self, pdf_path, text, extract_method="hybrid"):
+        """While document text is sent to the LLM, let the mock generation slice its sentences"""
+        token = _context_sentences.set((text, lambda: self.context_sentences(pdf_path, text, extract_method)))
+        try:
+            yield
+        finally:
+            _context_sentences.reset(token)
+    
+    def _chunk_passages(self, pdf_path, extract_method):
+        return ((chunk["page"], chunk["pages"][-1], chunk["text"]) for chunk in self.chunks(pdf_path, extract_method))
+    
+    def bm25_index(self, pdf_path, extract_method="hybrid"):
+        """Return the document's BM25 index over its chunks, building it on first use"""
+        if extract_method not in ("simple", "blocks"):
+            extract_method = "hybrid"
+        return bm25_cache.get(
+            pdf_path,
+            self.advanced_llm.preprocess,
+            lambda: self._chunk_passages(pdf_path, extract_method),
+            extract_method
+        )
+    
+    def vector_index(self, pdf_path, extract_method="hybrid"):
+        """Return the document's semantic vector index over its chunks, building it on first use"""
+        if extract_method not in ("simple", "blocks"):
+            extract_method = "hybrid"
+        return vector_cache.get(
+            pdf_path,
+            self.advanced_llm.preprocess,
+            lambda: self._chunk_passages(pdf_path, extract_method),
+            extract_method
+        )
+    
+    def search_passages(self, pdf_path, query, top_k=5, extract_method="hybrid", pages=None):
+        """Return the passages of a PDF most relevant to a query
+        
+        Keyword (BM25) matches are merged with semantic (vector) matches by
+        reciprocal rank when VECTOR_SEARCH is on, so paraphrased questions
+        still find their passages; the score is then the fused rank score.
+        
+        A page range is searched in the document's indexes if they exist;
+        otherwise only the chunks of those pages are extracted and ranked,
+        rather than indexing the whole document for one restricted question.
+        
+        Returns:
+            A list of {"id", "page", "pages", "text", "score"} dicts, best first
+        """
+        if extract_method not in ("simple", "blocks"):
+            extract_method = "hybrid"
+        query_tokens = self.advanced_llm.preprocess(query)
+        
+        if pages is None:
+            index = self.bm25_index(pdf_path, extract_method)
+            vectors = self.vector_index(pdf_path, extract_method) if VECTOR_SEARCH else None
+        else:
+            index = bm25_cache.peek(pdf_path, extract_method)
+            if index is None:
+                chunks = self.chunks(pdf_path, extract_method, pages)
+                ranked = rank_passages([self.advanced_llm.preprocess(chunk["text"]) for chunk in chunks], query_tokens, top_k)
+                return [dict(chunks[passage_id], score=score) for passage_id, score in ranked]
+            vectors = vector_cache.peek(pdf_path, extract_method) if VECTOR_SEARCH else None
+        
+        # Repeated questions reuse their ranking until the document changes
+        doc_hash = content_hash(pdf_path)
+        params = (extract_method, top_k, tuple(sorted(set(pages))) if pages is not None else None, vectors is not None)
+        ranked = query_cache.get(doc_hash, query_tokens, params)
+        if ranked is None:
+            ranked = index.search(query_tokens, top_k, pages)
+            if vectors is not None:
+                semantic = vectors.search(query_tokens, top_k, pages)
+                ranked = reciprocal_rank_fusion([ranked, semantic], top_k)
+            query_cache.put(doc_hash, query_tokens, params, ranked)
+        
+        results = []
+        for passage_id, score in ranked:
+            results.append({
+                "id": passage_id,
+                "page": index.page(passage_id),
+                "pages": index.pages(passage_id),
+                "text": index.passage(passage_id),
+                "score": score
+            })
+        return results
+    
+    def search_corpus(self, query, top_k=10, pages_per_document=3):
+        """Search every uploaded PDF for a query
+        
+        The global term dictionary picks the documents; each one's BM25 index
+        then finds its best passages.
+        
+        Returns:
+            A list of {"filename", "score", "pages", "matches"} dicts, best
+            document first; matches are {"page", "pages", "snippet", "score"}
+        """
+        query_tokens = self.advanced_llm.preprocess(query)
+        results = []
+        for filename, _, score in corpus_index.search(query_tokens, top_k):
+            pdf_path = os.path.join(self.upload_dir, filename)
+            if not os.path.exists(pdf_path):
+                continue
+            index = self.bm25_index(pdf_path)
+            matches = [
+                {
+                    "page": index.page(passage_id),
+                    "pages": index.pages(passage_id),
+                    "snippet": make_snippet(index.passage(passage_id), query),
+                    "score": passage_score
+                }
+                for passage_id, passage_score in index.search(query_tokens, pages_per_document)
+            ]
+            results.append({
+                "filename": filename,
+                "score": score,
+                "pages": sorted({page for match in matches for page in match["pages"]}),
+                "matches": matches
+            })
+        return results
+    
+    def extract_text(self, pdf_path, extract_method="hybrid", pages=None, remove_boilerplate=False):
+        """Extract text from a PDF file using the specified method
+        
+        If pages (1-based page numbers) is given, only those pages are extracted.
+        With remove_boilerplate, lines repeated across the document's pages
+        (running headers, footers, disclaimers) are left out.
+        """
         if not os.path.exists(pdf_path):
             print(f"PDF file not found: {pdf_path}")
             return ""
         
+        if extract_method not in ("simple", "blocks"):
+            extract_method = "hybrid"
+        
+        # A document known to have no text layer needs no extraction to say so
+        metadata = stored_metadata(pdf_path)
+        if metadata is not None and metadata["page_count"] and not metadata["total_chars"] and not pages:
+            print(f"Metadata shows no text layer in {pdf_path}")
+            return "The PDF file appears to contain no extractable text. It might be scanned or image-based."
+        
         try:
-            # Try importing PyMuPDF
-            try:
-                import fitz  # PyMuPDF
-            except ImportError as e:
-                print(f"PyMuPDF import error: {str(e)}")
-                # Fallback to simple text extraction
-                return f"Error: PyMuPDF (fitz) package is not installed. Please install it with 'pip install pymupdf'"
+            page_iter = self.iter_content_pages if remove_boilerplate else self.iter_pages
+            page_texts = [
+                format_page(page_number, text, extract_method)
+                for page_number, text in page_iter(pdf_path, extract_method, pages)
+            ]
             
-            # Open the PDF and check if it's valid
-            try:
-                doc = fitz.open(pdf_path)
-                if doc.page_count == 0:
-                    print(f"PDF has 0 pages: {pdf_path}")
-                    return "The PDF document appears to be empty (0 pages)."
-                
-                print(f"Successfully opened PDF with {doc.page_count} pages.")
-            except Exception as e:
-                print(f"Error opening PDF: {str(e)}")
-                return f"Could not open the PDF file. Error: {str(e)}"
-            
-            # Determine the extraction method
-            if extract_method == "simple":
-                # Simple extraction just gets the text as is
-                text = ""
-                for page_num in range(len(doc)):
-                    page = doc.load_page(page_num)
-                    page_text = page.get_text()
-                    text += f"[Page {page_num + 1}] " + page_text
-                    text += "\n\n"
-                
-                # Check if we got any meaningful text
-                if not text.strip():
-                    print("No text extracted with simple method")
-                    return "The PDF file appears to contain no extractable text. It might be scanned or image-based."
-                
-                return text
-            
-            elif extract_method == "blocks":
-                # Block extraction preserves layout better
-                text = ""
-                for page_num in range(len(doc)):
-                    page = doc.load_page(page_num)
-                    blocks = page.get_text("blocks")
-                    page_text = f"[Page {page_num + 1}] "
-                    
-                    for block in blocks:
-                        if block[6] == 0:  # Text blocks only
-                            page_text += block[4] + " "
-                    
-                    text += page_text.strip() + "\n\n"
-                
-                # Check if we got any meaningful text
-                if not text.strip():
-                    print("No text extracted with blocks method")
-                    return "The PDF file appears to contain no extractable text. It might be scanned or image-based."
-                
-                return text
+            if not page_texts:
+                if pages:
+                    print(f"None of pages {pages} exist in {pdf_path}")
+                    return "The requested pages do not exist in the PDF document."
+                print(f"PDF has 0 pages: {pdf_path}")
+                return "The PDF document appears to be empty (0 pages)."
             
-            else:  # hybrid is default
-                # Hybrid uses a combination of methods
-                text = ""
-                for page_num in range(len(doc)):
-                    page = doc.load_page(page_num)
-                    
-                    # Try getting text with layout preservation
-                    try:
-                        page_text = f"[Page {page_num + 1}] " + page.get_text("text")
-                    except:
-                        # Fallback to simple text extraction
-                        page_text = f"[Page {page_num + 1}] " + page.get_text()
-                    
-                    text += page_text.strip() + "\n\n"
-                
-                # Check if we got any meaningful text
-                if not text.strip() or len(text.strip()) < 10:
-                    print("No text extracted with hybrid method")
-                    return "The PDF file appears to contain no extractable text. It might be scanned or image-based."
-                
-                return text
+            text = "".join(page_texts)
+            
+            # Check if we got any meaningful text
+            if not text.strip() or (extract_method == "hybrid" and len(text.strip()) < 10):
+                print(f"No text extracted with {extract_method} method")
+                return "The PDF file appears to contain no extractable text. It might be scanned or image-based."
+            
+            return text
         
+        except ImportError as e:
+            print(f"PyMuPDF import error: {str(e)}")
+            return f"Error: PyMuPDF (fitz) package is not installed. Please install it with 'pip install pymupdf'"
+        except ValueError as e:
+            return str(e)
         except Exception as e:
             print(f"Error extracting text from PDF: {str(e)}")
             import traceback
@@ -1891,10 +3005,4 @@ class AIService:
 
 # Singleton instance
 ai_service = AIService() 
-
-def sent_tokenize(text):
-    """Simple sentence tokenizer function"""
-    # Split by common sentence-ending punctuation
-    # This is a simplified version that doesn't handle all cases
-    sentences = re.split(r'(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s', text)
-    return [s.strip() for s in sentences if s.strip()] 
\ No newline at end of file
+ 
\ No newline at end of file
@@ -0,0 +1,392 @@
+"""
+Persistent per-document BM25 index
+
+Passages are the document's chunks (see app/chunking.py). The index is
+written once per extraction method, to a bm25_<method>/ directory next to
+the document's other cached artifacts:
+
+    meta.json               passage count, average length, BM25 parameters
+    vocab.bin               sorted UTF-8 terms separated by newlines
+    vocab_offsets.npy       int64 start offset of each term in vocab.bin (+ end)
+    df.npy                  int32 document frequency per term
+    post_offsets.npy        int64 start of each term's postings (+ end)
+    post_docs.npy           int32 passage ids, grouped by term
+    post_tfs.npy            int32 term frequencies, parallel to post_docs
+    doc_lens.npy            int32 tokens per passage
+    passage_pages.npy       int32 first page of each passage
+    passage_last_pages.npy  int32 last page of each passage
+    passages.bin            page store of the passage texts, keyed by id + 1
+
+Arrays are opened with mmap_mode="r", so opening an index reads a few
+bytes of metadata and a query only pages in the postings of its terms.
+"""
+
+import os
+import json
+import mmap
+import shutil
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from app.doc_cache import content_hash, document_dir, write_json_atomic
+from app.page_store import PageStore, PageStoreWriter
+
+INDEX_DIR_NAME = "bm25"
+
+# Bump when the index layout changes so old indexes are rebuilt
+INDEX_VERSION = 2
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+# Open indexes kept in memory
+OPEN_INDEXES = 16
+
+def publish_index(tmp_dir, index_dir):
+    """Move a freshly built index directory into place, replacing any existing one
+
+    Indexes are only built when index_dir is missing or could not be
+    loaded (out of date or corrupt), so an existing directory is stale: it
+    is renamed aside and deleted before the new one is renamed in.
+    """
+    if os.path.isdir(index_dir):
+        stale_dir = f"{index_dir}.{os.getpid()}.{threading.get_ident()}.stale"
+        os.replace(index_dir, stale_dir)
+        shutil.rmtree(stale_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, index_dir)
+    except OSError:
+        # Another process published its build between the two renames; keep theirs
+        if not os.path.isdir(index_dir):
+            raise
+
+
+def build_index(index_dir, passages, tokenize):
+    """Build and write a BM25 index
+
+    Args:
+        index_dir: Directory to create; built in a temporary directory and renamed into place
+        passages: Iterable of (first_page, last_page, text)
+        tokenize: Function mapping text to a list of terms; queries must use the same one
+    """
+    tmp_dir = f"{index_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        postings = {}
+        doc_lens = []
+        passage_pages = []
+        passage_last_pages = []
+        with PageStoreWriter(os.path.join(tmp_dir, "passages.bin")) as store:
+            for first_page, last_page, text in passages:
+                passage_id = len(doc_lens)
+                tokens = tokenize(text)
+                for term, count in Counter(tokens).items():
+                    postings.setdefault(term, []).append((passage_id, count))
+                doc_lens.append(len(tokens))
+                passage_pages.append(first_page)
+                passage_last_pages.append(last_page)
+                store.add(passage_id + 1, text)
+
+        terms = sorted(postings, key=lambda term: term.encode("utf-8"))
+        encoded = [term.encode("utf-8") for term in terms]
+        vocab_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(term) + 1 for term in encoded], out=vocab_offsets[1:])
+        with open(os.path.join(tmp_dir, "vocab.bin"), "wb") as f:
+            f.write(b"".join(term + b"\n" for term in encoded))
+
+        post_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[term]) for term in terms], out=post_offsets[1:])
+        post_docs = np.empty(int(post_offsets[-1]), dtype=np.int32)
+        post_tfs = np.empty(int(post_offsets[-1]), dtype=np.int32)
+        for i, term in enumerate(terms):
+            entries = postings[term]
+            post_docs[post_offsets[i]:post_offsets[i + 1]] = [passage_id for passage_id, _ in entries]
+            post_tfs[post_offsets[i]:post_offsets[i + 1]] = [count for _, count in entries]
+
+        np.save(os.path.join(tmp_dir, "vocab_offsets.npy"), vocab_offsets)
+        np.save(os.path.join(tmp_dir, "df.npy"), np.diff(post_offsets).astype(np.int32))
+        np.save(os.path.join(tmp_dir, "post_offsets.npy"), post_offsets)
+        np.save(os.path.join(tmp_dir, "post_docs.npy"), post_docs)
+        np.save(os.path.join(tmp_dir, "post_tfs.npy"), post_tfs)
+        np.save(os.path.join(tmp_dir, "doc_lens.npy"), np.asarray(doc_lens, dtype=np.int32))
+        np.save(os.path.join(tmp_dir, "passage_pages.npy"), np.asarray(passage_pages, dtype=np.int32))
+        np.save(os.path.join(tmp_dir, "passage_last_pages.npy"), np.asarray(passage_last_pages, dtype=np.int32))
+
+        write_json_atomic(os.path.join(tmp_dir, "meta.json"), {
+            "version": INDEX_VERSION,
+            "passages": len(doc_lens),
+            "terms": len(terms),
+            "postings": int(post_offsets[-1]),
+            "avg_passage_length": float(np.mean(doc_lens)) if doc_lens else 0.0,
+            "k1": K1,
+            "b": B,
+        })
+
+        publish_index(tmp_dir, index_dir)
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def rank_passages(passage_tokens, query_tokens, top_k=5):
+    """Return [(passage_id, score)] for the best of a few passages held in memory, best first
+
+    Scores like BM25Index.search, for passage sets not worth an index on disk
+    (the chunks of a page range of a document that has none yet).
+
+    Args:
+        passage_tokens: One list of terms per passage
+        query_tokens: Query terms, from the same tokenizer
+    """
+    if not passage_tokens:
+        return []
+    counts = [Counter(tokens) for tokens in passage_tokens]
+    doc_lens = np.asarray([len(tokens) for tokens in passage_tokens], dtype=np.float32)
+    norm = K1 * (1 - B + B * doc_lens / (float(doc_lens.mean()) or 1.0))
+    scores = np.zeros(len(passage_tokens), dtype=np.float32)
+    for term, query_count in Counter(query_tokens).items():
+        tfs = np.asarray([passage_counts.get(term, 0) for passage_counts in counts], dtype=np.float32)
+        df = int(np.count_nonzero(tfs))
+        if not df:
+            continue
+        idf = np.log(1 + (len(passage_tokens) - df + 0.5) / (df + 0.5))
+        scores += query_count * idf * tfs * (K1 + 1) / (tfs + norm)
+    matched = np.flatnonzero(scores)
+    ranked = sorted(matched.tolist(), key=lambda passage_id: (-scores[passage_id], passage_id))[:top_k]
+    return [(passage_id, float(scores[passage_id])) for passage_id in ranked]
+
+
+class BM25Index:
+    """Read-only, memory-mapped BM25 index"""
+
+    def __init__(self, index_dir):
+        self.index_dir = str(index_dir)
+        with open(os.path.join(self.index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"BM25 index version {self.meta.get('version')} is out of date: {self.index_dir}")
+
+        def load(name):
+            return np.load(os.path.join(self.index_dir, name), mmap_mode="r")
+
+        self.vocab_offsets = load("vocab_offsets.npy")
+        self.df = load("df.npy")
+        self.post_offsets = load("post_offsets.npy")
+        self.post_docs = load("post_docs.npy")
+        self.post_tfs = load("post_tfs.npy")
+        self.doc_lens = load("doc_lens.npy")
+        self.passage_pages = load("passage_pages.npy")
+        self.passage_last_pages = load("passage_last_pages.npy")
+
+        self.num_passages = self.meta["passages"]
+        self.num_terms = self.meta["terms"]
+        self.avgdl = self.meta["avg_passage_length"] or 1.0
+        self.k1 = self.meta["k1"]
+        self.b = self.meta["b"]
+
+        self._vocab_file = open(os.path.join(self.index_dir, "vocab.bin"), "rb")
+        self._vocab = mmap.mmap(self._vocab_file.fileno(), 0, access=mmap.ACCESS_READ) if self.num_terms else b""
+        self._passages = PageStore(os.path.join(self.index_dir, "passages.bin")) if self.num_passages else None
+        self._norm = None
+
+    def __len__(self):
+        return self.num_passages
+
+    def _term(self, i):
+        return self._vocab[self.vocab_offsets[i]:self.vocab_offsets[i + 1] - 1]
+
+    def term_id(self, term):
+        """Binary-search the term dictionary; return the term's id or None"""
+        key = term.encode("utf-8")
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_terms and self._term(lo) == key:
+            return lo
+        return None
+
+    def terms(self):
+        """Yield (term, passages containing it) for every indexed term, in sorted order"""
+        for i in range(self.num_terms):
+            yield self._term(i).decode("utf-8"), int(self.df[i])
+
+    def _length_norm(self):
+        # k1 * (1 - b + b * dl / avgdl) per passage, computed on first query
+        if self._norm is None:
+            self._norm = self.k1 * (1 - self.b + self.b * np.asarray(self.doc_lens, dtype=np.float32) / self.avgdl)
+        return self._norm
+
+    def search(self, query_tokens, top_k=5, pages=None):
+        """Return [(passage_id, score)] for the best passages, best first
+
+        If pages is given, only passages covering one of those page numbers are returned.
+        """
+        if not self.num_passages:
+            return []
+
+        scores = None
+        for term, query_count in Counter(query_tokens).items():
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            start, end = int(self.post_offsets[term_id]), int(self.post_offsets[term_id + 1])
+            docs = np.asarray(self.post_docs[start:end])
+            tfs = np.asarray(self.post_tfs[start:end], dtype=np.float32)
+            df = end - start
+            idf = np.log(1 + (self.num_passages - df + 0.5) / (df + 0.5))
+            if scores is None:
+                scores = np.zeros(self.num_passages, dtype=np.float32)
+            scores[docs] += query_count * idf * tfs * (self.k1 + 1) / (tfs + self._length_norm()[docs])
+
+        if scores is None:
+            return []
+        if pages is not None:
+            # A passage covers a requested page if the first requested page at or after its start is within it
+            wanted = np.unique(np.asarray(list(pages), dtype=np.int32))
+            following = np.searchsorted(wanted, self.passage_pages)
+            covered = following < len(wanted)
+            covered[covered] = wanted[following[covered]] <= self.passage_last_pages[covered]
+            scores[~covered] = 0
+        matched = np.flatnonzero(scores)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        ranked = sorted(matched.tolist(), key=lambda passage_id: (-scores[passage_id], passage_id))
+        return [(passage_id, float(scores[passage_id])) for passage_id in ranked]
+
+    def passage(self, passage_id):
+        """Return the text of a passage"""
+        return self._passages[passage_id + 1]
+
+    def page(self, passage_id):
+        """Return the first page of a passage"""
+        return int(self.passage_pages[passage_id])
+
+    def pages(self, passage_id):
+        """Return the page numbers a passage covers"""
+        return list(range(int(self.passage_pages[passage_id]), int(self.passage_last_pages[passage_id]) + 1))
+
+    def close(self):
+        if isinstance(self._vocab, mmap.mmap):
+            self._vocab.close()
+        self._vocab_file.close()
+        if self._passages is not None:
+            self._passages.close()
+
+
+class BM25Cache:
+    """Opens (building on first use) the BM25 index of a document and keeps recent ones open"""
+
+    # Subclasses caching other per-document indexes override these
+    dir_name = INDEX_DIR_NAME
+    label = "BM25 index"
+
+    def __init__(self, max_open=OPEN_INDEXES):
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self.opens = 0
+        self.builds = 0
+        self.hits = 0
+
+    def index_dir(self, pdf_path, extract_method="hybrid"):
+        return os.path.join(document_dir(content_hash(pdf_path)), f"{self.dir_name}_{extract_method}")
+
+    def peek(self, pdf_path, extract_method="hybrid"):
+        """Return the index for a document if it is open or stored, or None; never builds"""
+        index_dir = self.index_dir(pdf_path, extract_method)
+        with self._lock:
+            index = self._open.get(index_dir)
+            if index is not None:
+                self._open.move_to_end(index_dir)
+                self.hits += 1
+                return index
+        index = self._load(index_dir)
+        if index is not None:
+            with self._lock:
+                self._open[index_dir] = index
+                self._open.move_to_end(index_dir)
+                while len(self._open) > self.max_open:
+                    self._open.popitem(last=False)
+        return index
+
+    def get(self, pdf_path, tokenize, passages, extract_method="hybrid"):
+        """Return the index for a document
+
+        Args:
+            pdf_path: Path to the PDF file
+            tokenize: Tokenizer used to build the index (and to be used on queries)
+            passages: Callable returning an iterator of (first_page, last_page, text),
+                used only to build
+            extract_method: Extraction method the pages come from
+        """
+        index_dir = self.index_dir(pdf_path, extract_method)
+        with self._lock:
+            index = self._open.get(index_dir)
+            if index is not None:
+                self._open.move_to_end(index_dir)
+                self.hits += 1
+                return index
+            build_lock = self._build_locks.setdefault(index_dir, threading.Lock())
+
+        # One build per document; concurrent callers wait and then open the result
+        with build_lock:
+            with self._lock:
+                index = self._open.get(index_dir)
+            if index is None:
+                index = self._load(index_dir)
+            if index is None:
+                print(f"Building {self.label} for {pdf_path}")
+                os.makedirs(os.path.dirname(index_dir), exist_ok=True)
+                self._build(index_dir, passages(), tokenize)
+                self.builds += 1
+                index = self._load(index_dir)
+                if index is None:
+                    raise RuntimeError(f"{self.label} {index_dir} could not be opened after building it")
+
+        with self._lock:
+            self._open[index_dir] = index
+            self._open.move_to_end(index_dir)
+            # Evicted indexes may still be in use by a query; their maps close when released
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+            self._build_locks.pop(index_dir, None)
+        return index
+
+    def _build(self, index_dir, passages, tokenize):
+        build_index(index_dir, passages, tokenize)
+
+    def _open_index(self, index_dir):
+        return BM25Index(index_dir)
+
+    def _load(self, index_dir):
+        if not os.path.exists(os.path.join(index_dir, "meta.json")):
+            return None
+        try:
+            index = self._open_index(index_dir)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Rebuilding {self.label} {index_dir}: {str(e)}")
+            return None
+        self.opens += 1
+        return index
+
+    def stats(self):
+        """Return open/build counters"""
+        with self._lock:
+            return {
+                "open_indexes": len(self._open),
+                "hits": self.hits,
+                "opens": self.opens,
+                "builds": self.builds,
+            }
+
+
+# Singleton instance
+bm25_cache = BM25Cache()
@@ -0,0 +1,185 @@
+"""
+Cross-page header, footer and disclaimer removal
+
+Every line is hashed after normalizing case and whitespace; short lines
+at the top or bottom of a page are also hashed with digits masked, so
+"Page 3 of 40" matches "Page 4 of 40". A hash seen on enough pages marks
+boilerplate that is removed before the text is sent to an LLM. The repeated hashes
+and the savings are stored per document and extraction method.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+
+from app.doc_cache import content_hash, document_dir, write_json_atomic
+
+try:
+    import config
+    REMOVE_BOILERPLATE = config.REMOVE_BOILERPLATE
+except (ImportError, AttributeError):
+    REMOVE_BOILERPLATE = True
+
+# Short lines this close to the top or bottom of a page may differ only in their digits
+EDGE_LINES = 3
+EDGE_MAX_WORDS = 8
+
+# A line is boilerplate if it appears on at least this many pages and this share of all pages
+MIN_REPEAT_PAGES = 3
+MIN_REPEAT_FRACTION = 0.5
+
+# Rough size of an LLM token in English text, for reporting
+CHARS_PER_TOKEN = 4
+
+_DIGITS = re.compile(r"\d+")
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _line_keys(text):
+    """Yield (line, exact_key, edge_key) for each line; edge_key is None away from the page edges"""
+    lines = text.split("\n")
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    edges = set(content[:EDGE_LINES]) | set(content[-EDGE_LINES:])
+    for i, line in enumerate(lines):
+        normalized = " ".join(line.split()).lower()
+        if not normalized:
+            yield line, None, None
+            continue
+        edge_key = None
+        if i in edges and len(normalized.split()) <= EDGE_MAX_WORDS:
+            edge_key = "e" + _digest(_DIGITS.sub("#", normalized))
+        yield line, _digest(normalized), edge_key
+
+
+def find_repeated_lines(pages):
+    """Return the set of line hashes repeated across pages
+
+    Args:
+        pages: Iterable of (page_number, text)
+    """
+    page_counts = {}
+    page_count = 0
+    for _, text in pages:
+        page_count += 1
+        keys = set()
+        for _, exact_key, edge_key in _line_keys(text):
+            if exact_key:
+                keys.add(exact_key)
+            if edge_key:
+                keys.add(edge_key)
+        for key in keys:
+            page_counts[key] = page_counts.get(key, 0) + 1
+
+    threshold = max(MIN_REPEAT_PAGES, MIN_REPEAT_FRACTION * page_count)
+    return {key for key, count in page_counts.items() if count >= threshold}
+
+
+def strip_page(text, repeated):
+    """Remove repeated lines from one page; return (text, lines_removed, chars_removed)"""
+    if not repeated:
+        return text, 0, 0
+    kept = []
+    lines_removed = 0
+    for line, exact_key, edge_key in _line_keys(text):
+        if exact_key in repeated or edge_key in repeated:
+            lines_removed += 1
+        else:
+            kept.append(line)
+    if not lines_removed:
+        return text, 0, 0
+    stripped = "\n".join(kept).strip()
+    return stripped, lines_removed, len(text) - len(stripped)
+
+
+def strip_repeated_lines(pages):
+    """Remove boilerplate from an in-memory set of pages
+
+    Args:
+        pages: Dict of {page_number: text}
+
+    Returns:
+        (cleaned pages dict, stats dict)
+    """
+    repeated = find_repeated_lines(pages.items())
+    cleaned = {}
+    stats = {"lines_removed": 0, "chars_saved": 0}
+    for page_number, text in pages.items():
+        cleaned[page_number], lines_removed, chars_removed = strip_page(text, repeated)
+        stats["lines_removed"] += lines_removed
+        stats["chars_saved"] += chars_removed
+    stats["tokens_saved"] = stats["chars_saved"] // CHARS_PER_TOKEN
+    return cleaned, stats
+
+
+def _record_path(pdf_path, extract_method):
+    return os.path.join(document_dir(content_hash(pdf_path)), f"boilerplate_{extract_method}.json")
+
+
+def stored_boilerplate(pdf_path, extract_method):
+    """Return the document's boilerplate record if it has been detected, else None"""
+    path = _record_path(pdf_path, extract_method)
+
+    with _memo_lock:
+        if path in _memo:
+            return _memo[path]
+
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+        record["repeated"] = set(record["repeated"])
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Rebuilding unreadable boilerplate record {path}: {str(e)}")
+        return None
+
+    with _memo_lock:
+        _memo[path] = record
+    return record
+
+
+def get_boilerplate(pdf_path, extract_method, pages):
+    """Return the boilerplate record for a document, detecting it on first use
+
+    The record holds the repeated line hashes and how many lines,
+    characters and estimated tokens removing them saves.
+
+    Args:
+        pdf_path: Path to the PDF file
+        extract_method: Extraction method the pages come from
+        pages: Callable returning a fresh iterator of (page_number, text)
+            over the whole document; called twice on a miss
+    """
+    record = stored_boilerplate(pdf_path, extract_method)
+    if record is None:
+        path = _record_path(pdf_path, extract_method)
+        repeated = find_repeated_lines(pages())
+        record = {"repeated": repeated, "lines_removed": 0, "chars_saved": 0, "chars_total": 0}
+        for _, text in pages():
+            _, lines_removed, chars_removed = strip_page(text, repeated)
+            record["lines_removed"] += lines_removed
+            record["chars_saved"] += chars_removed
+            record["chars_total"] += len(text)
+        record["tokens_saved"] = record["chars_saved"] // CHARS_PER_TOKEN
+        print(f"Boilerplate in {pdf_path}: {record['lines_removed']} lines, "
+              f"{record['chars_saved']} chars (~{record['tokens_saved']} tokens)")
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json_atomic(path, dict(record, repeated=sorted(repeated)))
+
+        with _memo_lock:
+            _memo[path] = record
+    return record
+
+
+def boilerplate_stats(record):
+    """Return the savings in a record, without the line hashes"""
+    return {key: value for key, value in record.items() if key != "repeated"}
@@ -0,0 +1,220 @@
+"""
+Token-bounded, overlapping chunks of a document with page provenance
+
+Pages are cut into units at paragraph boundaries (and at line boundaries
+inside paragraphs that are too long on their own). Consecutive units are
+packed into chunks of at most CHUNK_TOKENS estimated tokens; each new chunk
+starts with the last CHUNK_OVERLAP_TOKENS of the previous one. A unit never
+spans two pages, so every chunk knows the pages it covers.
+
+Chunks are computed once per document and extraction method and stored
+next to the other cached artifacts, so chat retrieval, summaries, mind
+maps and simplification share one chunking pass.
+"""
+
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+
+from app.boilerplate import CHARS_PER_TOKEN
+from app.doc_cache import content_hash, document_dir, write_json_atomic
+
+try:
+    import config
+    CHUNK_TOKENS = config.CHUNK_TOKENS
+    CHUNK_OVERLAP_TOKENS = config.CHUNK_OVERLAP_TOKENS
+except (ImportError, AttributeError):
+    CHUNK_TOKENS = 300
+    CHUNK_OVERLAP_TOKENS = 40
+
+# Bump when the chunking rules change so cached chunks are rebuilt
+CHUNK_VERSION = 1
+
+# Chunk lists kept in memory
+MEMORY_DOCUMENTS = 16
+
+_BLANK_LINES = re.compile(r"\n\s*\n")
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Estimate the LLM tokens in a text (about four characters per token for English)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _split_long(text, max_tokens):
+    """Split a line longer than max_tokens at whitespace"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    while len(text) > max_chars:
+        cut = text.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars
+        yield text[:cut].strip()
+        text = text[cut:].strip()
+    if text:
+        yield text
+
+
+def _units(text, max_tokens):
+    """Yield (text, starts_paragraph) units of at most max_tokens from one page"""
+    for paragraph in _BLANK_LINES.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            yield paragraph, True
+            continue
+
+        starts_paragraph = True
+        current = []
+        for line in paragraph.split("\n"):
+            for piece in _split_long(line.strip(), max_tokens):
+                if current and estimate_tokens("\n".join(current + [piece])) > max_tokens:
+                    yield "\n".join(current), starts_paragraph
+                    current, starts_paragraph = [], False
+                current.append(piece)
+        if current:
+            yield "\n".join(current), starts_paragraph
+
+
+def _make_chunk(chunk_id, units):
+    parts = []
+    previous_page = None
+    for page_number, text, _, starts_paragraph in units:
+        if previous_page is None:
+            parts.append(text)
+        elif page_number != previous_page:
+            parts.append(f"\n\n[Page {page_number}] {text}")
+        else:
+            parts.append(("\n\n" if starts_paragraph else "\n") + text)
+        previous_page = page_number
+    text = "".join(parts)
+    return {
+        "id": chunk_id,
+        "page": units[0][0],
+        "pages": sorted({unit[0] for unit in units}),
+        "text": text,
+        "tokens": estimate_tokens(text),
+    }
+
+
+def chunk_pages(pages, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Split pages into overlapping chunks
+
+    Args:
+        pages: Iterable of (page_number, text) in page order
+        max_tokens: Estimated token limit per chunk
+        overlap_tokens: Tokens repeated from the end of the previous chunk
+
+    Returns:
+        A list of {"id", "page", "pages", "text", "tokens"} dicts; "page" is
+        the first page and later pages are marked inline as "[Page n]"
+    """
+    chunks = []
+    current = []        # (page_number, text, tokens, starts_paragraph)
+    current_tokens = 0
+    fresh = 0           # Units in current that are not overlap from the previous chunk
+
+    for page_number, text in pages:
+        for unit_text, starts_paragraph in _units(text, max_tokens):
+            tokens = estimate_tokens(unit_text)
+            if fresh and current_tokens + tokens > max_tokens:
+                chunks.append(_make_chunk(len(chunks), current))
+
+                # Carry the tail of the chunk over, as long as it leaves room for the new unit
+                carried = []
+                carried_tokens = 0
+                for unit in reversed(current):
+                    if carried_tokens + unit[2] > min(overlap_tokens, max_tokens - tokens):
+                        break
+                    carried.insert(0, unit)
+                    carried_tokens += unit[2]
+                current, current_tokens, fresh = carried, carried_tokens, 0
+
+            current.append((page_number, unit_text, tokens, starts_paragraph))
+            current_tokens += tokens
+            fresh += 1
+
+    if fresh:
+        chunks.append(_make_chunk(len(chunks), current))
+    return chunks
+
+
+def get_chunks(pdf_path, extract_method, pages):
+    """Return a document's chunks, chunking it on first use
+
+    Args:
+        pdf_path: Path to the PDF file
+        extract_method: Extraction method the pages come from
+        pages: Callable returning an iterator of (page_number, text) over the
+            whole document; only called on a miss
+    """
+    path = os.path.join(document_dir(content_hash(pdf_path)), f"chunks_{extract_method}.json")
+    params = {"version": CHUNK_VERSION, "max_tokens": CHUNK_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS}
+
+    with _memo_lock:
+        if path in _memo:
+            _memo.move_to_end(path)
+            return _memo[path]
+
+    chunks = None
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("params") == params:
+                chunks = stored["chunks"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Rechunking unreadable chunk file {path}: {str(e)}")
+
+    if chunks is None:
+        chunks = chunk_pages(pages())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_json_atomic(path, {"params": params, "chunks": chunks})
+
+    with _memo_lock:
+        _memo[path] = chunks
+        while len(_memo) > MEMORY_DOCUMENTS:
+            _memo.popitem(last=False)
+    return chunks
+
+
+def select_spread(chunks, max_tokens):
+    """Pick chunks spread evenly over the document that fit in max_tokens, in document order"""
+    total = sum(chunk["tokens"] for chunk in chunks)
+    if total <= max_tokens:
+        return list(chunks)
+
+    average = total / len(chunks)
+    count = max(1, int(max_tokens // average))
+    step = len(chunks) / count
+    selected = []
+    used = 0
+    for i in range(count):
+        chunk = chunks[int(i * step)]
+        if selected and used + chunk["tokens"] > max_tokens:
+            continue
+        selected.append(chunk)
+        used += chunk["tokens"]
+    return selected
+
+
+def format_chunks(chunks):
+    """Join chunks into an LLM context, each tagged with its first page"""
+    return "\n\n".join(f"[Page {chunk['page']}] {chunk['text']}" for chunk in chunks)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to about max_tokens, at the last paragraph or line boundary that fits"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    for boundary in ("\n\n", "\n", " "):
+        cut = text.rfind(boundary, 0, max_chars)
+        if cut > max_chars // 2:
+            return text[:cut]
+    return text[:max_chars]
@@ -0,0 +1,244 @@
+"""
+Global term dictionary for searching across every uploaded document
+
+Each document's BM25 index (app/bm25_index.py) is one shard of the corpus.
+A SQLite database in the cache directory records, for every term, how many
+documents contain it and, per document, how many of its passages do, along
+with the uploaded filenames that point at each document.
+
+A query reads only the dictionary rows of its own terms (leaving out terms
+common to most documents when a rarer one is present) and ranks candidate
+documents by global IDF; only the shards of the best candidates are opened
+to find pages and snippets. The work therefore
+grows with the number of documents containing the query terms, not with the
+size of the corpus.
+"""
+
+import os
+import re
+import math
+import sqlite3
+import threading
+
+from app.doc_cache import CACHE_DIR
+
+CORPUS_DB_NAME = "corpus.sqlite3"
+
+# Terms in more than this share of the documents are skipped when a rarer term is present
+COMMON_TERM_FRACTION = 0.5
+
+# Characters of passage text around the first match
+SNIPPET_CHARS = 240
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id INTEGER PRIMARY KEY,
+    content_hash TEXT UNIQUE NOT NULL,
+    passages INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    filename TEXT PRIMARY KEY,
+    doc_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_doc ON files (doc_id);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT PRIMARY KEY,
+    documents INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    df INTEGER NOT NULL,
+    PRIMARY KEY (term, doc_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);
+"""
+
+
+class CorpusIndex:
+    """Term -> document dictionary over the per-document BM25 shards"""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, CORPUS_DB_NAME)
+        self._lock = threading.Lock()
+        self._conn = None
+        self._live_documents = None
+        self.searches = 0
+
+    def _connection(self):
+        # Opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            self._live_documents = self._conn.execute(
+                "SELECT COUNT(DISTINCT doc_id) FROM files"
+            ).fetchone()[0]
+        return self._conn
+
+    def add_document(self, filename, doc_hash, index):
+        """Point a filename at a document, adding the document's terms if they are new
+
+        A document no filename points at any more (a file re-uploaded with
+        new content) is dropped, so it no longer counts towards term IDF.
+
+        Args:
+            filename: Uploaded filename
+            doc_hash: Content hash of the file
+            index: The document's BM25Index
+        """
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                row = conn.execute("SELECT doc_id FROM documents WHERE content_hash = ?", (doc_hash,)).fetchone()
+                if row is None:
+                    doc_id = conn.execute(
+                        "INSERT INTO documents (content_hash, passages) VALUES (?, ?)", (doc_hash, len(index))
+                    ).lastrowid
+                    terms = list(index.terms())
+                    conn.executemany(
+                        "INSERT INTO postings (term, doc_id, df) VALUES (?, ?, ?)",
+                        ((term, doc_id, df) for term, df in terms)
+                    )
+                    conn.executemany(
+                        "INSERT INTO terms (term, documents) VALUES (?, 1) "
+                        "ON CONFLICT (term) DO UPDATE SET documents = documents + 1",
+                        ((term,) for term, _ in terms)
+                    )
+                else:
+                    doc_id = row[0]
+                previous = conn.execute("SELECT doc_id FROM files WHERE filename = ?", (filename,)).fetchone()
+                conn.execute(
+                    "INSERT INTO files (filename, doc_id) VALUES (?, ?) "
+                    "ON CONFLICT (filename) DO UPDATE SET doc_id = excluded.doc_id",
+                    (filename, doc_id)
+                )
+                if previous is not None and previous[0] != doc_id and conn.execute(
+                    "SELECT 1 FROM files WHERE doc_id = ? LIMIT 1", (previous[0],)
+                ).fetchone() is None:
+                    self._drop_document(conn, previous[0])
+            self._live_documents = conn.execute("SELECT COUNT(DISTINCT doc_id) FROM files").fetchone()[0]
+            return doc_id
+
+    def _drop_document(self, conn, doc_id):
+        # Uncount the document's terms, forgetting those no other document has
+        conn.execute(
+            "UPDATE terms SET documents = documents - 1 "
+            "WHERE term IN (SELECT term FROM postings WHERE doc_id = ?)", (doc_id,)
+        )
+        conn.execute(
+            "DELETE FROM terms WHERE documents <= 0 "
+            "AND term IN (SELECT term FROM postings WHERE doc_id = ?)", (doc_id,)
+        )
+        conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+        conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    def filenames(self):
+        """Return the set of registered filenames"""
+        with self._lock:
+            return {row[0] for row in self._connection().execute("SELECT filename FROM files")}
+
+    def search(self, query_tokens, limit=10):
+        """Rank the documents containing query terms
+
+        Each document scores sum(idf * (1 + log(passages containing the term)))
+        over the query terms it contains, where idf is the term's global BM25
+        IDF. Documents matching more distinct terms rank first.
+
+        Returns:
+            A list of (filename, content_hash, score) tuples, best first; a
+            document uploaded under several names appears once per name
+        """
+        counts = {}
+        for term in query_tokens:
+            counts[term] = counts.get(term, 0) + 1
+
+        with self._lock:
+            conn = self._connection()
+            self.searches += 1
+            total = self._live_documents
+            if not counts or not total:
+                return []
+
+            placeholders = ",".join("?" * len(counts))
+            frequencies = dict(conn.execute(
+                f"SELECT term, documents FROM terms WHERE term IN ({placeholders})", list(counts)
+            ))
+            if not frequencies:
+                return []
+
+            # Rare terms decide the candidates; very common ones would read most of the dictionary
+            rarest = min(frequencies.values())
+            selective = [
+                term for term, documents in frequencies.items()
+                if documents <= COMMON_TERM_FRACTION * total or documents == rarest
+            ]
+
+            scores = {}
+            matched = {}
+            for term in selective:
+                documents = frequencies[term]
+                idf = math.log(1 + (total - documents + 0.5) / (documents + 0.5))
+                for doc_id, df in conn.execute("SELECT doc_id, df FROM postings WHERE term = ?", (term,)):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + counts[term] * idf * (1 + math.log(df))
+                    matched[doc_id] = matched.get(doc_id, 0) + 1
+
+            # Over-fetch, since documents no longer uploaded under any name are dropped below
+            ranked = sorted(scores, key=lambda doc_id: (-matched[doc_id], -scores[doc_id], doc_id))[:limit * 2]
+            if not ranked:
+                return []
+            placeholders = ",".join("?" * len(ranked))
+            files = {}
+            for filename, doc_id, doc_hash in conn.execute(
+                f"SELECT f.filename, f.doc_id, d.content_hash FROM files f JOIN documents d USING (doc_id) "
+                f"WHERE f.doc_id IN ({placeholders}) ORDER BY f.filename", ranked
+            ):
+                files.setdefault(doc_id, []).append((filename, doc_hash))
+
+        results = []
+        for doc_id in ranked:
+            for filename, doc_hash in files.get(doc_id, []):
+                results.append((filename, doc_hash, scores[doc_id]))
+        return results[:limit]
+
+    def stats(self):
+        """Return dictionary sizes and the number of searches"""
+        with self._lock:
+            conn = self._connection()
+            return {
+                "documents": self._live_documents,
+                "files": conn.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+                "terms": conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0],
+                "searches": self.searches,
+            }
+
+
+def make_snippet(text, query, width=SNIPPET_CHARS):
+    """Return about width characters of text around where the most query words occur together"""
+    text = " ".join(text.split())
+    words = [re.escape(word) for word in re.findall(r"\w{3,}", query)]
+    matches = list(re.finditer(r"\b(" + "|".join(words) + r")", text, re.IGNORECASE)) if words else []
+
+    # Anchor on the match followed by the most distinct query words within the window
+    anchor = 0
+    best = 0
+    for i, match in enumerate(matches):
+        found = {m.group(1).lower() for m in matches[i:] if m.start() < match.start() + width * 2 // 3}
+        if len(found) > best:
+            anchor, best = match.start(), len(found)
+
+    start = max(0, anchor - width // 3)
+    if start:
+        # Begin at a word boundary
+        space = text.find(" ", start)
+        start = space + 1 if 0 <= space < start + 20 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        end = space if space > start else end
+    return ("..." if start else "") + text[start:end] + ("..." if end < len(text) else "")
+
+
+# Singleton instance
+corpus_index = CorpusIndex()
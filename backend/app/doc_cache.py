@@ -0,0 +1,217 @@
+"""
+Content-addressed cache for text extracted from PDF documents
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from app.page_store import PageStore, PageStoreWriter
+
+try:
+    import config
+    CACHE_DIR = config.CACHE_DIR
+    TEXT_CACHE_MEMORY_ITEMS = config.TEXT_CACHE_MEMORY_ITEMS
+    TEXT_CACHE_MEMORY_MAX_CHARS = config.TEXT_CACHE_MEMORY_MAX_CHARS
+except (ImportError, AttributeError):
+    CACHE_DIR = "cache"
+    TEXT_CACHE_MEMORY_ITEMS = 32
+    TEXT_CACHE_MEMORY_MAX_CHARS = 4000000
+
+# Maps absolute path -> ((mtime_ns, size), sha256) so unchanged files are never re-hashed
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def content_hash(path):
+    """Return the SHA-256 of a file's content
+
+    The digest is memoized per path and only recomputed when the file's
+    mtime or size changes, so repeated lookups cost a single stat() call.
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(key)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _hash_lock:
+        memo = _hash_memo.get(key)
+    if memo and memo[0] == signature:
+        return memo[1]
+
+    digest = hashlib.sha256()
+    with open(key, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    doc_hash = digest.hexdigest()
+
+    with _hash_lock:
+        _hash_memo[key] = (signature, doc_hash)
+    return doc_hash
+
+
+def document_dir(doc_hash, create=False):
+    """Return the directory holding derived artifacts for a document hash"""
+    path = os.path.join(CACHE_DIR, "docs", doc_hash)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_json_atomic(path, value):
+    """Write JSON to a temporary file and rename it into place"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class PageCacheWriter:
+    """Streams pages into a page store that is published to the cache on commit"""
+
+    def __init__(self, cache, key, path):
+        self.cache = cache
+        self.key = key
+        self._store = PageStoreWriter(path)
+        self._pages = []
+        self._chars = 0
+
+    def add(self, page_number, text):
+        """Append one page"""
+        self._store.add(page_number, text)
+        if self._pages is not None:
+            self._chars += len(text)
+            if self._chars <= self.cache.memory_max_chars:
+                self._pages.append((page_number, text))
+            else:
+                # Too large for the memory tier; keep only the disk copy
+                self._pages = None
+
+    def commit(self):
+        """Publish the entry to both tiers"""
+        self._store.commit()
+        if self._pages is not None:
+            self.cache._remember(self.key, self._pages)
+
+    def close(self):
+        """Discard the temporary file if the entry was never committed"""
+        self._store.close()
+
+
+class TextCache:
+    """Two-tier (memory LRU over disk) cache of extracted pages
+
+    Entries are keyed by (document content hash, extract_method), so a
+    re-uploaded or modified file automatically maps to a new key. Each
+    entry is an ordered list of (page_number, text) pairs; on disk it is
+    a page store (see app/page_store.py), so single pages can be read
+    without loading the whole document.
+    """
+
+    def __init__(self, memory_items=TEXT_CACHE_MEMORY_ITEMS, memory_max_chars=TEXT_CACHE_MEMORY_MAX_CHARS):
+        self.memory_items = memory_items
+        self.memory_max_chars = memory_max_chars
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk_path(self, doc_hash, extract_method, create=False):
+        return os.path.join(document_dir(doc_hash, create=create), f"pages_{extract_method}.bin")
+
+    def _remember(self, key, pages):
+        with self._lock:
+            self._memory[key] = pages
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _stream_disk(self, key, store, pages=None):
+        """Yield pages from an opened disk entry, promoting small documents to the memory tier"""
+        with store:
+            if pages is not None:
+                # Only the requested pages are decoded
+                for page_number in pages:
+                    text = store.get(page_number)
+                    if text is not None:
+                        yield page_number, text
+                return
+
+            promoted = []
+            chars = 0
+            for page_number, text in store:
+                if promoted is not None:
+                    chars += len(text)
+                    if chars <= self.memory_max_chars:
+                        promoted.append((page_number, text))
+                    else:
+                        promoted = None
+                yield page_number, text
+            if promoted is not None:
+                self._remember(key, promoted)
+
+    def lookup(self, pdf_path, extract_method, pages=None):
+        """Return an iterator over cached (page_number, text) pairs, or None on a miss
+
+        If pages (a sorted list of page numbers) is given, only those
+        pages are returned.
+        """
+        key = (content_hash(pdf_path), extract_method)
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                entries = self._memory[key]
+                if pages is None:
+                    return iter(entries)
+                wanted = set(pages)
+                return iter([entry for entry in entries if entry[0] in wanted])
+
+        disk_path = self._disk_path(*key)
+        if os.path.exists(disk_path):
+            # Validate the entry before handing out an iterator, so a corrupt one is a miss, not an error mid-stream
+            try:
+                store = PageStore(disk_path)
+            except (OSError, ValueError) as e:
+                print(f"Removing unreadable text cache entry {disk_path}: {str(e)}")
+                try:
+                    os.remove(disk_path)
+                except OSError:
+                    pass
+            else:
+                with self._lock:
+                    self.disk_hits += 1
+                return self._stream_disk(key, store, pages)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def writer(self, pdf_path, extract_method):
+        """Return a PageCacheWriter for a document that missed the cache"""
+        key = (content_hash(pdf_path), extract_method)
+        return PageCacheWriter(self, key, self._disk_path(*key, create=True))
+
+    def clear_memory(self):
+        """Drop the in-memory tier (the disk tier is kept)"""
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self):
+        """Return hit/miss counters for both tiers"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+# Singleton instance
+text_cache = TextCache()
@@ -0,0 +1,151 @@
+"""
+Per-document metadata computed once at ingest
+
+The record holds everything hot paths need to decide how to treat a
+document (page count, per-page text and image coverage, outline,
+encryption, content hash) so they never have to open the PDF for it.
+"""
+
+import os
+import json
+import time
+import threading
+
+from app.doc_cache import content_hash, document_dir, write_json_atomic
+
+METADATA_NAME = "metadata.json"
+
+# A page with fewer characters than this and mostly covered by images is treated as scanned
+SCANNED_MAX_CHARS = 100
+SCANNED_MIN_IMAGE_COVERAGE = 0.5
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def _image_coverage(page):
+    """Fraction of the page area covered by images (overlaps are not subtracted)"""
+    area = abs(page.rect)
+    if not area:
+        return 0.0
+    covered = sum(abs(page.rect & info["bbox"]) for info in page.get_image_info())
+    return round(min(covered / area, 1.0), 4)
+
+
+def build_metadata(pdf_path, page_texts=None):
+    """Compute the metadata record for a PDF
+
+    Args:
+        pdf_path: Path to the PDF file
+        page_texts: Optional iterable of (page_number, text) already extracted,
+            used for character counts instead of extracting again
+
+    Returns:
+        The metadata dict
+    """
+    import fitz  # PyMuPDF
+
+    chars_by_page = None
+    if page_texts is not None:
+        chars_by_page = {page_number: len(text) for page_number, text in page_texts}
+
+    with fitz.open(pdf_path) as doc:
+        pages = []
+        for page in doc:
+            page_number = page.number + 1
+            if chars_by_page is not None:
+                chars = chars_by_page.get(page_number, 0)
+            else:
+                chars = len(page.get_text().strip())
+            pages.append({
+                "page": page_number,
+                "width": round(page.rect.width, 2),
+                "height": round(page.rect.height, 2),
+                "chars": chars,
+                "image_coverage": _image_coverage(page),
+            })
+
+        info = doc.metadata or {}
+        metadata = {
+            "content_hash": content_hash(pdf_path),
+            "file_size": os.path.getsize(pdf_path),
+            "page_count": doc.page_count,
+            "encrypted": bool(doc.is_encrypted),
+            "needs_password": bool(doc.needs_pass),
+            "title": info.get("title") or None,
+            "author": info.get("author") or None,
+            "toc": [{"level": level, "title": title, "page": page} for level, title, page in doc.get_toc(simple=True)],
+            "pages": pages,
+        }
+
+    total_chars = sum(page["chars"] for page in pages)
+    metadata["total_chars"] = total_chars
+    metadata["avg_chars_per_page"] = round(total_chars / len(pages), 1) if pages else 0
+    metadata["scanned_pages"] = [
+        page["page"] for page in pages
+        if page["chars"] < SCANNED_MAX_CHARS and page["image_coverage"] >= SCANNED_MIN_IMAGE_COVERAGE
+    ]
+    metadata["created_at"] = time.time()
+    return metadata
+
+
+def _default_path(pdf_path):
+    return os.path.join(document_dir(content_hash(pdf_path)), METADATA_NAME)
+
+
+def stored_metadata(pdf_path, metadata_path=None):
+    """Return a document's metadata if it has already been computed, else None
+
+    Never opens the PDF, so hot paths can use it to make decisions cheaply.
+    """
+    if metadata_path is None:
+        metadata_path = _default_path(pdf_path)
+    metadata_path = str(metadata_path)
+
+    with _memo_lock:
+        if metadata_path in _memo:
+            return _memo[metadata_path]
+
+    if not os.path.exists(metadata_path):
+        return None
+    try:
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable metadata {metadata_path}: {str(e)}")
+        return None
+
+    with _memo_lock:
+        _memo[metadata_path] = metadata
+    return metadata
+
+
+def get_metadata(pdf_path, metadata_path=None, page_texts=None):
+    """Return a document's metadata, computing and storing it on first use
+
+    Args:
+        pdf_path: Path to the PDF file
+        metadata_path: Where the record lives; defaults to the document's
+            content-addressed cache directory
+        page_texts: Passed to build_metadata if the record has to be built
+    """
+    if metadata_path is None:
+        metadata_path = _default_path(pdf_path)
+    metadata_path = str(metadata_path)
+
+    metadata = stored_metadata(pdf_path, metadata_path)
+    if metadata is not None:
+        return metadata
+
+    metadata = build_metadata(pdf_path, page_texts)
+    os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
+    write_json_atomic(metadata_path, metadata)
+
+    with _memo_lock:
+        _memo[metadata_path] = metadata
+    return metadata
+
+
+def summarize_metadata(metadata):
+    """Return the document-level fields, without the per-page list"""
+    return {key: value for key, value in metadata.items() if key != "pages"}
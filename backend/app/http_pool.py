@@ -0,0 +1,150 @@
+"""
+Long-lived HTTP connections and LLM clients shared across requests and threads
+
+Creating a requests call or an SDK client per chat turn opens a new TCP
+connection and repeats the TLS handshake every time. Instead, one pooled
+requests.Session serves every direct HTTP call (keep-alive, up to
+HTTP_POOL_MAXSIZE connections per host for HTTP_POOL_CONNECTIONS hosts),
+and each provider SDK client is built once per provider and API key and
+reused, keeping its own connection pool warm.
+
+Async code paths share one httpx.AsyncClient with the same limits, so
+awaiting an LLM holds a keep-alive connection rather than a thread.
+"""
+
+import asyncio
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import config
+    HTTP_POOL_CONNECTIONS = config.HTTP_POOL_CONNECTIONS
+    HTTP_POOL_MAXSIZE = config.HTTP_POOL_MAXSIZE
+    HTTP_POOL_BLOCK = config.HTTP_POOL_BLOCK
+except (ImportError, AttributeError):
+    HTTP_POOL_CONNECTIONS = 10
+    HTTP_POOL_MAXSIZE = 20
+    HTTP_POOL_BLOCK = False
+
+_session = None
+_session_lock = threading.Lock()
+_clients = {}
+_clients_lock = threading.Lock()
+_async_client = None
+_async_loop = None
+_stats = {"requests": 0, "async_requests": 0, "clients_created": 0, "clients_reused": 0}
+
+
+class _CountingAdapter(HTTPAdapter):
+    def send(self, request, **kwargs):
+        _stats["requests"] += 1
+        return super().send(request, **kwargs)
+
+
+def get_session():
+    """Return the shared, pooled requests.Session"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = _CountingAdapter(
+                    pool_connections=HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=HTTP_POOL_MAXSIZE,
+                    pool_block=HTTP_POOL_BLOCK,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+async def _count_async_request(request):
+    _stats["async_requests"] += 1
+
+
+def get_async_client():
+    """Return the shared httpx.AsyncClient of the running event loop, or None without httpx"""
+    global _async_client, _async_loop
+    if httpx is None:
+        return None
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_CONNECTIONS * HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+            timeout=30,
+            event_hooks={"request": [_count_async_request]},
+        )
+        _async_loop = loop
+    return _async_client
+
+
+def get_client(key, factory):
+    """Return the client cached under key, creating it with factory() on first use
+
+    Args:
+        key: Hashable identity of the client, e.g. ("mistral", api_key)
+        factory: Zero-argument callable building the client
+    """
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _stats["clients_reused"] += 1
+            return client
+        client = factory()
+        _clients[key] = client
+        _stats["clients_created"] += 1
+        return client
+
+
+def close_all():
+    """Close the shared session and every cached client"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+    with _clients_lock:
+        for client in _clients.values():
+            close = getattr(client, "close", None)
+            if callable(close) and not asyncio.iscoroutinefunction(close):
+                try:
+                    close()
+                except Exception as e:
+                    print(f"Error closing LLM client: {str(e)}")
+        _clients.clear()
+
+
+async def aclose_all():
+    """Close the shared async client and async LLM clients, then everything close_all() closes"""
+    global _async_client, _async_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+        _async_loop = None
+    with _clients_lock:
+        clients = list(_clients.values())
+    for client in clients:
+        close = getattr(client, "close", None)
+        if asyncio.iscoroutinefunction(close):
+            try:
+                await close()
+            except Exception as e:
+                print(f"Error closing LLM client: {str(e)}")
+    close_all()
+
+
+def pool_stats():
+    """Return request and client reuse counters"""
+    with _clients_lock:
+        return dict(_stats, clients=len(_clients), pool_maxsize=HTTP_POOL_MAXSIZE)
@@ -0,0 +1,191 @@
+"""
+Background ingestion of uploaded PDFs
+
+/upload enqueues a job that runs every registered ingestion step
+(text extraction, metadata, indexes) on a small thread pool, so the
+expensive work is done before the first summary or chat request.
+Requests that arrive while a job is in flight wait for it instead of
+repeating the work.
+"""
+
+import os
+import time
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from app.ai_service import VECTOR_SEARCH, ai_service
+from app.boilerplate import boilerplate_stats, get_boilerplate
+from app.corpus_search import corpus_index
+from app.doc_cache import content_hash
+from app.doc_metadata import get_metadata, summarize_metadata
+
+try:
+    import config
+    INGEST_WORKERS = config.INGEST_WORKERS
+    INGEST_WAIT_TIMEOUT = config.INGEST_WAIT_TIMEOUT
+except (ImportError, AttributeError):
+    INGEST_WORKERS = 2
+    INGEST_WAIT_TIMEOUT = 300
+
+
+class IngestionManager:
+    """Runs ingestion steps for uploaded files and tracks their status per filename"""
+
+    def __init__(self, max_workers=INGEST_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._steps = []
+
+    def register_step(self, name, func):
+        """Add a step; func(pdf_path) returns a dict merged into the job result"""
+        self._steps.append((name, func))
+
+    def submit(self, filename, pdf_path):
+        """Queue ingestion for a file and return its initial status"""
+        job = {
+            "filename": filename,
+            "status": "queued",
+            "submitted_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "steps": {},
+            "result": {},
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[filename] = job
+            job["future"] = self._executor.submit(self._run, job, str(pdf_path))
+        return self.status(filename)
+
+    def _run(self, job, pdf_path):
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        try:
+            for name, func in self._steps:
+                step_start = time.time()
+                job["steps"][name] = {"status": "running"}
+                job["result"].update(func(pdf_path) or {})
+                job["steps"][name] = {"status": "done", "seconds": round(time.time() - step_start, 3)}
+            job["status"] = "done"
+        except Exception as e:
+            print(f"Error ingesting {job['filename']}: {str(e)}")
+            traceback.print_exc()
+            job["status"] = "failed"
+            job["error"] = str(e)
+        finally:
+            job["finished_at"] = time.time()
+
+    def status(self, filename):
+        """Return a JSON-serializable snapshot of a file's ingestion job"""
+        with self._lock:
+            job = self._jobs.get(filename)
+            if job is None:
+                return {"filename": filename, "status": "unknown"}
+            snapshot = {key: value for key, value in job.items() if key != "future"}
+            snapshot["steps"] = dict(job["steps"])
+            snapshot["result"] = dict(job["result"])
+            return snapshot
+
+    def _pending_future(self, filename):
+        with self._lock:
+            job = self._jobs.get(filename)
+        if job is None or job["future"].done():
+            return None
+        return job["future"]
+
+    def wait(self, filename, timeout=INGEST_WAIT_TIMEOUT):
+        """Block until an in-flight job for the file finishes (no-op if none)"""
+        future = self._pending_future(filename)
+        if future is not None:
+            print(f"Waiting for in-flight ingestion of {filename}")
+            try:
+                future.result(timeout=timeout)
+            except Exception as e:
+                print(f"Stopped waiting for ingestion of {filename}: {str(e)}")
+
+    async def wait_async(self, filename, timeout=INGEST_WAIT_TIMEOUT):
+        """Await an in-flight job for the file without blocking the event loop"""
+        future = self._pending_future(filename)
+        if future is not None:
+            print(f"Waiting for in-flight ingestion of {filename}")
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=timeout)
+            except Exception as e:
+                print(f"Stopped waiting for ingestion of {filename}: {str(e)}")
+
+
+def _extract_step(pdf_path):
+    """Warm the text cache with the extraction every endpoint uses by default"""
+    page_count = 0
+    characters = 0
+    for _, text in ai_service.iter_pages(pdf_path, "hybrid"):
+        page_count += 1
+        characters += len(text)
+    return {"page_count": page_count, "characters": characters}
+
+
+def _metadata_step(pdf_path):
+    """Store the document's metadata record, counting characters from the warmed text cache"""
+    metadata = get_metadata(pdf_path, page_texts=ai_service.iter_pages(pdf_path, "hybrid"))
+    summary = summarize_metadata(metadata)
+    return {key: summary[key] for key in ("content_hash", "file_size", "encrypted", "scanned_pages")}
+
+
+def _boilerplate_step(pdf_path):
+    """Detect running headers and footers and record what removing them saves"""
+    record = get_boilerplate(pdf_path, "hybrid", lambda: ai_service.iter_pages(pdf_path, "hybrid"))
+    stats = boilerplate_stats(record)
+    return {"boilerplate_chars_saved": stats["chars_saved"], "boilerplate_tokens_saved": stats["tokens_saved"]}
+
+
+def _chunk_step(pdf_path):
+    """Chunk the document once for retrieval, summaries, mind maps and simplification"""
+    chunks = ai_service.chunks(pdf_path)
+    return {"chunks": len(chunks), "chunk_tokens": sum(chunk["tokens"] for chunk in chunks)}
+
+
+def _sentence_step(pdf_path):
+    """Store the sentence offsets of every page for the local answer, summary and mind map code"""
+    index = ai_service.sentence_index(pdf_path)
+    return {"sentences": len(index) if index is not None else 0}
+
+
+def _index_step(pdf_path):
+    """Build the BM25 index chat retrieves passages from"""
+    index = ai_service.bm25_index(pdf_path)
+    return {"indexed_passages": len(index)}
+
+
+def _corpus_step(pdf_path):
+    """Add the document's terms to the corpus-wide dictionary used by /search"""
+    corpus_index.add_document(os.path.basename(pdf_path), content_hash(pdf_path), ai_service.bm25_index(pdf_path))
+    return {}
+
+
+def _vector_step(pdf_path):
+    """Build the semantic vector index merged into chat retrieval"""
+    if not VECTOR_SEARCH:
+        return {}
+    index = ai_service.vector_index(pdf_path)
+    return {"vector_dimensions": index.dimensions}
+
+
+def _lemma_step(pdf_path):
+    """Save the lemmas learned from the document for the next process"""
+    return {"lemmas": ai_service.advanced_llm.save_lemmas()}
+
+
+# Singleton instance
+ingestion_manager = IngestionManager()
+ingestion_manager.register_step("extract", _extract_step)
+ingestion_manager.register_step("metadata", _metadata_step)
+ingestion_manager.register_step("boilerplate", _boilerplate_step)
+ingestion_manager.register_step("chunk", _chunk_step)
+ingestion_manager.register_step("sentences", _sentence_step)
+ingestion_manager.register_step("index", _index_step)
+ingestion_manager.register_step("corpus", _corpus_step)
+ingestion_manager.register_step("vectors", _vector_step)
+ingestion_manager.register_step("lemmas", _lemma_step)
@@ -0,0 +1,188 @@
+"""
+Persistent cache of LLM responses
+
+The same request is often sent upstream again and again - the same summary
+complexity of the same PDF, a mindmap regenerated after a page reload.
+Responses are stored in a SQLite database in the cache directory, keyed by
+a digest of the provider, model, system prompt, generation parameters, the
+context's hash and the query, so identical requests are answered locally,
+across restarts too.
+
+Entries expire LLM_CACHE_TTL seconds after they were stored, and beyond
+LLM_CACHE_MAX_ENTRIES the least recently used are evicted. Only the prompt
+types listed in LLM_CACHE_PROMPT_TYPES are cached. Each entry keeps how
+long the provider took to produce it, so hits report the latency they saved.
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+from app.doc_cache import CACHE_DIR
+
+try:
+    import config
+    LLM_CACHE = config.LLM_CACHE
+    LLM_CACHE_TTL = config.LLM_CACHE_TTL
+    LLM_CACHE_MAX_ENTRIES = config.LLM_CACHE_MAX_ENTRIES
+    LLM_CACHE_PROMPT_TYPES = config.LLM_CACHE_PROMPT_TYPES
+except (ImportError, AttributeError):
+    LLM_CACHE = True
+    LLM_CACHE_TTL = 7 * 24 * 3600
+    LLM_CACHE_MAX_ENTRIES = 5000
+    LLM_CACHE_PROMPT_TYPES = ["summarization", "simplification", "mindmap"]
+
+LLM_CACHE_DB_NAME = "llm_responses.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    prompt_type TEXT NOT NULL,
+    response TEXT NOT NULL,
+    latency REAL NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS responses_created ON responses (created);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def request_key(provider, model, system_prompt, context, query, params=()):
+    """Return the cache key of an LLM request
+
+    Args:
+        provider: Provider name
+        model: Model name
+        system_prompt: System prompt sent with the request
+        context: Document context (hashed, so large contexts make short keys)
+        query: The user's question or task
+        params: JSON-serializable generation parameters (temperature, max tokens, ...)
+    """
+    context_hash = hashlib.sha256((context or "").encode("utf-8", "replace")).hexdigest()
+    request = json.dumps([provider, model, system_prompt, context_hash, query, list(params)])
+    return hashlib.sha256(request.encode("utf-8", "replace")).hexdigest()
+
+
+class LLMCache:
+    """SQLite store of LLM responses with a TTL and an LRU size cap"""
+
+    def __init__(self, path=None, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 prompt_types=LLM_CACHE_PROMPT_TYPES, enabled=LLM_CACHE):
+        self.path = path or os.path.join(CACHE_DIR, LLM_CACHE_DB_NAME)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.prompt_types = set(prompt_types)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._conn = None
+        self._entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.latency_saved = 0.0
+
+    def _connection(self):
+        # Opened on first use so importing the module never touches the disk
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return self._conn
+
+    def caches(self, prompt_type):
+        """Return whether responses to prompt_type are cached"""
+        return self.enabled and prompt_type in self.prompt_types
+
+    def get(self, key):
+        """Return the cached response for key, or None when missing or expired"""
+        start = time.perf_counter()
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response, latency, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, latency, created = row
+            with conn:
+                if now - created > self.ttl:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._entries -= 1
+                    self.expired += 1
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.latency_saved += max(0.0, latency - (time.perf_counter() - start))
+            return response
+
+    def put(self, key, prompt_type, response, latency):
+        """Store a response, evicting expired and then least recently used entries
+
+        Args:
+            key: request_key() of the request
+            prompt_type: Prompt type of the request
+            response: Generated text
+            latency: Seconds the provider took to generate it
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO responses (key, prompt_type, response, latency, created, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET response = excluded.response, latency = excluded.latency, "
+                    "created = excluded.created, accessed = excluded.accessed",
+                    (key, prompt_type, response, latency, now, now)
+                )
+                self.expired += conn.execute(
+                    "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+                ).rowcount
+                self._entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if self._entries > self.max_entries:
+                    evicted = conn.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                        (self._entries - self.max_entries,)
+                    ).rowcount
+                    self._entries -= evicted
+                    self.evictions += evicted
+
+    def clear(self):
+        """Drop every cached response; return how many were dropped"""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                removed = conn.execute("DELETE FROM responses").rowcount
+            self._entries = 0
+            return removed
+
+    def stats(self):
+        """Return hit/miss counters, the hit rate and the provider latency hits saved"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "prompt_types": sorted(self.prompt_types),
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "latency_saved_seconds": round(self.latency_saved, 3),
+            }
+
+
+# Singleton instance
+llm_cache = LLMCache()
@@ -1,17 +1,33 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Body
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import uvicorn
 import asyncio
 import os
+import time
 import traceback
 from pathlib import Path
 
 # Use absolute imports instead of relative
 from app.pdf_processor import pdf_processor
 from app.ai_service import ai_service
+from app.doc_cache import content_hash, text_cache
+from app.ocr import ocr_cache_stats
+from app.ingest import ingestion_manager
+from app.doc_metadata import get_metadata, summarize_metadata
+from app.boilerplate import boilerplate_stats, get_boilerplate
+from app.bm25_index import bm25_cache
+from app.vector_index import vector_cache
+from app.corpus_search import corpus_index
+from app.query_cache import query_cache
+from app.sentence_index import sentence_stats
+from app.http_pool import aclose_all, pool_stats
+from app.streaming import sse_stream, stream_stats
+from app.llm_cache import llm_cache
+from app.singleflight import singleflight
 
 app = FastAPI(title="PDF Intellect API")
 
@@ -46,12 +62,14 @@ class SummaryRequest(BaseModel):
     extract_method: str = "hybrid"
     length: Optional[str] = "medium"
     pdf_id: Optional[str] = None
+    page_numbers: Optional[List[int]] = None  # If None, summarize entire document
 
 class ChatRequest(BaseModel):
     filename: str
     message: str
     extract_method: str = "hybrid"
     pdf_id: Optional[str] = None
+    page_numbers: Optional[List[int]] = None  # If None, use entire document
 
 class LanguageConversionRequest(BaseModel):
     pdf_id: str
@@ -61,15 +79,48 @@ class SimplifyRequest(BaseModel):
     filename: str
     text: str
     extract_method: str = "hybrid"
+    page_numbers: Optional[List[int]] = None  # If None, simplify entire document
 
 class MindmapRequest(BaseModel):
     filename: str
     extract_method: str = "hybrid"
+    page_numbers: Optional[List[int]] = None  # If None, map entire document
+
+class SearchRequest(BaseModel):
+    query: str
+    top_k: int = 10  # Documents to return
+    pages_per_document: int = 3  # Best passages shown per document
+
+@app.on_event("startup")
+async def index_existing_uploads():
+    """Ingest PDFs uploaded before the corpus-wide search index existed"""
+    registered = await asyncio.to_thread(corpus_index.filenames)
+    for path in sorted(UPLOAD_DIR.glob("*.pdf")):
+        if path.name not in registered:
+            ingestion_manager.submit(path.name, path)
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to PDF Intellect API"}
 
+@app.get("/stats")
+async def cache_stats():
+    """Report cache hit/miss counters"""
+    return {
+        "text_cache": text_cache.stats(),
+        "ocr_image_cache": ocr_cache_stats(),
+        "bm25_indexes": bm25_cache.stats(),
+        "vector_indexes": vector_cache.stats(),
+        "corpus_index": corpus_index.stats(),
+        "query_cache": query_cache.stats(),
+        "preprocess": ai_service.advanced_llm.preprocess_stats(),
+        "sentences": sentence_stats(),
+        "http_pool": pool_stats(),
+        "streams": stream_stats(),
+        "llm_cache": llm_cache.stats(),
+        "singleflight": singleflight.stats(),
+    }
+
 @app.post("/upload")
 async def upload_pdf(file: UploadFile = File(...)):
     """Upload a PDF file for analysis"""
@@ -78,35 +129,75 @@ async def upload_pdf(file: UploadFile = File(...)):
         filename = file.filename.replace(" ", "_")
         file_path = UPLOAD_DIR / filename
         
+        # Cached answers about a file being replaced no longer apply
+        if file_path.exists():
+            query_cache.invalidate(await asyncio.to_thread(content_hash, file_path))
+        
         # Create the output file
         with open(file_path, "wb") as output_file:
             # Read the uploaded file in chunks to avoid loading large files into memory
             while content := await file.read(1024 * 1024):  # 1MB chunks
                 output_file.write(content)
         
+        # Extract and index in the background so the first request finds the work done
+        ingestion = ingestion_manager.submit(filename, file_path)
+        
         return {
             "filename": filename,
             "status": "success",
-            "message": f"File {filename} uploaded successfully"
+            "message": f"File {filename} uploaded successfully",
+            "ingestion": ingestion["status"]
         }
     except Exception as e:
         print(f"Error uploading file: {str(e)}")
         traceback.print_exc()
         return {"status": "error", "message": str(e)}
 
+@app.get("/ingest-status/{filename}")
+async def ingest_status(filename: str):
+    """Report background ingestion progress for an uploaded file"""
+    return ingestion_manager.status(filename)
+
+@app.get("/metadata/{filename}")
+async def document_metadata(filename: str, include_pages: bool = False):
+    """Return the stored metadata for an uploaded file (page count, TOC, text and image coverage)"""
+    try:
+        file_path = UPLOAD_DIR / filename
+        if not os.path.exists(file_path):
+            return {"status": "error", "message": "PDF file not found"}
+        
+        await ingestion_manager.wait_async(filename)
+        metadata = await asyncio.to_thread(get_metadata, str(file_path))
+        boilerplate = await asyncio.to_thread(
+            get_boilerplate, str(file_path), "hybrid", lambda: ai_service.iter_pages(str(file_path), "hybrid")
+        )
+        
+        return {
+            "status": "success",
+            "metadata": metadata if include_pages else summarize_metadata(metadata),
+            "boilerplate": boilerplate_stats(boilerplate)
+        }
+    except Exception as e:
+        print(f"Error reading metadata: {str(e)}")
+        traceback.print_exc()
+        return {"status": "error", "message": str(e)}
+
 @app.post("/summarize")
-def summarize_pdf(request: SummaryRequest):
+async def summarize_pdf(request: SummaryRequest):
     try:
         # Check if file exists
         file_path = os.path.join(UPLOAD_DIR, request.filename)
         if not os.path.exists(file_path):
             return {"success": False, "error": f"File not found: {request.filename}"}
             
+        await ingestion_manager.wait_async(request.filename)
+        
         # Call AI service to get summary
-        summary = ai_service.summarize(
+        summary = await ai_service.asummarize(
             filename=request.filename,
             complexity=request.complexity,
-            max_length=request.max_length
+            max_length=request.max_length,
+            pages=request.page_numbers
         )
         
         return {
@@ -121,6 +212,32 @@ def summarize_pdf(request: SummaryRequest):
         traceback.print_exc()
         return {"success": False, "error": str(e)}
 
+def event_stream(endpoint, events, started):
+    """Wrap (event, data) pairs in a server-sent event response"""
+    return StreamingResponse(
+        sse_stream(endpoint, events, started),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/summarize/stream")
+async def stream_summary(request: SummaryRequest):
+    """Stream a summary as server-sent events: token events with text, then done"""
+    started = time.perf_counter()
+    file_path = os.path.join(UPLOAD_DIR, request.filename)
+    if not os.path.exists(file_path):
+        return {"success": False, "error": f"File not found: {request.filename}"}
+    
+    await ingestion_manager.wait_async(request.filename)
+    
+    events = ai_service.astream_summary(
+        filename=request.filename,
+        complexity=request.complexity,
+        max_length=request.max_length,
+        pages=request.page_numbers
+    )
+    return event_stream("summarize", events, started)
+
 @app.post("/chat")
 async def chat_with_pdf(request: ChatRequest):
     """Chat with the AI about a PDF document"""
@@ -129,27 +246,65 @@ async def chat_with_pdf(request: ChatRequest):
             return {"response": "PDF file not found", "status": "error"}
         
         file_path = UPLOAD_DIR / request.filename
+        await ingestion_manager.wait_async(request.filename)
         
         # Process the chat query
-        response = ai_service.chat(
+        result = await ai_service.achat_with_sources(
             prompt=request.message,
             pdf_path=str(file_path),
-            extract_method=request.extract_method
+            extract_method=request.extract_method,
+            pages=request.page_numbers
         )
         
-        return {"response": response, "status": "success"}
+        return {"response": result["response"], "pages": result["pages"], "status": "success"}
     except Exception as e:
         print(f"Error in chat endpoint: {str(e)}")
         traceback.print_exc()
         return {"response": f"Error processing chat: {str(e)}", "status": "error"}
 
+@app.post("/chat/stream")
+async def stream_chat_with_pdf(request: ChatRequest):
+    """Stream a chat answer as server-sent events: token events with text, then done with the pages used"""
+    started = time.perf_counter()
+    if not os.path.exists(UPLOAD_DIR / request.filename):
+        return {"response": "PDF file not found", "status": "error"}
+    
+    file_path = UPLOAD_DIR / request.filename
+    await ingestion_manager.wait_async(request.filename)
+    
+    events = ai_service.astream_chat(
+        prompt=request.message,
+        pdf_path=str(file_path),
+        extract_method=request.extract_method,
+        pages=request.page_numbers
+    )
+    return event_stream("chat", events, started)
+
+@app.on_event("shutdown")
+async def close_llm_connections():
+    """Close the pooled HTTP connections and LLM clients"""
+    await aclose_all()
+
+@app.post("/search")
+async def search_documents(request: SearchRequest):
+    """Search every uploaded PDF; return ranked documents with their best pages and snippets"""
+    try:
+        results = await asyncio.to_thread(
+            ai_service.search_corpus, request.query, request.top_k, request.pages_per_document
+        )
+        return {"results": results, "status": "success"}
+    except Exception as e:
+        print(f"Error in search endpoint: {str(e)}")
+        traceback.print_exc()
+        return {"results": [], "status": "error", "message": str(e)}
+
 @app.post("/simplify")
 async def simplify_language(request: SimplifyRequest):
     """Simplify text from the PDF or provided text"""
     try:
         # If text is provided directly, simplify it
         if request.text:
-            simplified = ai_service.simplify(request.text)
+            simplified = await ai_service.asimplify(request.text)
             return {"simplified": simplified, "status": "success"}
         
         # Otherwise get text from the PDF file
@@ -157,10 +312,14 @@ async def simplify_language(request: SimplifyRequest):
             return {"simplified": "PDF file not found", "status": "error"}
         
         file_path = UPLOAD_DIR / request.filename
+        await ingestion_manager.wait_async(request.filename)
         
         # Extract text and then simplify it
-        text = ai_service.extract_text(str(file_path), request.extract_method)
-        simplified = ai_service.simplify(text)
+        simplified = await ai_service.asimplify(
+            pdf_path=str(file_path),
+            extract_method=request.extract_method,
+            pages=request.page_numbers
+        )
         
         return {"simplified": simplified, "status": "success"}
     except Exception as e:
@@ -176,11 +335,13 @@ async def generate_mindmap(request: MindmapRequest):
             return {"success": False, "error": "PDF file not found"}
         
         file_path = UPLOAD_DIR / request.filename
+        await ingestion_manager.wait_async(request.filename)
         
         # Generate the mindmap
-        mindmap = ai_service.create_mindmap(
+        mindmap = await ai_service.acreate_mindmap(
             pdf_path=str(file_path),
-            extract_method=request.extract_method
+            extract_method=request.extract_method,
+            pages=request.page_numbers
         )
         
         return {
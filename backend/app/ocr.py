@@ -0,0 +1,225 @@
+"""
+OCR for scanned or image-only PDF pages
+
+Only pages flagged as having little extractable text have their images
+decoded with PyMuPDF and passed to Tesseract, across a bounded process pool. Results
+are cached per page so a document is never recognized twice, and per
+embedded image (keyed by content hash) in a cache shared by every
+document, so repeated letterheads, logos and stamps are recognized once.
+"""
+
+import os
+import time
+import atexit
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import config
+    OCR_WORKERS = config.OCR_WORKERS
+    OCR_PAGE_TIMEOUT = config.OCR_PAGE_TIMEOUT
+    OCR_LANG = config.OCR_LANG
+    OCR_CACHE_DIR = os.path.join(config.CACHE_DIR, "ocr")
+except (ImportError, AttributeError):
+    OCR_WORKERS = 2
+    OCR_PAGE_TIMEOUT = 60
+    OCR_LANG = "eng"
+    OCR_CACHE_DIR = os.path.join("cache", "ocr")
+
+# Extra time allowed on top of the Tesseract timeout for opening and rendering the page
+RENDER_GRACE_SECONDS = 15
+
+# Images smaller than this (in PDF points) on either side are decorations, not text
+MIN_REGION_POINTS = 24
+
+_pool = None
+_pool_lock = threading.Lock()
+_tesseract_available = None
+
+# Shared image cache counters, aggregated from the workers
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def tesseract_available():
+    """Check once whether the Tesseract binary can be called"""
+    global _tesseract_available
+    if _tesseract_available is None:
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            _tesseract_available = True
+        except Exception as e:
+            print(f"Tesseract OCR is not available: {str(e)}")
+            _tesseract_available = False
+    return _tesseract_available
+
+
+def get_pool():
+    """Return the shared OCR pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def _image_key(doc, xref):
+    """Hash an embedded image by its raw (still encoded) stream bytes
+
+    The same logo or stamp is stored as the same stream on every page and
+    in every document, so it only needs to be recognized once.
+    """
+    return hashlib.sha256(doc.xref_stream_raw(xref) or b"").hexdigest()
+
+
+def _shared_cache_path(shared_cache_dir, key):
+    return os.path.join(shared_cache_dir, key[:2], f"{key}.txt")
+
+
+def ocr_page(pdf_path, page_number, shared_cache_dir=OCR_CACHE_DIR, timeout=OCR_PAGE_TIMEOUT, lang=OCR_LANG):
+    """Recognize the images on one page (1-based)
+
+    Returns (text, shared_cache_hits, shared_cache_misses). Each embedded
+    image is looked up in the shared cache by its content hash before it
+    is decoded and passed to Tesseract, and the page text is the image
+    texts in reading order. timeout bounds the page as a whole: each
+    Tesseract call gets what is left of it, and TimeoutError is raised
+    once it is spent (images recognized so far stay in the shared cache).
+    """
+    import fitz  # PyMuPDF
+    import pytesseract
+    from PIL import Image
+
+    deadline = time.monotonic() + timeout
+    hits = misses = 0
+    texts = []
+    with fitz.open(pdf_path) as doc:
+        page = doc.load_page(page_number - 1)
+
+        # Place each image by its first visible placement; skip decorations
+        placements = []
+        for image in page.get_images(full=True):
+            xref = image[0]
+            rects = [rect & page.rect for rect in page.get_image_rects(xref)]
+            rects = [rect for rect in rects if rect.width >= MIN_REGION_POINTS and rect.height >= MIN_REGION_POINTS]
+            if rects:
+                first = min(rects, key=lambda rect: (round(rect.y0), rect.x0))
+                placements.append(((round(first.y0), first.x0), xref))
+        placements.sort()
+
+        # A page without images is digital (e.g. a short title page); there is nothing to recognize
+        for _, xref in placements:
+            key = _image_key(doc, xref)
+            cache_path = _shared_cache_path(shared_cache_dir, key)
+            if os.path.exists(cache_path):
+                with open(cache_path, "r", encoding="utf-8") as f:
+                    text = f.read()
+                hits += 1
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"OCR of page {page_number} exceeded {timeout} s")
+                try:
+                    pix = fitz.Pixmap(doc, xref)
+                    if pix.alpha:
+                        # Converting keeps the alpha channel, which would double the samples per pixel
+                        pix = fitz.Pixmap(pix, 0)
+                    if pix.colorspace is None or pix.colorspace.n != 1:
+                        pix = fitz.Pixmap(fitz.csGRAY, pix)
+                except Exception as e:
+                    # e.g. stencil masks with no colour data
+                    print(f"Skipping undecodable image {xref} on page {page_number}: {str(e)}")
+                    continue
+                image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+                text = pytesseract.image_to_string(image, lang=lang, timeout=remaining).strip()
+                _write_text(cache_path, text)
+                misses += 1
+            if text:
+                texts.append(text)
+
+    return "\n\n".join(texts), hits, misses
+
+
+def _write_text(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def ocr_cache_stats():
+    """Return hit counters for the shared image cache"""
+    with _stats_lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return {
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+def _cache_path(cache_dir, page_number):
+    return os.path.join(cache_dir, f"page_{page_number}.txt")
+
+
+async def ocr_pages(pdf_path, page_numbers, cache_dir):
+    """OCR the given pages, returning {page_number: text} for every page that succeeded
+
+    Cached pages are read from cache_dir. Pages that fail or exceed the
+    per-page timeout are left out of the result so callers can keep
+    their placeholder text.
+    """
+    results = {}
+    pending = []
+    for page_number in page_numbers:
+        path = _cache_path(cache_dir, page_number)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                results[page_number] = f.read()
+        else:
+            pending.append(page_number)
+
+    if not pending or not tesseract_available():
+        return results
+
+    pool = get_pool()
+    # Only OCR_WORKERS pages are in flight, so each timeout covers one page rather than queue time
+    slots = asyncio.Semaphore(OCR_WORKERS)
+
+    def release(future):
+        slots.release()
+        if not future.cancelled():
+            future.exception()  # retrieved, so a worker failing after its page timed out isn't reported as unhandled
+
+    async def run(page_number):
+        await slots.acquire()
+        future = asyncio.wrap_future(pool.submit(ocr_page, str(pdf_path), page_number, OCR_CACHE_DIR, OCR_PAGE_TIMEOUT))
+        # A running worker can't be cancelled, so its slot is freed when it finishes, not when its page times out
+        future.add_done_callback(release)
+        try:
+            # The worker stops itself after OCR_PAGE_TIMEOUT; this only catches a stuck render
+            text, hits, misses = await asyncio.wait_for(
+                asyncio.shield(future),
+                timeout=OCR_PAGE_TIMEOUT + RENDER_GRACE_SECONDS
+            )
+        except asyncio.TimeoutError:
+            print(f"OCR timed out on page {page_number}")
+            return
+        except Exception as e:
+            print(f"OCR failed on page {page_number}: {str(e)}")
+            return
+
+        with _stats_lock:
+            _stats["hits"] += hits
+            _stats["misses"] += misses
+        results[page_number] = text
+        _write_text(_cache_path(cache_dir, page_number), text)
+
+    print(f"Running OCR on {len(pending)} page(s)")
+    await asyncio.gather(*(run(page_number) for page_number in pending))
+    return results
@@ -0,0 +1,187 @@
+"""
+Indexed binary page store
+
+Layout (little-endian):
+
+    header   8 bytes   b"PDFPAGE1"
+    payloads           one UTF-8 record per page, optionally zlib-compressed
+    index    17 bytes  per page: page_number u32, offset u64, length u32, flags u8
+    footer   20 bytes  index_offset u64, page_count u32, b"PDFPIDX1"
+
+The index sits at the end so pages can be streamed in as they are
+extracted. Readers memory-map the file and binary-search the index, so
+fetching one page costs a single slice of the mapping instead of a parse
+of the whole document.
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import threading
+
+HEADER_MAGIC = b"PDFPAGE1"
+FOOTER_MAGIC = b"PDFPIDX1"
+INDEX_ENTRY = struct.Struct("<IQIB")
+FOOTER = struct.Struct("<QI8s")
+
+FLAG_ZLIB = 1
+
+# Pages shorter than this are stored uncompressed
+MIN_COMPRESS_BYTES = 256
+
+
+class PageStoreWriter:
+    """Append pages in ascending page order, then commit() to publish the store"""
+
+    def __init__(self, path, compress=True):
+        self.path = str(path)
+        self.compress = compress
+        self.tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = open(self.tmp_path, "wb")
+        self._file.write(HEADER_MAGIC)
+        self._index = []
+        self._last_page = None
+        self._committed = False
+
+    def add(self, page_number, text):
+        """Append one page"""
+        if self._last_page is not None and page_number <= self._last_page:
+            raise ValueError(f"Pages must be added in ascending order (got {page_number} after {self._last_page})")
+
+        payload = text.encode("utf-8")
+        flags = 0
+        if self.compress and len(payload) >= MIN_COMPRESS_BYTES:
+            compressed = zlib.compress(payload, 6)
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= FLAG_ZLIB
+
+        self._index.append((page_number, self._file.tell(), len(payload), flags))
+        self._file.write(payload)
+        self._last_page = page_number
+
+    def commit(self):
+        """Write the index and footer and rename the store into place"""
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(INDEX_ENTRY.pack(*entry))
+        self._file.write(FOOTER.pack(index_offset, len(self._index), FOOTER_MAGIC))
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+        self._committed = True
+
+    def close(self):
+        """Discard the temporary file if the store was never committed"""
+        if not self._file.closed:
+            self._file.close()
+        if not self._committed and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and not self._committed:
+            self.commit()
+        self.close()
+        return False
+
+
+def write_page_store(path, pages, compress=True):
+    """Write an iterable of (page_number, text) pairs to a page store"""
+    with PageStoreWriter(path, compress=compress) as writer:
+        for page_number, text in sorted(pages):
+            writer.add(page_number, text)
+
+
+class PageStore:
+    """Read-only, memory-mapped view of a page store"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError(f"Page store is empty: {self.path}")
+
+        if len(self._map) < len(HEADER_MAGIC) + FOOTER.size or self._map[:len(HEADER_MAGIC)] != HEADER_MAGIC:
+            self.close()
+            raise ValueError(f"Not a page store: {self.path}")
+
+        self._index_offset, self._count, magic = FOOTER.unpack_from(self._map, len(self._map) - FOOTER.size)
+        if magic != FOOTER_MAGIC or self._index_offset + self._count * INDEX_ENTRY.size + FOOTER.size != len(self._map):
+            self.close()
+            raise ValueError(f"Page store is truncated: {self.path}")
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        return INDEX_ENTRY.unpack_from(self._map, self._index_offset + i * INDEX_ENTRY.size)
+
+    def _find(self, page_number):
+        """Binary-search the index for a page number; return its entry or None"""
+        lo, hi = 0, self._count
+        # Pages are usually numbered 1..n, so try the direct slot first
+        if 0 < page_number <= hi:
+            entry = self._entry(page_number - 1)
+            if entry[0] == page_number:
+                return entry
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            if entry[0] < page_number:
+                lo = mid + 1
+            elif entry[0] > page_number:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def _decode(self, entry):
+        _, offset, length, flags = entry
+        payload = self._map[offset:offset + length]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return payload.decode("utf-8")
+
+    def page_numbers(self):
+        """Return the stored page numbers in ascending order"""
+        return [self._entry(i)[0] for i in range(self._count)]
+
+    def get(self, page_number, default=None):
+        """Return the text of one page, or default if it is not stored"""
+        entry = self._find(page_number)
+        if entry is None:
+            return default
+        return self._decode(entry)
+
+    def __getitem__(self, page_number):
+        entry = self._find(page_number)
+        if entry is None:
+            raise KeyError(page_number)
+        return self._decode(entry)
+
+    def __contains__(self, page_number):
+        return self._find(page_number) is not None
+
+    def __iter__(self):
+        """Yield (page_number, text) pairs in page order"""
+        for i in range(self._count):
+            entry = self._entry(i)
+            yield entry[0], self._decode(entry)
+
+    def close(self):
+        if getattr(self, "_map", None) is not None and not self._map.closed:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
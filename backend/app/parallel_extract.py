@@ -0,0 +1,139 @@
+"""
+Parallel page extraction across a process pool
+
+Each worker opens its own copy of the PDF and extracts a contiguous page
+range; callers merge the results back in page order. Documents below
+PARALLEL_EXTRACT_MIN_PAGES stay on the serial path.
+"""
+
+import os
+import atexit
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import config
+    EXTRACT_WORKERS = config.EXTRACT_WORKERS
+    PARALLEL_EXTRACT_MIN_PAGES = config.PARALLEL_EXTRACT_MIN_PAGES
+except (ImportError, AttributeError):
+    EXTRACT_WORKERS = os.cpu_count() or 1
+    PARALLEL_EXTRACT_MIN_PAGES = 64
+
+# Smallest page range handed to a single task
+MIN_PAGES_PER_TASK = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def page_text(page, extract_method):
+    """Return the text of one PyMuPDF page for the given extraction method"""
+    if extract_method == "simple":
+        return page.get_text()
+
+    if extract_method == "blocks":
+        # Block extraction preserves layout better
+        block_texts = [block[4] for block in page.get_text("blocks") if block[6] == 0]  # Text blocks only
+        return " ".join(block_texts).strip()
+
+    # hybrid is default
+    try:
+        return page.get_text("text").strip()
+    except Exception:
+        return page.get_text().strip()
+
+
+def format_page(page_number, text, extract_method):
+    """Lay out one page the way AIService.extract_text joins them"""
+    if extract_method == "simple":
+        return f"[Page {page_number}] " + text + "\n\n"
+    return (f"[Page {page_number}] " + text).strip() + "\n\n"
+
+
+def extract_fitz_range(pdf_path, start, end, extract_method):
+    """Return (page_number, text) for pages [start, end) (0-based) using a private fitz document"""
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as doc:
+        return [(i + 1, page_text(doc.load_page(i), extract_method)) for i in range(start, end)]
+
+
+def extract_pypdf_range(pdf_path, start, end):
+    """Return (page_number, raw_text, error) for pages [start, end) using a private PyPDF2 reader"""
+    import PyPDF2
+
+    results = []
+    with open(pdf_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        if reader.is_encrypted:
+            reader.decrypt('')
+        for i in range(start, end):
+            try:
+                results.append((i + 1, reader.pages[i].extract_text(), None))
+            except Exception as e:
+                results.append((i + 1, None, str(e)))
+    return results
+
+
+def split_ranges(page_count, workers=EXTRACT_WORKERS):
+    """Split [0, page_count) into contiguous ranges, a few per worker for load balancing"""
+    tasks = max(1, min(workers * 4, page_count // MIN_PAGES_PER_TASK))
+    size, remainder = divmod(page_count, tasks)
+    ranges = []
+    start = 0
+    for i in range(tasks):
+        end = start + size + (1 if i < remainder else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def should_parallelize(page_count):
+    """Only large documents are worth the pool's dispatch overhead"""
+    return EXTRACT_WORKERS > 1 and page_count >= PARALLEL_EXTRACT_MIN_PAGES
+
+
+def get_pool():
+    """Return the shared extraction pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def reset_pool():
+    """Discard a broken pool so the next call starts a fresh one"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def imap_ranges(worker, pdf_path, page_count, *args):
+    """Yield each range's results in page order, keeping a bounded number of tasks in flight"""
+    pool = get_pool()
+    pending = deque()
+    try:
+        for start, end in split_ranges(page_count):
+            pending.append(pool.submit(worker, pdf_path, start, end, *args))
+            if len(pending) >= EXTRACT_WORKERS * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # The consumer stopped early (or a task failed); drop the remaining work
+        for future in pending:
+            future.cancel()
+
+
+def submit_ranges(worker, pdf_path, page_count, *args):
+    """Submit one task per page range; futures are returned in page order"""
+    pool = get_pool()
+    return [
+        pool.submit(worker, pdf_path, start, end, *args)
+        for start, end in split_ranges(page_count)
+    ]
@@ -1,5 +1,6 @@
 import os
 import uuid
+import asyncio
 from typing import List, Dict, Optional, Tuple
 import PyPDF2
 import re
@@ -9,6 +10,12 @@ from PIL import Image
 import nltk
 from nltk.tokenize import sent_tokenize, word_tokenize
 
+from app.boilerplate import strip_repeated_lines
+from app.doc_metadata import METADATA_NAME, get_metadata, stored_metadata
+from app.ocr import ocr_pages
+from app.page_store import PageStore, write_page_store
+from app.parallel_extract import extract_pypdf_range, reset_pool, should_parallelize, submit_ranges
+
 # Download NLTK data if needed
 try:
     nltk.data.find('tokenizers/punkt')
@@ -19,6 +26,9 @@ except LookupError:
 STORAGE_PATH = Path("./pdf_storage")
 STORAGE_PATH.mkdir(exist_ok=True)
 
+# Per-document indexed page cache (see app/page_store.py)
+PAGE_STORE_NAME = "pages.bin"
+
 class PDFProcessor:
     def __init__(self):
         pass
@@ -39,6 +49,12 @@ class PDFProcessor:
         # Save metadata
         with open(pdf_dir / "metadata.txt", "w") as f:
             f.write(f"Original filename: {filename}\n")
+        
+        # Index page count, text/image coverage and outline once, so later calls never re-parse
+        try:
+            await asyncio.to_thread(get_metadata, str(pdf_path), pdf_dir / METADATA_NAME)
+        except Exception as e:
+            print(f"Could not index metadata for {pdf_id}: {str(e)}")
             
         return pdf_id
         
@@ -53,39 +69,20 @@ class PDFProcessor:
         has_ocr_note = False
         
         # Check if we already have cached text content
-        text_path = STORAGE_PATH / pdf_id / "text_content.txt"
-        if text_path.exists():
+        store_path = STORAGE_PATH / pdf_id / PAGE_STORE_NAME
+        if not store_path.exists():
+            self._migrate_legacy_text(pdf_id)
+        if store_path.exists():
             print("Using cached text content")
-            with open(text_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                
-            # Parse the content back into the text_by_page dictionary
-            current_page = None
-            current_text = []
-            
-            for line in content.split('\n'):
-                if line.startswith('--- PAGE '):
-                    # Save previous page if any
-                    if current_page is not None and current_text:
-                        text_by_page[current_page] = '\n'.join(current_text)
-                        current_text = []
-                    
-                    # Extract new page number
-                    try:
-                        current_page = int(line.replace('--- PAGE ', '').replace(' ---', ''))
-                    except ValueError:
-                        continue
-                elif current_page is not None:
-                    current_text.append(line)
-            
-            # Add the last page
-            if current_page is not None and current_text:
-                text_by_page[current_page] = '\n'.join(current_text)
-                
+            with PageStore(store_path) as store:
+                text_by_page = dict(store)
+            
             # If we successfully loaded cached text, return it
             if text_by_page:
                 return text_by_page
         
+        metadata = stored_metadata(pdf_path, STORAGE_PATH / pdf_id / METADATA_NAME)
+        
         try:
             # Try extracting text with PyPDF2
             with open(pdf_path, "rb") as file:
@@ -98,42 +95,81 @@ class PDFProcessor:
                     except:
                         raise Exception("PDF is encrypted and cannot be decrypted")
                 
-                total_text_length = 0
-                for i, page in enumerate(reader.pages):
-                    try:
-                        text = page.extract_text()
-                        
-                        # Clean up the extracted text
-                        if text:
-                            text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
-                            text = text.strip()
-                            
-                            # Additional cleaning: remove page numbers and headers/footers
-                            # Remove lines that are just page numbers
-                            text = re.sub(r'^(\d+)$', '', text, flags=re.MULTILINE)
-                            # Remove common header/footer patterns
-                            text = re.sub(r'^(Page \d+ of \d+)$', '', text, flags=re.MULTILINE)
-                        
-                        # If page has very little text, it might be scanned or contain mostly images
-                        if not text or len(text) < 100:
-                            print(f"Page {i+1} has little text, might be scanned or contain images")
-                            text = f"[OCR would process page {i+1}]"
-                            has_ocr_note = True
-                            
-                        text_by_page[i+1] = text
-                        total_text_length += len(text)
-                        
-                    except Exception as e:
-                        print(f"Error extracting text from page {i+1}: {str(e)}")
-                        text_by_page[i+1] = f"[Error extracting text from page {i+1}]"
+                page_count = len(reader.pages)
+            
+            # Large documents are split into page ranges across the process pool
+            raw_pages = None
+            if should_parallelize(page_count):
+                try:
+                    futures = submit_ranges(extract_pypdf_range, str(pdf_path), page_count)
+                    raw_pages = []
+                    for chunk in await asyncio.gather(*[asyncio.wrap_future(f) for f in futures]):
+                        raw_pages.extend(chunk)
+                    print(f"Extracted {page_count} pages in parallel")
+                except Exception as e:
+                    print(f"Parallel extraction failed, falling back to serial: {str(e)}")
+                    reset_pool()
+                    raw_pages = None
+            
+            if raw_pages is None:
+                raw_pages = extract_pypdf_range(str(pdf_path), 0, page_count)
+            
+            # Drop running headers, footers and disclaimers repeated across pages
+            raw_text, boilerplate = strip_repeated_lines({
+                page_num: text for page_num, text, error in raw_pages if error is None and text
+            })
+            if boilerplate["lines_removed"]:
+                print(f"Removed {boilerplate['lines_removed']} repeated lines "
+                      f"({boilerplate['chars_saved']} chars, ~{boilerplate['tokens_saved']} tokens)")
+            
+            total_text_length = 0
+            ocr_candidates = []
+            for page_num, text, error in raw_pages:
+                if error is not None:
+                    print(f"Error extracting text from page {page_num}: {error}")
+                    text_by_page[page_num] = f"[Error extracting text from page {page_num}]"
+                    continue
+                
+                # Clean up the extracted text
+                text = raw_text.get(page_num, text)
+                if text:
+                    # Remove page numbers and headers/footers while the text still has its lines
+                    # Remove lines that are just page numbers
+                    text = re.sub(r'^\s*(\d+)\s*$', '', text, flags=re.MULTILINE)
+                    # Remove common header/footer patterns
+                    text = re.sub(r'^\s*(Page \d+ of \d+)\s*$', '', text, flags=re.MULTILINE)
+                    
+                    text = re.sub(r'\s+', ' ', text)  # Normalize whitespace
+                    text = text.strip()
+                
+                # If page has very little text, it might be scanned or contain mostly images
+                if not text or len(text) < 100:
+                    print(f"Page {page_num} has little text, might be scanned or contain images")
+                    text = f"[OCR would process page {page_num}]"
+                    ocr_candidates.append(page_num)
+                    
+                text_by_page[page_num] = text
+                total_text_length += len(text)
+            
+            # Pages the metadata shows have no images have nothing for OCR to recognize
+            if metadata is not None:
+                coverage = {page["page"]: page["image_coverage"] for page in metadata["pages"]}
+                ocr_candidates = [page_num for page_num in ocr_candidates if coverage.get(page_num, 1.0) > 0]
+            
+            # Recognize only the flagged pages; digital pages never reach OCR
+            if ocr_candidates:
+                ocr_text = await ocr_pages(pdf_path, ocr_candidates, STORAGE_PATH / pdf_id / "ocr")
+                for page_num, text in ocr_text.items():
+                    if text:
+                        total_text_length += len(text) - len(text_by_page[page_num])
+                        text_by_page[page_num] = text
+                has_ocr_note = any(not ocr_text.get(page_num) for page_num in ocr_candidates)
             
-            # If total extracted text is very small, the PDF might be mostly scanned
-            # Try using a better extraction method or OCR in a real application
+            # If total extracted text is still very small, OCR was unavailable or found little
             if total_text_length < 1000 and has_ocr_note:
                 print("PDF appears to be mostly scanned or image-based. Limited text extraction.")
-                # In a production app, you would use OCR here
                 
-                # For now, add a placeholder explanation
+                # Add a placeholder explanation
                 placeholder = "This PDF appears to contain mostly scanned content or images. "
                 placeholder += "Limited text could be extracted without OCR. "
                 placeholder += "The extracted content may not represent the full document."
@@ -143,9 +179,7 @@ class PDFProcessor:
                 text_by_page[first_page] = placeholder + "\n\n" + text_by_page[first_page]
                         
             # Cache the extracted text
-            with open(text_path, "w", encoding="utf-8") as f:
-                for page_num, text in sorted(text_by_page.items()):
-                    f.write(f"--- PAGE {page_num} ---\n{text}\n\n")
+            write_page_store(store_path, text_by_page.items())
                     
             return text_by_page
             
@@ -160,20 +194,80 @@ class PDFProcessor:
         if not pdf_path.exists():
             raise FileNotFoundError(f"PDF with ID {pdf_id} not found")
             
+        metadata = stored_metadata(pdf_path, STORAGE_PATH / pdf_id / METADATA_NAME)
+        if metadata is not None:
+            return metadata["page_count"]
+        
+        # The page store already knows the page count once text is extracted
+        store_path = STORAGE_PATH / pdf_id / PAGE_STORE_NAME
+        if store_path.exists():
+            with PageStore(store_path) as store:
+                return len(store)
+            
         with open(pdf_path, "rb") as file:
             reader = PyPDF2.PdfReader(file)
             return len(reader.pages)
+    
+    async def get_page_text(self, pdf_id: str, page_number: int) -> Optional[str]:
+        """Get the text of a single page without loading the rest of the document"""
+        store_path = STORAGE_PATH / pdf_id / PAGE_STORE_NAME
+        
+        if not store_path.exists():
+            # If text not extracted yet, do it now
+            text_by_page = await self.extract_text(pdf_id)
+            return text_by_page.get(page_number)
+        
+        with PageStore(store_path) as store:
+            return store.get(page_number)
+    
+    def _migrate_legacy_text(self, pdf_id: str) -> None:
+        """Convert a "--- PAGE N ---" text_content.txt cache into a page store"""
+        text_path = STORAGE_PATH / pdf_id / "text_content.txt"
+        if not text_path.exists():
+            return
+        
+        with open(text_path, "r", encoding="utf-8") as f:
+            content = f.read()
+            
+        # Parse the content back into the text_by_page dictionary
+        text_by_page = {}
+        current_page = None
+        current_text = []
+        
+        for line in content.split('\n'):
+            if line.startswith('--- PAGE '):
+                # Save previous page if any
+                if current_page is not None and current_text:
+                    text_by_page[current_page] = '\n'.join(current_text)
+                    current_text = []
+                
+                # Extract new page number
+                try:
+                    current_page = int(line.replace('--- PAGE ', '').replace(' ---', ''))
+                except ValueError:
+                    continue
+            elif current_page is not None:
+                current_text.append(line)
+        
+        # Add the last page
+        if current_page is not None and current_text:
+            text_by_page[current_page] = '\n'.join(current_text)
+        
+        if text_by_page:
+            print(f"Migrating cached text for {pdf_id} to the page store")
+            write_page_store(STORAGE_PATH / pdf_id / PAGE_STORE_NAME, text_by_page.items())
+            text_path.unlink()
             
     async def extract_key_entities(self, pdf_id: str) -> Dict[str, List[Dict]]:
         """Extract key entities for mind mapping"""
-        text_path = STORAGE_PATH / pdf_id / "text_content.txt"
+        store_path = STORAGE_PATH / pdf_id / PAGE_STORE_NAME
         
-        if not text_path.exists():
+        if not store_path.exists():
             # If text not extracted yet, do it now
             await self.extract_text(pdf_id)
             
-        with open(text_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        with PageStore(store_path) as store:
+            content = "\n\n".join(text for _, text in store)
         
         # Simple extraction of potential key terms using regex
         # This is a very basic approach compared to spaCy's NER
@@ -0,0 +1,87 @@
+"""
+LRU cache of ranked passage lists per document and query
+
+Entries are keyed by the document's content hash and the query's
+normalized tokens (lowercased, lemmatized, stopwords removed, as produced
+by AdvancedLLM.preprocess), so "What are the payment terms?" and
+"payment term" share an entry. A changed document has a new hash and never hits
+its old entries; those are dropped explicitly when a file is replaced.
+"""
+
+import threading
+from collections import OrderedDict
+
+try:
+    import config
+    QUERY_CACHE_SIZE = config.QUERY_CACHE_SIZE
+except (ImportError, AttributeError):
+    QUERY_CACHE_SIZE = 1024
+
+
+class QueryCache:
+    """Bounded LRU of [(passage_id, score)] rankings"""
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, doc_hash, query_tokens, params=()):
+        """Return the cached ranking or None
+
+        Args:
+            doc_hash: Content hash of the document
+            query_tokens: Normalized query tokens
+            params: Hashable search parameters (method, top_k, pages, ...)
+        """
+        key = (doc_hash, tuple(query_tokens), params)
+        with self._lock:
+            ranked = self._entries.get(key)
+            if ranked is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return ranked
+
+    def put(self, doc_hash, query_tokens, params, ranked):
+        key = (doc_hash, tuple(query_tokens), params)
+        with self._lock:
+            self._entries[key] = list(ranked)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, doc_hash=None):
+        """Drop the entries of one document, or all entries; return how many were dropped"""
+        with self._lock:
+            if doc_hash is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [key for key in self._entries if key[0] == doc_hash]
+                for key in stale:
+                    del self._entries[key]
+                removed = len(stale)
+            self.invalidations += removed
+            return removed
+
+    def stats(self):
+        """Return hit/miss counters and the hit rate"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+
+# Singleton instance
+query_cache = QueryCache()
@@ -0,0 +1,308 @@
+"""
+Sentence boundaries computed once per page and reused by every consumer
+
+split_spans() is the one sentence splitter of the backend: NLTK's Punkt
+model when its data is installed, otherwise a punctuation rule. It splits
+each paragraph (blank-line separated block) on its own, so a sentence
+never crosses a paragraph break and a paragraph's sentences are the same
+wherever the paragraph appears - in a page, a chunk or a joined context.
+
+At ingest, the spans of every content page are stored per document and
+extraction method as offset arrays in sentences_<method>.npz:
+
+    page_numbers  int32 page number of each page
+    page_lengths  int64 length of each page's text when it was split
+    page_offsets  int64 start of each page's rows in spans (+ end)
+    spans         int32 (sentences x 2) start and end offsets in the page text
+
+Code working on a document's text slices the sentences of the pages it
+needs from these arrays (SentenceIndex.page_sentences) instead of
+tokenizing them. split_sentences() is for text that comes from no stored
+document; it remembers recent paragraphs by digest.
+"""
+
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.doc_cache import content_hash, document_dir
+
+# Bump when the splitting rules or the file layout change so stored spans are recomputed
+SENTENCE_VERSION = 2
+
+# Paragraphs whose spans are kept in memory, and documents whose indexes stay loaded
+MEMORY_PARAGRAPHS = 50000
+MEMORY_DOCUMENTS = 16
+
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+_PAGE_MARKER = re.compile(r"\[Page \d+\] ")
+
+# Fallback rule: end punctuation followed by whitespace, except after initials and abbreviations like "e.g."
+_SENTENCE_END = re.compile(r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|\!)\s")
+
+_punkt = None
+_punkt_loaded = False
+
+_spans = OrderedDict()     # paragraph digest -> int32 (n x 2) spans within the paragraph
+_spans_lock = threading.Lock()
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+_stats = {"hits": 0, "misses": 0, "pages_sliced": 0, "pages_split": 0}
+
+
+def _load_punkt():
+    """Return NLTK's English Punkt tokenizer, or None without its data"""
+    global _punkt, _punkt_loaded
+    if not _punkt_loaded:
+        try:
+            from nltk.tokenize import PunktTokenizer  # NLTK 3.8.2+, punkt_tab data
+            _punkt = PunktTokenizer("english")
+        except (ImportError, LookupError, OSError, ValueError):
+            try:
+                import nltk
+                _punkt = nltk.data.load("tokenizers/punkt/english.pickle")
+            except (ImportError, LookupError, OSError, ValueError):
+                _punkt = None
+        _punkt_loaded = True
+    return _punkt
+
+
+def _tokenize_paragraph(paragraph):
+    """Return [(start, end)] of the sentences of one paragraph, without surrounding whitespace"""
+    punkt = _load_punkt()
+    if punkt is not None:
+        return list(punkt.span_tokenize(paragraph))
+
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(paragraph):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(paragraph)))
+
+    trimmed = []
+    for start, end in spans:
+        sentence = paragraph[start:end]
+        stripped = sentence.strip()
+        if stripped:
+            start += len(sentence) - len(sentence.lstrip())
+            trimmed.append((start, start + len(stripped)))
+    return trimmed
+
+
+def _paragraphs(text):
+    """Yield (start, end) of each blank-line separated block of text"""
+    start = 0
+    for match in _PARAGRAPH_BREAK.finditer(text):
+        yield start, match.start()
+        start = match.end()
+    yield start, len(text)
+
+
+def _digest(paragraph):
+    return hashlib.blake2b(paragraph.encode("utf-8", "replace"), digest_size=16).digest()
+
+
+def _remember(key, spans):
+    with _spans_lock:
+        _spans[key] = spans
+        _spans.move_to_end(key)
+        while len(_spans) > MEMORY_PARAGRAPHS:
+            _spans.popitem(last=False)
+
+
+def _paragraph_spans(paragraph):
+    """Return the int32 spans of one paragraph, from memory when it has been seen"""
+    key = _digest(paragraph)
+    with _spans_lock:
+        spans = _spans.get(key)
+        if spans is not None:
+            _spans.move_to_end(key)
+            _stats["hits"] += 1
+            return spans
+        _stats["misses"] += 1
+    spans = np.asarray(_tokenize_paragraph(paragraph), dtype=np.int32).reshape(-1, 2)
+    _remember(key, spans)
+    return spans
+
+
+def split_spans(text):
+    """Return the sentences of text as an int32 (n x 2) array of start and end offsets"""
+    rows = []
+    for start, end in _paragraphs(text):
+        paragraph = text[start:end]
+        stripped = paragraph.strip()
+        if stripped:
+            rows.append(_paragraph_spans(stripped) + (start + len(paragraph) - len(paragraph.lstrip())))
+    return np.concatenate(rows) if rows else np.zeros((0, 2), dtype=np.int32)
+
+
+def split_sentences(text):
+    """Return the sentences of text as strings
+
+    A "[Page n] " marker opening a paragraph is kept with its first
+    sentence but ignored when looking the paragraph up.
+    """
+    if not text:
+        return []
+    sentences = []
+    for start, end in _paragraphs(text):
+        paragraph = text[start:end].strip()
+        marker = _PAGE_MARKER.match(paragraph)
+        if marker:
+            paragraph = paragraph[marker.end():]
+        if not paragraph:
+            continue
+        for i, (sentence_start, sentence_end) in enumerate(_paragraph_spans(paragraph).tolist()):
+            sentence = paragraph[sentence_start:sentence_end]
+            sentences.append(marker.group(0) + sentence if marker and i == 0 else sentence)
+    return sentences
+
+
+def sentence_pieces(text):
+    """Yield text in consecutive pieces that each end after a sentence
+
+    Unlike split_sentences(), the whitespace between sentences is kept, so
+    the pieces join back into text; used to stream locally generated text.
+    """
+    end = 0
+    for _, sentence_end in split_spans(text or "").tolist():
+        yield text[end:sentence_end]
+        end = sentence_end
+    if end < len(text or ""):
+        yield text[end:]
+
+
+class SentenceIndex:
+    """Per-page sentence offsets of one document"""
+
+    def __init__(self, page_numbers, page_lengths, page_offsets, spans):
+        self.page_numbers = page_numbers
+        self.page_lengths = page_lengths
+        self.page_offsets = page_offsets
+        self.spans = spans
+        self._rows = {int(page_number): i for i, page_number in enumerate(page_numbers.tolist())}
+
+    def __len__(self):
+        return len(self.spans)
+
+    def page_spans(self, page_number):
+        """Return the (n x 2) spans of a page, or an empty array for unknown pages"""
+        row = self._rows.get(page_number)
+        if row is None:
+            return self.spans[:0]
+        return self.spans[self.page_offsets[row]:self.page_offsets[row + 1]]
+
+    def page_sentences(self, page_number, text):
+        """Return the sentences of a page by slicing its text
+
+        A page the index doesn't cover, or whose text is no longer the text
+        that was split, is split again.
+        """
+        row = self._rows.get(page_number)
+        if row is not None and int(self.page_lengths[row]) == len(text):
+            spans = self.page_spans(page_number)
+            counter = "pages_sliced"
+        else:
+            spans = split_spans(text)
+            counter = "pages_split"
+        with _spans_lock:
+            _stats[counter] += 1
+        return [text[start:end] for start, end in spans.tolist()]
+
+
+def build_sentence_index(pages):
+    """Split (page_number, text) pairs into a SentenceIndex"""
+    page_numbers = []
+    page_lengths = []
+    page_spans = []
+    for page_number, text in pages:
+        page_numbers.append(page_number)
+        page_lengths.append(len(text))
+        page_spans.append(split_spans(text))
+    page_offsets = np.zeros(len(page_numbers) + 1, dtype=np.int64)
+    np.cumsum([len(spans) for spans in page_spans], out=page_offsets[1:])
+    spans = np.concatenate(page_spans) if page_spans else np.zeros((0, 2), dtype=np.int32)
+    return SentenceIndex(
+        np.asarray(page_numbers, dtype=np.int32), np.asarray(page_lengths, dtype=np.int64),
+        page_offsets, spans.astype(np.int32)
+    )
+
+
+def _index_path(pdf_path, extract_method):
+    return os.path.join(document_dir(content_hash(pdf_path)), f"sentences_{extract_method}.npz")
+
+
+def _keep(path, index):
+    with _indexes_lock:
+        _indexes[path] = index
+        _indexes.move_to_end(path)
+        while len(_indexes) > MEMORY_DOCUMENTS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def stored_sentence_index(pdf_path, extract_method):
+    """Return a document's stored sentence index, or None if it has not been split yet
+
+    Loading reads only the offset arrays, never the document's text.
+    """
+    path = _index_path(pdf_path, extract_method)
+    with _indexes_lock:
+        if path in _indexes:
+            _indexes.move_to_end(path)
+            return _indexes[path]
+
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as stored:
+            if int(stored["version"]) != SENTENCE_VERSION:
+                return None
+            index = SentenceIndex(
+                stored["page_numbers"], stored["page_lengths"], stored["page_offsets"], stored["spans"]
+            )
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Resplitting unreadable sentence index {path}: {str(e)}")
+        return None
+    return _keep(path, index)
+
+
+def get_sentence_index(pdf_path, extract_method, pages):
+    """Return a document's sentence index, splitting and storing it on first use
+
+    Args:
+        pdf_path: Path to the PDF file
+        extract_method: Extraction method the pages come from
+        pages: Callable returning an iterator of (page_number, text) over the
+            whole document; only called when no index is stored
+    """
+    index = stored_sentence_index(pdf_path, extract_method)
+    if index is not None:
+        return index
+
+    path = _index_path(pdf_path, extract_method)
+    index = build_sentence_index(pages())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    np.savez(
+        tmp_path,
+        version=np.int32(SENTENCE_VERSION),
+        page_numbers=index.page_numbers,
+        page_lengths=index.page_lengths,
+        page_offsets=index.page_offsets,
+        spans=index.spans,
+    )
+    os.replace(tmp_path, path)
+    return _keep(path, index)
+
+
+def sentence_stats():
+    """Return pages sliced from stored offsets versus split again, and free-text paragraph lookups"""
+    with _spans_lock:
+        return dict(_stats, paragraphs=len(_spans))
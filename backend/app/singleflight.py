@@ -0,0 +1,103 @@
+"""
+Single-flight coalescing of concurrent identical operations
+
+When several requests ask for the same expensive result at once - the same
+summary of a PDF a whole team just opened - only the first runs; the others
+wait for it and share its result (or its exception). Calls are keyed by
+operation, document hash and parameters, and only overlap is coalesced:
+once a call finishes, the next identical one runs again.
+
+ado() coalesces coroutines on the event loop; the computation runs as its
+own task, so a caller that disconnects doesn't cancel it for the others.
+do() does the same for blocking functions called from threads.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """In-flight operations by key, with per-operation counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self._stats = {}
+
+    def _count(self, operation, collapsed):
+        stats = self._stats.setdefault(operation, {"calls": 0, "executed": 0, "collapsed": 0})
+        stats["calls"] += 1
+        stats["collapsed" if collapsed else "executed"] += 1
+
+    def do(self, key, fn):
+        """Return fn(), or the result of the identical call already running in another thread
+
+        Args:
+            key: Hashable tuple whose first item names the operation,
+                e.g. ("summarize", doc_hash, complexity)
+            fn: Zero-argument callable computing the result
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._count(key[0], not leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key, fn):
+        """Await fn(), or the identical call already in flight on the event loop
+
+        Args:
+            key: Hashable tuple whose first item names the operation
+            fn: Zero-argument callable returning the coroutine to run
+        """
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(fn())
+                task.add_done_callback(lambda _: self._forget(key, task))
+            self._count(key[0], not leader)
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+
+    def stats(self):
+        """Return per-operation calls, executions and collapsed duplicates, and the calls in flight"""
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._tasks),
+                "operations": {operation: dict(stats) for operation, stats in self._stats.items()},
+            }
+
+
+# Singleton instance
+singleflight = SingleFlight()
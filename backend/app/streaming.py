@@ -0,0 +1,75 @@
+"""
+Server-sent events for the streaming endpoints, with time-to-first-byte stats
+
+A streamed answer is an async iterator of (event, data) pairs; sse_stream()
+encodes each as an SSE frame:
+
+    event: token
+    data: {"text": "..."}
+
+and records, per endpoint, the time from the request to the first token
+frame (what the user waits for before text appears) and to the end of the
+stream.
+"""
+
+import json
+import time
+import threading
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def sse_event(event, data):
+    """Encode one server-sent event with a JSON data payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _record(endpoint, ttfb, total):
+    with _stats_lock:
+        stats = _stats.setdefault(
+            endpoint, {"streams": 0, "ttfb_count": 0, "ttfb_total": 0.0, "ttfb_last": None, "duration_total": 0.0}
+        )
+        stats["streams"] += 1
+        stats["duration_total"] += total
+        if ttfb is not None:
+            stats["ttfb_count"] += 1
+            stats["ttfb_total"] += ttfb
+            stats["ttfb_last"] = ttfb
+
+
+async def sse_stream(endpoint, events, started=None):
+    """Encode an async iterator of (event, data) as SSE frames, timing the stream
+
+    Args:
+        endpoint: Name the timings are recorded under
+        events: Async iterator of (event name, JSON-serializable data)
+        started: perf_counter() at which the request arrived (default: now)
+    """
+    started = started or time.perf_counter()
+    ttfb = None
+    try:
+        async for event, data in events:
+            if ttfb is None and event == "token":
+                ttfb = time.perf_counter() - started
+                print(f"{endpoint} first token after {ttfb * 1000:.0f} ms")
+            yield sse_event(event, data)
+    except Exception as e:
+        print(f"Error streaming {endpoint}: {str(e)}")
+        yield sse_event("error", {"message": str(e)})
+    finally:
+        _record(endpoint, ttfb, time.perf_counter() - started)
+
+
+def stream_stats():
+    """Return per-endpoint stream counts and mean time to first token and to completion, in ms"""
+    with _stats_lock:
+        return {
+            endpoint: {
+                "streams": stats["streams"],
+                "mean_ttfb_ms": round(stats["ttfb_total"] * 1000 / stats["ttfb_count"], 1) if stats["ttfb_count"] else None,
+                "last_ttfb_ms": round(stats["ttfb_last"] * 1000, 1) if stats["ttfb_last"] is not None else None,
+                "mean_duration_ms": round(stats["duration_total"] * 1000 / stats["streams"], 1),
+            }
+            for endpoint, stats in _stats.items()
+        }
@@ -0,0 +1,308 @@
+"""
+Offline semantic vector index over a document's chunks
+
+Chunks are embedded without any network call: their preprocessed terms and
+term bigrams are hashed into a sparse TF-IDF matrix (scikit-learn's
+HashingVectorizer), and a truncated SVD of that matrix (latent semantic
+analysis) maps every chunk to a dense unit vector. Chunks that use related
+vocabulary end up close together even when a question shares few exact
+words with them.
+
+The index is written once per extraction method, to a vectors_<method>/
+directory next to the document's other cached artifacts:
+
+    meta.json               passage count, dimensions, storage type, list count
+    columns.npy             int64 hashed feature columns kept for the document
+    idf.npy                 float32 IDF per kept column
+    term_vectors.npy        float16 (columns x dimensions) SVD projection
+    vectors.npy             int8 or float32 unit vector per passage
+    scales.npy              float32 per-passage scale of int8 vectors
+    centroids.npy           float32 IVF list centroids
+    list_offsets.npy        int64 start of each IVF list in list_ids (+ end)
+    list_ids.npy            int32 passage ids grouped by IVF list
+    passage_pages.npy       int32 first page of each passage
+    passage_last_pages.npy  int32 last page of each passage
+
+Search is approximate: the query is compared with the list centroids and
+only the passages of the VECTOR_NPROBE closest lists are scored (an
+inverted-file index). Arrays are memory-mapped like the BM25 index's.
+"""
+
+import os
+import json
+import shutil
+import threading
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+from sklearn.utils.extmath import randomized_svd
+
+from app.bm25_index import BM25Cache, publish_index
+from app.doc_cache import write_json_atomic
+
+try:
+    import config
+    VECTOR_DIMENSIONS = config.VECTOR_DIMENSIONS
+    VECTOR_DTYPE = config.VECTOR_DTYPE
+    VECTOR_NPROBE = config.VECTOR_NPROBE
+except (ImportError, AttributeError):
+    VECTOR_DIMENSIONS = 128
+    VECTOR_DTYPE = "int8"
+    VECTOR_NPROBE = 8
+
+INDEX_DIR_NAME = "vectors"
+
+# Bump when the index layout or embedding changes so old indexes are rebuilt
+INDEX_VERSION = 1
+
+# Hashed feature space; a document keeps only the columns its chunks use
+HASH_FEATURES = 2 ** 20
+
+# Columns used by fewer chunks are dropped, unless that leaves too few
+MIN_DF = 2
+
+# Documents with fewer passages are searched exhaustively
+IVF_MIN_PASSAGES = 256
+KMEANS_ITERATIONS = 10
+
+
+def _features(tokens):
+    """Terms and adjacent-term bigrams of a preprocessed token list"""
+    return list(tokens) + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+_hasher = HashingVectorizer(
+    n_features=HASH_FEATURES, analyzer=_features, alternate_sign=False, norm=None, dtype=np.float32
+)
+
+
+def _weight(counts, idf):
+    """Sublinear TF times IDF, with rows scaled to unit length"""
+    counts = counts.tocsr(copy=True)
+    counts.data = 1 + np.log(counts.data)
+    return normalize(counts.multiply(idf).tocsr())
+
+
+def _kmeans(vectors, num_lists, rng):
+    """Spherical k-means; return (unit centroids, list of each vector)"""
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids.astype(np.float32), np.argmax(vectors @ centroids.T, axis=1)
+
+
+def build_index(index_dir, passages, tokenize, dimensions=VECTOR_DIMENSIONS, dtype=VECTOR_DTYPE):
+    """Embed passages and write a vector index
+
+    Args:
+        index_dir: Directory to create; built in a temporary directory and renamed into place
+        passages: Iterable of (first_page, last_page, text)
+        tokenize: Function mapping text to a list of terms; queries must use the same one
+        dimensions: Largest vector size (smaller documents get fewer)
+        dtype: "int8" or "float32" storage of the passage vectors
+    """
+    passage_pages = []
+    passage_last_pages = []
+    token_lists = []
+    for first_page, last_page, text in passages:
+        passage_pages.append(first_page)
+        passage_last_pages.append(last_page)
+        token_lists.append(tokenize(text))
+
+    num_passages = len(token_lists)
+    counts = _hasher.transform(token_lists) if num_passages else None
+    df = np.bincount(counts.indices, minlength=HASH_FEATURES) if num_passages else np.zeros(HASH_FEATURES)
+    columns = np.flatnonzero(df >= MIN_DF)
+    if len(columns) < min(dimensions, num_passages):
+        columns = np.flatnonzero(df)
+
+    if num_passages and len(columns):
+        idf = (np.log((1 + num_passages) / (1 + df[columns])) + 1).astype(np.float32)
+        weighted = _weight(counts[:, columns], idf)
+        k = min(dimensions, num_passages, len(columns))
+        _, _, components = randomized_svd(weighted, k, random_state=0)
+        term_vectors = components.T.astype(np.float16)
+        vectors = normalize(weighted @ term_vectors.astype(np.float32)).astype(np.float32)
+    else:
+        idf = np.zeros(0, dtype=np.float32)
+        term_vectors = np.zeros((0, 0), dtype=np.float16)
+        vectors = np.zeros((num_passages, 0), dtype=np.float32)
+
+    if num_passages >= IVF_MIN_PASSAGES:
+        centroids, assignment = _kmeans(vectors, int(np.sqrt(num_passages)), np.random.default_rng(0))
+    else:
+        centroids = np.zeros((1, vectors.shape[1]), dtype=np.float32)
+        assignment = np.zeros(num_passages, dtype=np.int64)
+    list_ids = np.argsort(assignment, kind="stable").astype(np.int32)
+    list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignment, minlength=len(centroids)), out=list_offsets[1:])
+
+    tmp_dir = f"{index_dir}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        def save(name, array):
+            np.save(os.path.join(tmp_dir, name), array)
+
+        if dtype == "int8":
+            peaks = np.abs(vectors).max(axis=1) if vectors.size else np.zeros(num_passages, dtype=np.float32)
+            scales = np.where(peaks > 0, peaks / 127, 1).astype(np.float32)
+            save("vectors.npy", np.round(vectors / scales[:, None]).astype(np.int8))
+            save("scales.npy", scales)
+        else:
+            dtype = "float32"
+            save("vectors.npy", vectors)
+
+        save("columns.npy", columns.astype(np.int64))
+        save("idf.npy", idf)
+        save("term_vectors.npy", term_vectors)
+        save("centroids.npy", centroids)
+        save("list_offsets.npy", list_offsets)
+        save("list_ids.npy", list_ids)
+        save("passage_pages.npy", np.asarray(passage_pages, dtype=np.int32))
+        save("passage_last_pages.npy", np.asarray(passage_last_pages, dtype=np.int32))
+
+        write_json_atomic(os.path.join(tmp_dir, "meta.json"), {
+            "version": INDEX_VERSION,
+            "passages": num_passages,
+            "dimensions": int(vectors.shape[1]),
+            "columns": int(len(columns)),
+            "dtype": dtype,
+            "lists": int(len(centroids)),
+        })
+
+        publish_index(tmp_dir, index_dir)
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class VectorIndex:
+    """Read-only, memory-mapped vector index with IVF search"""
+
+    def __init__(self, index_dir):
+        self.index_dir = str(index_dir)
+        with open(os.path.join(self.index_dir, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Vector index version {self.meta.get('version')} is out of date: {self.index_dir}")
+
+        def load(name):
+            return np.load(os.path.join(self.index_dir, name), mmap_mode="r")
+
+        self.columns = load("columns.npy")
+        self.idf = load("idf.npy")
+        self.term_vectors = load("term_vectors.npy")
+        self.vectors = load("vectors.npy")
+        self.scales = load("scales.npy") if self.meta["dtype"] == "int8" else None
+        self.centroids = load("centroids.npy")
+        self.list_offsets = load("list_offsets.npy")
+        self.list_ids = load("list_ids.npy")
+        self.passage_pages = load("passage_pages.npy")
+        self.passage_last_pages = load("passage_last_pages.npy")
+
+        self.num_passages = self.meta["passages"]
+        self.dimensions = self.meta["dimensions"]
+        self.num_lists = self.meta["lists"]
+
+    def __len__(self):
+        return self.num_passages
+
+    def embed(self, query_tokens):
+        """Return the unit vector of a preprocessed query, or None if it shares no terms with the document"""
+        if not self.dimensions:
+            return None
+        counts = _hasher.transform([query_tokens])
+        positions = np.searchsorted(self.columns, counts.indices)
+        positions = np.minimum(positions, len(self.columns) - 1)
+        known = self.columns[positions] == counts.indices
+        if not known.any():
+            return None
+        tf = 1 + np.log(counts.data[known])
+        rows = positions[known]
+        weights = tf * self.idf[rows]
+        vector = weights @ np.asarray(self.term_vectors[rows], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return (vector / norm).astype(np.float32) if norm > 0 else None
+
+    def _scores(self, passage_ids, query_vector):
+        vectors = np.asarray(self.vectors[passage_ids], dtype=np.float32)
+        scores = vectors @ query_vector
+        if self.scales is not None:
+            scores *= self.scales[passage_ids]
+        return scores
+
+    def candidates(self, query_vector, nprobe=VECTOR_NPROBE):
+        """Return the passage ids in the nprobe IVF lists closest to a query vector"""
+        if self.num_lists <= nprobe:
+            return np.arange(self.num_passages)
+        nearest = np.argpartition(-(self.centroids @ query_vector), nprobe - 1)[:nprobe]
+        return np.concatenate([
+            self.list_ids[self.list_offsets[i]:self.list_offsets[i + 1]] for i in nearest.tolist()
+        ]).astype(np.int64)
+
+    def search(self, query_tokens, top_k=5, pages=None, nprobe=VECTOR_NPROBE):
+        """Return [(passage_id, cosine similarity)] for the closest passages, best first
+
+        Only passages with a positive similarity are returned. If pages is
+        given, every passage covering one of those page numbers is scored
+        exactly instead of probing the IVF lists.
+        """
+        if not self.num_passages:
+            return []
+        query_vector = self.embed(query_tokens)
+        if query_vector is None:
+            return []
+
+        if pages is not None:
+            wanted = np.unique(np.asarray(list(pages), dtype=np.int32))
+            following = np.searchsorted(wanted, self.passage_pages)
+            covered = following < len(wanted)
+            covered[covered] = wanted[following[covered]] <= self.passage_last_pages[covered]
+            passage_ids = np.flatnonzero(covered)
+        else:
+            passage_ids = self.candidates(query_vector, nprobe)
+
+        scores = self._scores(passage_ids, query_vector)
+        keep = scores > 0
+        passage_ids, scores = passage_ids[keep], scores[keep]
+        if len(passage_ids) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            passage_ids, scores = passage_ids[best], scores[best]
+        order = np.lexsort((passage_ids, -scores))
+        return [(int(passage_ids[i]), float(scores[i])) for i in order]
+
+
+class VectorCache(BM25Cache):
+    """Opens (building on first use) the vector index of a document and keeps recent ones open"""
+
+    dir_name = INDEX_DIR_NAME
+    label = "vector index"
+
+    def _build(self, index_dir, passages, tokenize):
+        build_index(index_dir, passages, tokenize)
+
+    def _open_index(self, index_dir):
+        return VectorIndex(index_dir)
+
+
+def reciprocal_rank_fusion(rankings, top_k=5, k=60):
+    """Merge several [(id, score)] rankings into one by reciprocal rank
+
+    Each id scores sum(1 / (k + rank)) over the rankings it appears in, so
+    results found by more than one method rise to the top.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (passage_id, _) in enumerate(ranking, 1):
+            fused[passage_id] = fused.get(passage_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:top_k]
+
+
+# Singleton instance
+vector_cache = VectorCache()
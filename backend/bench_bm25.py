@@ -0,0 +1,133 @@
+"""
+Benchmark the persistent BM25 index against AdvancedLLM.rank_paragraphs
+
+Usage:
+    python bench_bm25.py [path/to/document.pdf] [--pages 1000] [--queries 20]
+
+Without a PDF a synthetic document with --pages pages is generated. The
+cache directory is a temporary one, so nothing in ./cache is touched.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_bm25_")
+os.environ["CACHE_DIR"] = os.path.join(WORK_DIR, "cache")
+
+# Add the parent directory to the path so we can import the app
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app.ai_service import ai_service
+from app.bm25_index import BM25Cache
+from app.chunking import chunk_pages
+
+
+def make_pdf(path, pages, seed=42):
+    """Write a synthetic PDF: Zipf-distributed words, a few paragraphs per page"""
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "shi", "po", "ve", "den", "mar", "tel"]
+    vocab = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(8000)})
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        paragraphs = []
+        for _ in range(rng.randint(3, 5)):
+            words = rng.choices(vocab, weights=weights, k=rng.randint(60, 110))
+            paragraphs.append(" ".join(words).capitalize() + ".")
+        page.insert_textbox(page.rect + (50, 50, -50, -50), "\n\n".join(paragraphs), fontsize=9)
+    doc.save(path)
+    return path
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?", help="PDF to index (default: synthetic)")
+    parser.add_argument("--pages", type=int, default=1000, help="Pages of the synthetic PDF")
+    parser.add_argument("--queries", type=int, default=20, help="Number of questions to time")
+    args = parser.parse_args()
+
+    pdf_path = args.pdf
+    if not pdf_path:
+        pdf_path = os.path.join(WORK_DIR, "synthetic.pdf")
+        print(f"Generating a {args.pages}-page PDF...")
+        make_pdf(pdf_path, args.pages)
+
+    llm = ai_service.advanced_llm
+    pages = list(ai_service.iter_content_pages(pdf_path))
+    chunks = chunk_pages(pages)
+    passages = [(chunk["page"], chunk["pages"][-1], chunk["text"]) for chunk in chunks]
+    paragraphs = [chunk["text"] for chunk in chunks]
+    print(f"{len(pages)} pages, {len(paragraphs)} passages")
+
+    rng = random.Random(7)
+    queries = []
+    while len(queries) < args.queries:
+        words = rng.choice(paragraphs).split()
+        start = rng.randrange(max(len(words) - 4, 1))
+        queries.append(" ".join(words[start:start + 4]))
+    query_tokens = [llm.preprocess(query) for query in queries]
+
+    # Current ranking: the first question tokenizes every paragraph and builds the in-memory index
+    _, rank_cold = timed(llm.rank_paragraphs, query_tokens[0], paragraphs)
+    rank_warm = [timed(llm.rank_paragraphs, tokens, paragraphs)[1] for tokens in query_tokens]
+
+    # BM25: built once at ingest, then opened from disk
+    _, bm25_build = timed(BM25Cache().get, pdf_path, llm.preprocess, lambda: iter(passages))
+    index, bm25_open = timed(BM25Cache().get, pdf_path, llm.preprocess, lambda: iter(passages))
+    bm25_queries = [timed(index.search, tokens, 5)[1] for tokens in query_tokens]
+
+    # Memory each approach keeps per document (timed separately, tracing slows allocation)
+    llm._index_cache.clear()
+    tracemalloc.start()
+    llm.rank_paragraphs(query_tokens[0], paragraphs)
+    rank_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    traced_index = BM25Cache().get(pdf_path, llm.preprocess, lambda: iter(passages))
+    for tokens in query_tokens:
+        traced_index.search(tokens, 5)
+    bm25_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    index_bytes = sum(
+        os.path.getsize(os.path.join(index.index_dir, name)) for name in os.listdir(index.index_dir)
+    )
+
+    def ms(seconds):
+        return f"{seconds * 1000:9.2f} ms"
+
+    print()
+    print("rank_paragraphs (in-memory ParagraphIndex)")
+    print(f"  first question (tokenize + index) {ms(rank_cold)}")
+    print(f"  later questions, mean             {ms(sum(rank_warm) / len(rank_warm))}")
+    print(f"  Python heap held                  {rank_memory / 1e6:9.2f} MB")
+    print("BM25 index (memory-mapped)")
+    print(f"  build at ingest                   {ms(bm25_build)}")
+    print(f"  open from disk                    {ms(bm25_open)}")
+    print(f"  query, mean                       {ms(sum(bm25_queries) / len(bm25_queries))}")
+    print(f"  Python heap held                  {bm25_memory / 1e6:9.2f} MB")
+    print(f"  on disk                           {index_bytes / 1e6:9.2f} MB")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
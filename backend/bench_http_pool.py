@@ -0,0 +1,126 @@
+"""
+Benchmark pooled versus per-call HTTP connections to an LLM endpoint
+
+Usage:
+    python bench_http_pool.py [--calls 200] [--threads 8] [--delay 0] [--tls]
+    python bench_http_pool.py --url http://127.0.0.1:8080/v1/chat/completions
+
+By default the virtual_api.py stand-in is served in-process on a free port
+over HTTP/1.1 (keep-alive), with its simulated 0.5 s processing time
+replaced by --delay so connection costs are not drowned out. --tls serves
+it over HTTPS with a throwaway certificate (needs the cryptography
+package), which adds the handshake a real provider costs. --url targets an
+already running server instead, e.g. "python virtual_api.py".
+
+Each call posts a chat completion request, first with a bare
+requests.post (a new connection per call, as the connector used to do)
+and then through the shared pool in app/http_pool.py, sequentially and
+from --threads threads.
+"""
+
+import os
+import sys
+import time
+import types
+import socket
+import argparse
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+
+# Add the parent directory to the path so we can import the app
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app.http_pool import get_session, pool_stats
+
+PAYLOAD = {
+    "model": "virtual",
+    "messages": [{"role": "user", "content": "What is the capital of France?"}],
+}
+
+
+def serve_virtual_api(delay, tls):
+    """Serve virtual_api.app on a free local port; return its completions URL"""
+    import virtual_api
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+    # The stand-in sleeps 0.5 s per request; use the requested delay instead
+    virtual_api.time = types.SimpleNamespace(sleep=lambda _: time.sleep(delay), time=time.time)
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = make_server(
+        "127.0.0.1", port, virtual_api.app, threaded=True,
+        request_handler=KeepAliveHandler, ssl_context="adhoc" if tls else None
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"{'https' if tls else 'http'}://127.0.0.1:{port}/v1/chat/completions"
+
+
+def bare_call(url):
+    response = requests.post(url, json=PAYLOAD, timeout=30, verify=False)
+    response.raise_for_status()
+
+
+def pooled_call(url):
+    response = get_session().post(url, json=PAYLOAD, timeout=30, verify=False)
+    response.raise_for_status()
+
+
+def run(call, url, calls, threads):
+    """Return (per-call latencies, wall time) for calls spread over threads"""
+    def timed_call(_):
+        start = time.perf_counter()
+        call(url)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if threads == 1:
+        latencies = [timed_call(i) for i in range(calls)]
+    else:
+        with ThreadPoolExecutor(threads) as executor:
+            latencies = list(executor.map(timed_call, range(calls)))
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Completions endpoint of a running server (default: serve virtual_api.py)")
+    parser.add_argument("--calls", type=int, default=200, help="Requests per run")
+    parser.add_argument("--threads", type=int, default=8, help="Threads for the concurrent runs")
+    parser.add_argument("--delay", type=float, default=0.0, help="Simulated processing time per request, seconds")
+    parser.add_argument("--tls", action="store_true", help="Serve the stand-in over HTTPS")
+    args = parser.parse_args()
+
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    url = args.url or serve_virtual_api(args.delay, args.tls)
+    print(f"Benchmarking {url}")
+
+    # Warm up the server and the shared pool
+    bare_call(url)
+    pooled_call(url)
+
+    def report(label, latencies, wall):
+        ordered = sorted(latencies)
+        print(f"  {label:24} mean {statistics.mean(latencies) * 1000:8.2f} ms"
+              f"  p50 {ordered[len(ordered) // 2] * 1000:8.2f} ms"
+              f"  p99 {ordered[int(len(ordered) * 0.99) - 1] * 1000:8.2f} ms"
+              f"  {len(latencies) / wall:8.1f} req/s")
+
+    for threads in (1, args.threads):
+        print(f"{args.calls} calls, {threads} thread{'s' if threads > 1 else ''}")
+        report("new connection per call", *run(bare_call, url, args.calls, threads))
+        report("shared pool", *run(pooled_call, url, args.calls, threads))
+
+    print(f"pool: {pool_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark AdvancedLLM.preprocess with and without its caches
+
+Usage:
+    python bench_preprocess.py [path/to/document.pdf] [--pages 300]
+
+Preprocesses every chunk of a document four ways:
+
+  - uncached: word_tokenize and WordNetLemmatizer on every token, as
+    preprocess did before the caches
+  - first pass: a fresh AdvancedLLM filling its lemma memo and token cache
+  - repeat pass: the same paragraphs again, served from the token cache
+  - restart: a new AdvancedLLM that loads the saved lemma memo but has an
+    empty token cache
+"""
+
+import argparse
+import os
+import shutil
+
+# Shares the temporary cache directory and synthetic document of the BM25 benchmark
+from bench_bm25 import WORK_DIR, make_pdf, timed
+
+from nltk.tokenize import word_tokenize
+
+from app.ai_service import AdvancedLLM, ai_service
+from app.chunking import chunk_pages
+
+
+def preprocess_uncached(llm, text):
+    tokens = word_tokenize(text.lower())
+    tokens = [t for t in tokens if t.isalnum() and t not in llm.stop_words]
+    return [llm.lemmatizer.lemmatize(t) for t in tokens]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?", help="PDF to preprocess (default: synthetic)")
+    parser.add_argument("--pages", type=int, default=300, help="Pages of the synthetic PDF")
+    args = parser.parse_args()
+
+    pdf_path = args.pdf
+    if not pdf_path:
+        pdf_path = os.path.join(WORK_DIR, "synthetic.pdf")
+        print(f"Generating a {args.pages}-page PDF...")
+        make_pdf(pdf_path, args.pages)
+
+    paragraphs = [chunk["text"] for chunk in chunk_pages(ai_service.iter_content_pages(pdf_path))]
+    print(f"{len(paragraphs)} paragraphs")
+
+    llm = AdvancedLLM()
+    expected, uncached = timed(lambda: [preprocess_uncached(llm, text) for text in paragraphs])
+    first, first_time = timed(lambda: [llm.preprocess(text) for text in paragraphs])
+    repeat, repeat_time = timed(lambda: [llm.preprocess(text) for text in paragraphs])
+    llm.save_lemmas()
+
+    restarted = AdvancedLLM()
+    restart, restart_time = timed(lambda: [restarted.preprocess(text) for text in paragraphs])
+
+    assert first == expected and repeat == expected and restart == expected, "cached tokens differ"
+
+    def row(label, seconds):
+        print(f"  {label:32} {seconds * 1000:9.2f} ms  {seconds * 1e6 / len(paragraphs):9.1f} us/paragraph"
+              f"  {uncached / seconds:7.1f}x")
+
+    print()
+    print(f"{llm.preprocess_stats()['lemmas']} distinct words")
+    row("uncached", uncached)
+    row("first pass (memo filling)", first_time)
+    row("repeat pass (token cache)", repeat_time)
+    row("restart (saved lemma memo)", restart_time)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
@@ -0,0 +1,179 @@
+"""
+Measure recall and latency of the offline vector index
+
+Usage:
+    python bench_vector_index.py [path/to/document.pdf] [--pages 1000] [--queries 200]
+
+Without a PDF a synthetic document is generated whose sections each draw
+most of their words from their own topic vocabulary, like the chapters of a
+real document. The cache directory is a temporary one. Reported:
+
+  - ANN recall@10: share of the exact top 10 (float32, every chunk scored)
+    that IVF search with int8 vectors returns, per nprobe
+  - hit@5: share of queries whose source chunk is in the top 5 for BM25,
+    vector search and their fusion; a query is a few words of one chunk
+  - topic precision@5 (synthetic document only): share of the top 5 from
+    the query's section when the query is topic words picked without
+    looking at any chunk, i.e. a paraphrase rather than a quote
+  - build time, query latency and on-disk size per vector type
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench_vectors_")
+os.environ["CACHE_DIR"] = os.path.join(WORK_DIR, "cache")
+
+# Add the parent directory to the path so we can import the app
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app.ai_service import ai_service
+from app.bm25_index import BM25Index, build_index as build_bm25
+from app.chunking import chunk_pages
+from app.vector_index import VECTOR_NPROBE, VectorIndex, build_index, reciprocal_rank_fusion
+
+TOPICS = 40
+
+
+def make_pdf(path, pages, seed=42):
+    """Write a synthetic PDF of TOPICS consecutive sections; return the topic words of each section"""
+    import fitz  # PyMuPDF
+
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "shi", "po", "ve", "den", "mar", "tel"]
+    vocab = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(8000)})
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+    topics = [rng.sample(vocab[500:], 150) for _ in range(TOPICS)]
+
+    doc = fitz.open()
+    for page_number in range(pages):
+        topic = topics[page_number * TOPICS // pages]
+        page = doc.new_page()
+        paragraphs = []
+        for _ in range(rng.randint(3, 5)):
+            words = [
+                rng.choice(topic) if rng.random() < 0.4 else rng.choices(vocab, weights=weights)[0]
+                for _ in range(rng.randint(60, 110))
+            ]
+            paragraphs.append(" ".join(words).capitalize() + ".")
+        page.insert_textbox(page.rect + (50, 50, -50, -50), "\n\n".join(paragraphs), fontsize=9)
+    doc.save(path)
+    return topics
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf", nargs="?", help="PDF to index (default: synthetic)")
+    parser.add_argument("--pages", type=int, default=1000, help="Pages of the synthetic PDF")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--words", type=int, default=6, help="Words per query")
+    args = parser.parse_args()
+
+    pdf_path = args.pdf
+    topics = None
+    if not pdf_path:
+        pdf_path = os.path.join(WORK_DIR, "synthetic.pdf")
+        print(f"Generating a {args.pages}-page PDF...")
+        topics = make_pdf(pdf_path, args.pages)
+
+    tokenize = ai_service.advanced_llm.preprocess
+    chunks = chunk_pages(ai_service.iter_content_pages(pdf_path))
+    passages = [(chunk["page"], chunk["pages"][-1], chunk["text"]) for chunk in chunks]
+    print(f"{len(chunks)} chunks")
+
+    indexes = {}
+    build_times = {}
+    for dtype in ("float32", "int8"):
+        index_dir = os.path.join(WORK_DIR, f"vectors_{dtype}")
+        _, build_times[dtype] = timed(build_index, index_dir, passages, tokenize, dtype=dtype)
+        indexes[dtype] = VectorIndex(index_dir)
+    build_bm25(os.path.join(WORK_DIR, "bm25"), passages, tokenize)
+    bm25 = BM25Index(os.path.join(WORK_DIR, "bm25"))
+
+    rng = random.Random(7)
+    queries = []
+    while len(queries) < args.queries:
+        source = rng.randrange(len(chunks))
+        words = chunks[source]["text"].split()
+        queries.append((source, tokenize(" ".join(rng.sample(words, min(args.words, len(words)))))))
+
+    # Exact float32 neighbours are the ground truth for the approximate int8 search
+    exact = indexes["float32"]
+    vectors = np.asarray(exact.vectors)
+    truths = []
+    for _, tokens in queries:
+        query_vector = exact.embed(tokens)
+        if query_vector is not None:
+            truths.append((tokens, set(np.argsort(-(vectors @ query_vector))[:10].tolist())))
+    recall = {}
+    for nprobe in sorted({1, 4, VECTOR_NPROBE, 16, 32}):
+        recall[nprobe] = np.mean([
+            len(truth & {passage_id for passage_id, _ in indexes["int8"].search(tokens, 10, nprobe=nprobe)}) / len(truth)
+            for tokens, truth in truths
+        ])
+
+    latencies = {dtype: [] for dtype in indexes}
+    hits = {"bm25": 0, "vector": 0, "fused": 0}
+    for source, tokens in queries:
+        keyword = bm25.search(tokens, 5)
+        for dtype, index in indexes.items():
+            semantic, elapsed = timed(index.search, tokens, 5)
+            latencies[dtype].append(elapsed)
+        hits["bm25"] += source in {passage_id for passage_id, _ in keyword}
+        hits["vector"] += source in {passage_id for passage_id, _ in semantic}
+        hits["fused"] += source in {passage_id for passage_id, _ in reciprocal_rank_fusion([keyword, semantic], 5)}
+
+    precision = None
+    if topics:
+        chunk_topics = [(chunk["page"] - 1) * TOPICS // args.pages for chunk in chunks]
+        precision = {"bm25": [], "vector": [], "fused": []}
+        for _ in range(args.queries):
+            topic = rng.randrange(TOPICS)
+            tokens = tokenize(" ".join(rng.sample(topics[topic], args.words)))
+            keyword = bm25.search(tokens, 5)
+            semantic = indexes["int8"].search(tokens, 5)
+            for name, ranked in (("bm25", keyword), ("vector", semantic),
+                                 ("fused", reciprocal_rank_fusion([keyword, semantic], 5))):
+                precision[name].append(np.mean([chunk_topics[passage_id] == topic for passage_id, _ in ranked] or [0]))
+
+    def ms(seconds):
+        return f"{seconds * 1000:9.2f} ms"
+
+    print()
+    print(f"{exact.dimensions} dimensions, {exact.num_lists} IVF lists")
+    for nprobe, value in recall.items():
+        print(f"ANN recall@10, nprobe {nprobe:<3}{' (default)' if nprobe == VECTOR_NPROBE else '          '}       {value:9.3f}")
+    for name, count in hits.items():
+        print(f"hit@5 {name:35} {count / len(queries):9.3f}")
+    if precision:
+        for name, values in precision.items():
+            print(f"topic precision@5 {name:23} {np.mean(values):9.3f}")
+    for dtype, index in indexes.items():
+        print(f"{dtype}")
+        print(f"  build                              {ms(build_times[dtype])}")
+        print(f"  query, mean                        {ms(sum(latencies[dtype]) / len(latencies[dtype]))}")
+        print(f"  on disk                            {directory_bytes(index.index_dir) / 1e6:9.2f} MB")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
@@ -27,10 +27,55 @@ CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
 # Max upload size
 MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 10485760))  # Default: 10MB
 
+# Derived-artifact cache (extracted text, indexes) keyed by document content hash
+CACHE_DIR = os.path.join(BASE_DIR, os.getenv("CACHE_DIR", "cache"))
+TEXT_CACHE_MEMORY_ITEMS = int(os.getenv("TEXT_CACHE_MEMORY_ITEMS", 32))  # Documents kept in memory
+TEXT_CACHE_MEMORY_MAX_CHARS = int(os.getenv("TEXT_CACHE_MEMORY_MAX_CHARS", 4000000))  # Larger documents stream from disk
+
+# Parallel page extraction
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 1))  # Process pool size
+PARALLEL_EXTRACT_MIN_PAGES = int(os.getenv("PARALLEL_EXTRACT_MIN_PAGES", 64))  # Smaller PDFs stay serial
+
+# Background ingestion started by /upload
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))  # Documents ingested concurrently
+INGEST_WAIT_TIMEOUT = int(os.getenv("INGEST_WAIT_TIMEOUT", 300))  # Seconds a request waits for in-flight ingestion
+
+# OCR for scanned pages (requires the Tesseract binary)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", 2))  # Concurrent Tesseract processes
+OCR_PAGE_TIMEOUT = int(os.getenv("OCR_PAGE_TIMEOUT", 60))  # Seconds per page
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+# Cross-page header/footer removal before text is sent to an LLM
+REMOVE_BOILERPLATE = os.getenv("REMOVE_BOILERPLATE", "True").lower() in ("true", "1", "t")
+
+# Chunking shared by chat retrieval, summaries, mind maps and simplification
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 300))  # Estimated tokens per chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 40))  # Tokens repeated between neighbouring chunks
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", 6000))  # Document text sent for summaries, mind maps and simplification
+
+# Offline semantic search: LSA vectors of the chunks, searched with an IVF index and fused with BM25
+VECTOR_SEARCH = os.getenv("VECTOR_SEARCH", "True").lower() in ("true", "1", "t")
+VECTOR_DIMENSIONS = int(os.getenv("VECTOR_DIMENSIONS", 128))  # Largest vector size
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "int8")  # "int8" or "float32" vector storage
+VECTOR_NPROBE = int(os.getenv("VECTOR_NPROBE", 8))  # IVF lists scored per query
+
+# Retrieval-augmented chat: send the passages most relevant to a message instead of the whole document
+CHAT_RETRIEVAL = os.getenv("CHAT_RETRIEVAL", "True").lower() in ("true", "1", "t")
+CHAT_TOP_K = int(os.getenv("CHAT_TOP_K", 8))  # Passages retrieved per message
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 3000))  # Token budget for the retrieved passages
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))  # Ranked passage lists kept for repeated questions
+PERSIST_LEMMAS = os.getenv("PERSIST_LEMMAS", "True").lower() in ("true", "1", "t")  # Keep the word -> lemma memo in CACHE_DIR across restarts
+
 # LLM Provider Config
 ENABLE_EXTERNAL_LLM = True  # Enable external LLM
 LLM_PROVIDER = "mistral"  # Use Mistral AI
 
+# LLM response cache: identical requests are answered from CACHE_DIR instead of the provider
+LLM_CACHE = os.getenv("LLM_CACHE", "True").lower() in ("true", "1", "t")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))  # Seconds a cached response stays valid
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000))  # Least recently used responses are evicted beyond this
+LLM_CACHE_PROMPT_TYPES = os.getenv("LLM_CACHE_PROMPT_TYPES", "summarization,simplification,mindmap").split(",")  # Add pdf_analysis to cache chat answers
+
 # Mistral Configuration
 MISTRAL_MODEL = "mistral-large-latest"  # Model to use with Mistral AI client
 
@@ -111,5 +156,10 @@ TEMPERATURE = 0.3  # Lower temperature for more focused, accurate responses
 HF_PROVIDER = "inference-api"
 HF_MODEL = "mistralai/Mistral-7B-Instruct-v0.1"
 
+# Pooled HTTP connections to LLM providers, shared across requests and threads
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 10))  # Hosts to keep connection pools for
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 20))  # Keep-alive connections per host
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "False").lower() in ("true", "1", "t")  # Wait for a free connection instead of exceeding the per-host limit
+
 # API Rate Limiting
 MAX_REQUESTS_PER_MINUTE = 20 
\ No newline at end of file
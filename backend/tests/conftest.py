@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Run from anywhere: the app package and config.py live in backend/
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Keep cached artifacts of test documents out of the real cache directory
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="pdf_intellect_test_cache_"))
@@ -0,0 +1,59 @@
+"""Superseded documents leave the corpus dictionary"""
+
+import pytest
+
+from app.corpus_search import CorpusIndex
+
+
+class FakeIndex:
+    """Stands in for a BM25Index: a passage count and (term, df) pairs"""
+
+    def __init__(self, terms, passages=3):
+        self._terms = terms
+        self.passages = passages
+
+    def __len__(self):
+        return self.passages
+
+    def terms(self):
+        return iter(self._terms.items())
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    return CorpusIndex(str(tmp_path / "corpus.sqlite3"))
+
+
+def document_frequencies(corpus):
+    return dict(corpus._connection().execute("SELECT term, documents FROM terms"))
+
+
+def test_reupload_drops_superseded_document(corpus):
+    corpus.add_document("a.pdf", "hash-a1", FakeIndex({"invoice": 2, "payment": 1}))
+    corpus.add_document("b.pdf", "hash-b", FakeIndex({"invoice": 1, "contract": 1}))
+    corpus.add_document("a.pdf", "hash-a2", FakeIndex({"invoice": 1, "refund": 1}))
+
+    assert document_frequencies(corpus) == {"invoice": 2, "contract": 1, "refund": 1}
+    assert corpus.stats()["documents"] == 2
+    assert corpus.search(["payment"]) == []
+    assert [filename for filename, _, _ in corpus.search(["refund"])] == ["a.pdf"]
+    orphaned = corpus._connection().execute(
+        "SELECT COUNT(*) FROM postings WHERE doc_id NOT IN (SELECT doc_id FROM documents)"
+    ).fetchone()[0]
+    assert orphaned == 0
+
+
+def test_document_kept_while_another_name_points_at_it(corpus):
+    corpus.add_document("a.pdf", "hash-a", FakeIndex({"invoice": 2}))
+    corpus.add_document("copy.pdf", "hash-a", FakeIndex({"invoice": 2}))
+    corpus.add_document("a.pdf", "hash-new", FakeIndex({"refund": 1}))
+
+    assert document_frequencies(corpus) == {"invoice": 1, "refund": 1}
+    assert [filename for filename, _, _ in corpus.search(["invoice"])] == ["copy.pdf"]
+
+
+def test_same_content_reregistered_counts_once(corpus):
+    corpus.add_document("a.pdf", "hash-a", FakeIndex({"invoice": 2}))
+    corpus.add_document("a.pdf", "hash-a", FakeIndex({"invoice": 2}))
+
+    assert document_frequencies(corpus) == {"invoice": 1}
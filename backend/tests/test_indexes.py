@@ -0,0 +1,68 @@
+"""Per-document indexes are rebuilt when their stored version is out of date"""
+
+import pytest
+
+from app import bm25_index, vector_index
+from app.bm25_index import BM25Cache
+from app.vector_index import VectorCache
+
+TOPICS = [
+    "payment terms invoice due within thirty days",
+    "delivery schedule shipping warehouse carrier",
+    "termination notice breach remedy cure period",
+    "confidential information disclosure recipient",
+]
+
+
+def passages():
+    for i in range(40):
+        yield i + 1, i + 1, f"{TOPICS[i % len(TOPICS)]} clause {i}"
+
+
+def tokenize(text):
+    return text.lower().split()
+
+
+@pytest.fixture
+def document(tmp_path, monkeypatch):
+    """A file whose indexes are written under tmp_path"""
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4 test document")
+    monkeypatch.setattr(bm25_index, "document_dir", lambda doc_hash: str(tmp_path / doc_hash))
+    return str(pdf_path)
+
+
+@pytest.mark.parametrize("module, cache_class", [(bm25_index, BM25Cache), (vector_index, VectorCache)])
+def test_index_rebuilt_after_version_bump(document, monkeypatch, module, cache_class):
+    cache = cache_class()
+    index = cache.get(document, tokenize, passages)
+    assert cache.builds == 1
+    assert len(index) == 40
+    old_version = index.meta["version"]
+    index_dir = index.index_dir
+
+    monkeypatch.setattr(module, "INDEX_VERSION", old_version + 1)
+
+    cache = cache_class()
+    rebuilt = cache.get(document, tokenize, passages)
+    assert cache.builds == 1
+    assert rebuilt.index_dir == index_dir
+    assert rebuilt.meta["version"] == old_version + 1
+    assert rebuilt.search(tokenize("payment invoice"), top_k=1)
+
+    # The published index now opens without another build
+    cache = cache_class()
+    cache.get(document, tokenize, passages)
+    assert cache.builds == 0
+
+
+def test_corrupt_index_rebuilt(document):
+    cache = BM25Cache()
+    index = cache.get(document, tokenize, passages)
+    with open(f"{index.index_dir}/meta.json", "w") as f:
+        f.write("{not json")
+
+    cache = BM25Cache()
+    rebuilt = cache.get(document, tokenize, passages)
+    assert cache.builds == 1
+    assert len(rebuilt) == 40
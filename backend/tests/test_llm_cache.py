@@ -0,0 +1,56 @@
+"""Streamed LLM responses are cached only when the stream completed"""
+
+import asyncio
+
+import pytest
+
+nltk = pytest.importorskip("nltk")
+try:
+    nltk.data.find("corpora/stopwords")
+    nltk.data.find("corpora/wordnet")
+except LookupError:
+    pytest.skip("NLTK stopwords/wordnet data not installed", allow_module_level=True)
+
+from app import ai_service as ai_service_module
+from app.ai_service import ExternalLLMConnector
+from app.llm_cache import LLMCache
+
+
+@pytest.fixture
+def connector(tmp_path, monkeypatch):
+    """An OpenAI connector with streaming patched out and an empty response cache"""
+    import config
+    monkeypatch.setattr(config, "ENABLE_EXTERNAL_LLM", True)
+    cache = LLMCache(str(tmp_path / "llm.sqlite3"), prompt_types=["summarization"])
+    monkeypatch.setattr(ai_service_module, "llm_cache", cache)
+    connector = ExternalLLMConnector(provider="openai")
+    connector.endpoint = "http://127.0.0.1:9/v1/chat/completions"
+    return connector
+
+
+def stream(connector):
+    async def collect():
+        return "".join([piece async for piece in connector.astream_response("Summarize", "Context", "summarization")])
+    return asyncio.run(collect())
+
+
+def test_complete_stream_is_cached(connector):
+    async def tokens(endpoint, headers, data):
+        for token in ("The whole ", "answer."):
+            yield token
+    connector._astream_sse = tokens
+
+    assert stream(connector) == "The whole answer."
+    assert ai_service_module.llm_cache.stats()["entries"] == 1
+    assert stream(connector) == "The whole answer."
+    assert ai_service_module.llm_cache.stats()["hits"] == 1
+
+
+def test_interrupted_stream_is_not_cached(connector):
+    async def broken(endpoint, headers, data):
+        yield "The first half "
+        raise ConnectionError("stream reset")
+    connector._astream_sse = broken
+
+    assert stream(connector) == "The first half "
+    assert ai_service_module.llm_cache.stats()["entries"] == 0
@@ -0,0 +1,80 @@
+"""A page-range request extracts only the requested pages"""
+
+import uuid
+
+import pytest
+
+nltk = pytest.importorskip("nltk")
+try:
+    nltk.data.find("corpora/stopwords")
+    nltk.data.find("corpora/wordnet")
+except LookupError:
+    pytest.skip("NLTK stopwords/wordnet data not installed", allow_module_level=True)
+
+import fitz
+
+from app import ai_service as ai_service_module
+from app.ai_service import ai_service
+from app.bm25_index import bm25_cache
+from app.doc_cache import text_cache
+from app.vector_index import vector_cache
+
+PAGES = 30
+HEADER = "ACME Corp Confidential Report"
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    """A new (never cached) PDF with a repeated header on every page"""
+    marker = uuid.uuid4().hex
+    doc = fitz.open()
+    for i in range(PAGES):
+        page = doc.new_page()
+        page.insert_text((50, 40), HEADER)
+        page.insert_text((50, 80), f"Page {i + 1} of document {marker}: clause {i} covers payment terms.")
+    path = str(tmp_path / "doc.pdf")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """Record the page numbers PyMuPDF extracts"""
+    pages = []
+    page_text = ai_service_module.page_text
+
+    def recording_page_text(page, extract_method):
+        pages.append(page.number + 1)
+        return page_text(page, extract_method)
+
+    monkeypatch.setattr(ai_service_module, "page_text", recording_page_text)
+    return pages
+
+
+def test_page_range_extracts_only_requested_pages(pdf_path, extracted):
+    content = list(ai_service.iter_content_pages(pdf_path, pages=[10, 11, 12]))
+
+    assert [page_number for page_number, _ in content] == [10, 11, 12]
+    assert sorted(extracted) == [10, 11, 12]
+    # Repeated lines are still removed, detected among the requested pages
+    assert all(HEADER not in text for _, text in content)
+    # A range leaves the whole-document text cache alone
+    assert text_cache.lookup(pdf_path, "hybrid") is None
+
+
+def test_page_range_text(pdf_path, extracted):
+    text = ai_service.extract_text(pdf_path, pages=[3], remove_boilerplate=True)
+
+    assert "clause 2 covers" in text
+    assert extracted == [3]
+
+
+def test_page_range_search_builds_no_index(pdf_path, extracted):
+    builds = bm25_cache.builds, vector_cache.builds
+    passages = ai_service.retrieve_passages(pdf_path, "clause 11 payment terms", pages=[11, 12])
+
+    assert passages and all(set(passage["pages"]) <= {11, 12} for passage in passages)
+    assert sorted(set(extracted)) == [11, 12]
+    assert (bm25_cache.builds, vector_cache.builds) == builds
+    assert bm25_cache.peek(pdf_path) is None
@@ -0,0 +1,59 @@
+"""ParagraphIndex scores match the original per-paragraph ranking"""
+
+import math
+from collections import Counter
+
+import pytest
+
+from app.paragraph_index import ParagraphIndex
+
+PARAGRAPHS = [
+    ["prepay", "termination", "fee", "waived"],
+    ["pay", "term", "net", "thirty", "day"],
+    ["late", "fee", "charged", "monthly", "fee"],
+    [],
+    ["invoice", "sent", "monthly", "pay", "termination", "notice"],
+]
+
+
+def _original_scores(query_tokens, paragraphs):
+    """The scoring of the original AdvancedLLM.rank_paragraphs, one paragraph at a time"""
+    scores = []
+    for para_tokens in paragraphs:
+        if not para_tokens:
+            scores.append(0)
+            continue
+        tfidf_sim = 0
+        for token in query_tokens:
+            if token in para_tokens:
+                tf = Counter(para_tokens)[token] / len(para_tokens)
+                df = sum(1 for doc in paragraphs if token in doc)
+                tfidf_sim += tf * math.log(len(paragraphs) / max(df, 1))
+        query_set, para_set = set(query_tokens), set(para_tokens)
+        jaccard = len(query_set & para_set) / len(query_set | para_set)
+        boost = 0
+        for bigram in (" ".join(query_tokens[i:i + 2]) for i in range(len(query_tokens) - 1)):
+            if bigram in " ".join(para_tokens):
+                boost += 0.2
+        scores.append(0.6 * tfidf_sim + 0.3 * jaccard + 0.1 * boost)
+    return scores
+
+
+@pytest.mark.parametrize("query", [
+    ["pay", "term"],
+    ["late", "fee", "fee"],
+    ["monthly", "pay", "term", "pay", "term"],
+    ["unknown", "word"],
+])
+def test_scores_match_original(query):
+    scores = ParagraphIndex(PARAGRAPHS).score_array(query)
+
+    assert scores == pytest.approx(_original_scores(query, PARAGRAPHS))
+
+
+def test_bigram_matches_inside_longer_tokens():
+    index = ParagraphIndex([["prepay", "termination"], ["pay", "later", "term"]])
+
+    # "pay term" is a substring of "prepay termination", though neither token matches
+    scores = index.score_array(["pay", "term"])
+    assert scores[0] == pytest.approx(0.1 * 0.2)
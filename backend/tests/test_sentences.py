@@ -0,0 +1,129 @@
+"""Sentences of a stored document are sliced from its offsets, not split again"""
+
+import os
+import uuid
+
+import pytest
+
+nltk = pytest.importorskip("nltk")
+try:
+    nltk.data.find("corpora/stopwords")
+    nltk.data.find("corpora/wordnet")
+except LookupError:
+    pytest.skip("NLTK stopwords/wordnet data not installed", allow_module_level=True)
+
+import fitz
+
+import config
+from app import ai_service as ai_service_module
+from app import sentence_index
+from app.ai_service import ai_service
+
+PAGES = 12
+
+
+@pytest.fixture
+def pdf_path(tmp_path, monkeypatch):
+    """An ingested (sentence-split) PDF in the upload directory, after a restart"""
+    marker = uuid.uuid4().hex
+    doc = fitz.open()
+    for i in range(PAGES):
+        page = doc.new_page()
+        page.insert_text((50, 80), f"Clause {i} of document {marker} covers payment terms. It applies to invoice {i}.")
+        page.insert_text((50, 110), f"Late fees for clause {i} are charged monthly. Refunds take {i + 1} weeks.")
+    os.makedirs(ai_service.upload_dir, exist_ok=True)
+    path = os.path.join(ai_service.upload_dir, f"sentences_{marker}.pdf")
+    doc.save(path)
+    doc.close()
+
+    assert ai_service.sentence_index(path) is not None
+
+    # A restart forgets every in-memory index and paragraph
+    monkeypatch.setattr(sentence_index, "_indexes", type(sentence_index._indexes)())
+    monkeypatch.setattr(sentence_index, "_spans", type(sentence_index._spans)())
+    yield path
+    os.remove(path)
+
+
+@pytest.fixture
+def no_splitting(monkeypatch):
+    def tokenize(paragraph):
+        raise AssertionError(f"split again: {paragraph[:40]!r}")
+
+    monkeypatch.setattr(sentence_index, "_tokenize_paragraph", tokenize)
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """Record the page numbers PyMuPDF extracts"""
+    pages = []
+    page_text = ai_service_module.page_text
+
+    def recording_page_text(page, extract_method):
+        pages.append(page.number + 1)
+        return page_text(page, extract_method)
+
+    monkeypatch.setattr(ai_service_module, "page_text", recording_page_text)
+    return pages
+
+
+def test_page_sentences_sliced_from_stored_offsets(pdf_path, no_splitting):
+    before = sentence_index.sentence_stats()["pages_sliced"]
+    (page_number, sentences), = ai_service.page_sentences(pdf_path, pages=[4])
+
+    assert page_number == 4
+    assert sentences[0].startswith("Clause 3 of document")
+    assert sentences[-1] == "Refunds take 4 weeks."
+    assert sentence_index.sentence_stats()["pages_sliced"] == before + 1
+
+
+def test_passage_sentences_without_splitting(pdf_path, no_splitting):
+    chunks = ai_service.chunks(pdf_path)
+    pieces = [(chunk["page"], chunk["text"]) for chunk in chunks]
+    sentences = ai_service.document_sentences(pdf_path, pieces)
+
+    assert len(sentences) == len(chunks)
+    assert all(sentence in chunk["text"] for chunk, found in zip(chunks, sentences) for sentence in found)
+    assert "Late fees for clause 7 are charged monthly." in [s for found in sentences for s in found]
+
+
+def test_local_answers_without_splitting(pdf_path, no_splitting, monkeypatch):
+    monkeypatch.setattr(config, "ENABLE_EXTERNAL_LLM", False)
+
+    assert ai_service.summarize(os.path.basename(pdf_path))
+    assert ai_service.simplify(pdf_path=pdf_path)
+    assert "children" in ai_service.create_mindmap(pdf_path)
+    assert ai_service.chat("When are late fees charged?", pdf_path)
+
+
+def test_page_range_splits_only_requested_pages(tmp_path, extracted):
+    doc = fitz.open()
+    for i in range(PAGES):
+        doc.new_page().insert_text((50, 80), f"Page {i + 1} {uuid.uuid4().hex}. Second sentence here.")
+    path = str(tmp_path / "fresh.pdf")
+    doc.save(path)
+    doc.close()
+
+    pages = ai_service.page_sentences(path, pages=[5, 6])
+
+    assert [page_number for page_number, _ in pages] == [5, 6]
+    assert sorted(set(extracted)) == [5, 6]
+    assert sentence_index.stored_sentence_index(path, "hybrid") is None
+
+
+def test_changed_page_text_is_split_again():
+    index = sentence_index.build_sentence_index([(1, "One sentence. Two sentences.")])
+    before = sentence_index.sentence_stats()["pages_split"]
+
+    assert index.page_sentences(1, "One sentence. Two sentences.") == ["One sentence.", "Two sentences."]
+    assert index.page_sentences(1, "Different text now. Still two.") == ["Different text now.", "Still two."]
+    assert sentence_index.sentence_stats()["pages_split"] == before + 1
+
+
+def test_mock_provider_without_splitting(pdf_path, no_splitting, monkeypatch):
+    monkeypatch.setattr(config, "ENABLE_EXTERNAL_LLM", True)
+    monkeypatch.setattr(ai_service.external_llm, "provider", "mock")
+
+    assert ai_service.summarize(os.path.basename(pdf_path))
+    assert ai_service.simplify(pdf_path=pdf_path)
+    assert ai_service.create_mindmap(pdf_path)
@@ -0,0 +1,150 @@
+"""Concurrent identical calls share one run"""
+
+import asyncio
+import time
+import threading
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_async_calls_run_once():
+    flight = SingleFlight()
+    runs = []
+
+    async def compute():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "summary"
+
+    async def main():
+        return await asyncio.gather(*(flight.ado(("summarize", "hash", "standard"), compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["summary"] * 5
+    assert len(runs) == 1
+    stats = flight.stats()
+    assert stats["operations"]["summarize"] == {"calls": 5, "executed": 1, "collapsed": 4}
+    assert stats["in_flight"] == 0
+
+
+def test_calls_after_completion_run_again():
+    flight = SingleFlight()
+    runs = []
+
+    async def compute():
+        runs.append(1)
+        return len(runs)
+
+    async def main():
+        first = await flight.ado(("mindmap", "hash"), compute)
+        second = await flight.ado(("mindmap", "hash"), compute)
+        return first, second
+
+    assert asyncio.run(main()) == (1, 2)
+
+
+def test_async_error_shared_with_followers():
+    flight = SingleFlight()
+    runs = []
+
+    async def compute():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        raise ValueError("no text")
+
+    async def main():
+        return await asyncio.gather(
+            *(flight.ado(("simplify", "hash"), compute) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert len(runs) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "summary"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.ado(("summarize", "hash"), compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.ado(("summarize", "hash"), compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "summary"
+
+
+def test_threads_share_one_run():
+    flight = SingleFlight()
+    runs = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        runs.append(1)
+        started.set()
+        release.wait(5)
+        return "mindmap"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do(("mindmap", "hash"), compute)))
+    leader.start()
+    started.wait(5)
+    followers = [
+        threading.Thread(target=lambda: results.append(flight.do(("mindmap", "hash"), compute)))
+        for _ in range(3)
+    ]
+    for thread in followers:
+        thread.start()
+    # Followers register before the leader finishes
+    while flight.stats()["operations"]["mindmap"]["calls"] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ["mindmap"] * 4
+    assert len(runs) == 1
+    assert flight.stats()["operations"]["mindmap"]["collapsed"] == 3
+
+
+def test_thread_error_shared():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        raise FileNotFoundError("gone.pdf")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do(("summarize", "hash"), compute)
+        except FileNotFoundError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    while flight.stats()["operations"]["summarize"]["calls"] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 3
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,86 @@
+"""A damaged disk entry of the text cache is a miss, not the document text"""
+
+import os
+import uuid
+
+import pytest
+
+from app.doc_cache import TextCache, content_hash
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / "document.pdf"
+    path.write_bytes(uuid.uuid4().bytes)
+    return str(path)
+
+
+def _store(cache, document, pages):
+    writer = cache.writer(document, "hybrid")
+    try:
+        for page_number, text in pages:
+            writer.add(page_number, text)
+        writer.commit()
+    finally:
+        writer.close()
+    cache.clear_memory()
+    return cache._disk_path(*writer.key)
+
+
+def test_disk_entry_streams_pages(document):
+    cache = TextCache()
+    _store(cache, document, [(1, "First page."), (2, "Second page.")])
+
+    assert list(cache.lookup(document, "hybrid", [2])) == [(2, "Second page.")]
+    assert cache.stats()["disk_hits"] == 1
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: b"",
+    lambda data: b"not a page store" + data[16:],
+    lambda data: data[:-1],
+    lambda data: data[:12] + data[20:],
+])
+def test_corrupt_disk_entry_is_a_miss(document, damage):
+    cache = TextCache()
+    disk_path = _store(cache, document, [(1, "First page."), (2, "Second page.")])
+    with open(disk_path, "rb") as f:
+        data = f.read()
+    with open(disk_path, "wb") as f:
+        f.write(damage(data))
+
+    assert cache.lookup(document, "hybrid") is None
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["disk_hits"] == 0
+    assert not os.path.exists(disk_path)
+
+    # The re-extracted pages replace the removed entry
+    _store(cache, document, [(1, "First page."), (2, "Second page.")])
+    assert list(cache.lookup(document, "hybrid")) == [(1, "First page."), (2, "Second page.")]
+
+
+def test_corrupt_disk_entry_is_extracted_again(tmp_path):
+    nltk = pytest.importorskip("nltk")
+    try:
+        nltk.data.find("corpora/stopwords")
+        nltk.data.find("corpora/wordnet")
+    except LookupError:
+        pytest.skip("NLTK stopwords/wordnet data not installed")
+    import fitz
+    from app.ai_service import ai_service
+    from app.doc_cache import text_cache
+
+    doc = fitz.open()
+    doc.new_page().insert_text((50, 80), f"Cached text {uuid.uuid4().hex}.")
+    path = str(tmp_path / "cached.pdf")
+    doc.save(path)
+    doc.close()
+    text = ai_service.extract_text(path)
+
+    text_cache.clear_memory()
+    disk_path = text_cache._disk_path(content_hash(path), "hybrid")
+    with open(disk_path, "wb") as f:
+        f.write(b"corrupt")
+
+    assert ai_service.extract_text(path) == text
+    assert "Cached text" in text